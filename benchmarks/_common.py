@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+_common.py.
+
+Description
+-----------
+Helpers shared by the riparian connectivity benchmark scripts.
+
+The riparian connectivity script's filename contains a hyphen, so it cannot be
+imported with a regular import statement. load_script() loads it as a module instead.
+"""
+
+from contextlib import contextmanager
+import importlib.util
+import os
+from pathlib import Path
+import sys
+import time
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+SCRIPT_PATH = REPO_DIR / "riparian-connectivity.py"
+SAMPLE_RESULTS_DIR = REPO_DIR / "example" / "sample_results"
+
+
+def load_script():
+    """Load the riparian-connectivity.py script as a module."""
+    spec = importlib.util.spec_from_file_location("riparian_connectivity", SCRIPT_PATH)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def time_call(func, repeat=3, **kwargs):
+    """
+    Call a function repeatedly and time it.
+
+    Parameters
+    ----------
+    func : callable
+        The function to time.
+
+    repeat : int, optional
+        The number of times to call the function. The default is 3.
+
+    **kwargs
+        Keyword arguments passed to the function.
+
+    Returns
+    -------
+    timings : list of float
+        The wall time in seconds of each call.
+
+    result : object
+        The return value of the last call.
+    """
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(**kwargs)
+        timings.append(time.perf_counter() - start)
+    return timings, result
+
+
+@contextmanager
+def working_directory(path):
+    """Temporarily change the working directory to path."""
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield path
+    finally:
+        os.chdir(previous)
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+bench_classification.py.
+
+Description
+-----------
+Benchmark the histogram, Otsu threshold and classification of an NDVI image:
+
+    legacy
+        The three passes of the original script: ndvi_da.plot.hist(bins=50), Otsu
+        on a zero-filled copy of the whole image, then the original classification
+        with its boolean and int64 intermediate arrays.
+
+    fused
+        classify_ndvi_windowed(), which reads each block of the NDVI image once,
+        counts it into the histogram and writes its uint8 classes, followed by the
+        Otsu threshold and plot from that histogram.
+
+Peak memory is the peak of the allocations traced by tracemalloc, which include
+NumPy arrays but not the buffers allocated by GDAL.
+
+If no NDVI image is given, a synthetic one of --size x --size pixels is written to
+a temporary directory, with nan pixels outside a diagonal band standing in for the
+riparian buffer.
+
+Usage
+-----
+python benchmarks/bench_classification.py [--ndvi PATH] [--size N] [--threshold T]
+    [--repeat N]
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+import matplotlib.pyplot as plt
+import numpy as np
+import rasterio
+import skimage
+
+from _common import load_script, working_directory
+
+
+def write_synthetic_ndvi(path, size, seed=0):
+    """Write a smooth random NDVI image with nan pixels outside a diagonal band."""
+    rng = np.random.default_rng(seed)
+    coarse = rng.uniform(-0.2, 0.9, (size // 64 + 2, size // 64 + 2))
+    ndvi = np.kron(coarse, np.ones((64, 64)))[:size, :size]
+    ndvi += rng.normal(0, 0.05, ndvi.shape)
+    rows, cols = np.indices(ndvi.shape)
+    ndvi[np.abs(rows - cols) > size // 8] = np.nan
+
+    profile = {
+        "driver": "GTiff",
+        "height": size,
+        "width": size,
+        "count": 1,
+        "dtype": "float64",
+        "crs": "EPSG:32618",
+        "transform": rasterio.transform.from_origin(500000, 5000000, 10, 10),
+        "nodata": np.nan,
+    }
+    with rasterio.open(path, "w", **profile) as dst:
+        dst.write(np.clip(ndvi, -1, 1), 1)
+
+
+def legacy(rc, ndvi_path, threshold, log_filepath):
+    """Run the histogram, Otsu and classification passes of the original script."""
+    ndvi_da = rc.open_ndvi(ndvi_path).load()
+
+    ndvi_da.plot.hist(bins=50, figsize=(10, 10))
+    plt.savefig("3-riparian_buffer-NDVI_histogram.png")
+    plt.close()
+
+    _ndvi_da = ndvi_da.copy()
+    _ndvi_da.values[np.isnan(_ndvi_da.values)] = 0
+    otsu_threshold = float(skimage.filters.threshold_otsu(_ndvi_da.values))
+
+    # The original classification, kept here so the baseline does not follow the
+    #   script's classification
+    veg_da = ndvi_da >= threshold
+    veg_da.values = np.where(veg_da.values == True, 1, 0)
+    veg_da = veg_da.astype("uint8")
+    not_veg_da = ndvi_da < threshold
+    not_veg_da.values = np.where(not_veg_da.values == True, 2, 0)
+    not_veg_da = not_veg_da.astype("uint8")
+    riparian_da = veg_da + not_veg_da
+    riparian_da.rio.to_raster("3-riparian_buffer-vegetation.tiff")
+    return otsu_threshold, riparian_da.values
+
+
+def fused(rc, ndvi_path, threshold, log_filepath):
+    """Run the single blockwise pass followed by the Otsu threshold and plot."""
+    riparian_da, histogram = rc.classify_ndvi_windowed(
+        ndvi_path, threshold, log_filepath
+    )
+    otsu_threshold = rc.otsu_from_histogram(*histogram)
+    rc.select_ndvi_threshold(
+        rc.open_ndvi(ndvi_path), log_filepath, threshold, histogram=histogram
+    )
+    return otsu_threshold, riparian_da.values
+
+
+def measure(func, repeat, **kwargs):
+    """Return the wall times, peak traced memory and result of repeated calls."""
+    timings, peaks = [], []
+    for _ in range(repeat):
+        tracemalloc.start()
+        start = time.perf_counter()
+        result = func(**kwargs)
+        timings.append(time.perf_counter() - start)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return timings, max(peaks), result
+
+
+def main():
+    """Time both classification paths and check that their results agree."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--ndvi", default=None, help="NDVI image to classify.")
+    parser.add_argument(
+        "--size", type=int, default=4096, help="Size of the synthetic NDVI image."
+    )
+    parser.add_argument(
+        "--threshold", type=float, default=0.3, help="NDVI threshold to classify with."
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per path.")
+    args = parser.parse_args()
+
+    rc = load_script()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir, working_directory(tmp_dir):
+        ndvi_path = os.path.abspath(args.ndvi) if args.ndvi else "ndvi.tiff"
+        if not args.ndvi:
+            write_synthetic_ndvi(ndvi_path, args.size)
+        print(f"NDVI image: {ndvi_path}")
+
+        log_filepath = "benchmark-log.txt"
+        for name, func in [("legacy", legacy), ("fused", fused)]:
+            timings, peak, result = measure(
+                func,
+                args.repeat,
+                rc=rc,
+                ndvi_path=ndvi_path,
+                threshold=args.threshold,
+                log_filepath=log_filepath,
+            )
+            results[name] = result
+            print(
+                f"{name:>7}: median {statistics.median(timings):.3f} s,"
+                f" min {min(timings):.3f} s, peak memory {peak / 2**20:.1f} MB"
+                f" over {args.repeat} runs"
+            )
+
+    # Both paths must classify the pixels identically
+    assert np.array_equal(results["legacy"][1], results["fused"][1])
+    print(
+        "Classified images match. Otsu threshold:"
+        f" legacy {results['legacy'][0]:.4f} (nodata counted as 0),"
+        f" fused {results['fused'][0]:.4f} (valid pixels only)"
+    )
+
+
+if __name__ == "__main__":
+    main()
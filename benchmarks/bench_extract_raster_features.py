@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+bench_extract_raster_features.py.
+
+Description
+-----------
+Benchmark the two polygonization methods of extract_raster_features():
+
+    shapely
+        Builds the polygons straight from the ring coordinates returned by
+        rasterio.features.shapes() with the vectorized Shapely 2 constructors.
+
+    joblib
+        Converts each shape to a string and parses it back with ast.literal_eval()
+        and shapely.geometry.shape() across a pool of processes.
+
+By default the classified riparian buffer raster of the sample watershed
+(example/sample_results/3-riparian_buffer-vegetation.tiff) is used.
+
+Usage
+-----
+python benchmarks/bench_extract_raster_features.py [--raster PATH] [--repeat N]
+"""
+
+import argparse
+import statistics
+import tempfile
+
+import rioxarray as rxr
+
+from _common import SAMPLE_RESULTS_DIR, load_script, time_call, working_directory
+
+
+def main():
+    """Time both polygonization methods and check that their results agree."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument(
+        "--raster",
+        default=str(SAMPLE_RESULTS_DIR / "3-riparian_buffer-vegetation.tiff"),
+        help="Classified riparian buffer raster to polygonize.",
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per method.")
+    args = parser.parse_args()
+
+    rc = load_script()
+    riparian_da = rxr.open_rasterio(args.raster).squeeze("band", drop=True).load()
+    print(f"Raster: {args.raster} ({riparian_da.shape[0]} x {riparian_da.shape[1]} px)")
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir, working_directory(tmp_dir):
+        log_filepath = "benchmark-log.txt"
+        for method in ["joblib", "shapely"]:
+            timings, riparian_dict = time_call(
+                rc.extract_raster_features,
+                repeat=args.repeat,
+                da=riparian_da,
+                log_filepath=log_filepath,
+                method=method,
+            )
+            results[method] = riparian_dict
+            print(
+                f"{method:>8}: median {statistics.median(timings):.3f} s,"
+                f" min {min(timings):.3f} s over {args.repeat} runs"
+            )
+
+    # The two methods must produce the same features
+    for key in ["vegetation_gdf", "not_vegetation_gdf", "riparian_buffer_gdf"]:
+        joblib_gdf = results["joblib"][key]
+        shapely_gdf = results["shapely"][key]
+        assert len(joblib_gdf) == len(shapely_gdf), key
+        assert abs(joblib_gdf.area.sum() - shapely_gdf.area.sum()) < 1e-6, key
+    print("Results of both methods match.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+bench_import_time.py.
+
+Description
+-----------
+Benchmark how long the riparian connectivity script takes to start:
+
+    load
+        A fresh interpreter loading the script as a module, which is what every
+        batch worker process pays before its first watershed.
+
+    --help
+        A fresh interpreter running 'python riparian-connectivity.py --help'.
+
+Each is timed over --repeat fresh interpreters. The modules with the longest
+cumulative import times, from 'python -X importtime', are then listed, and the
+slow optional modules (matplotlib, folium, skimage and joblib) that loading the
+script imported are reported. These are only imported by the stages that use them.
+
+Usage
+-----
+python benchmarks/bench_import_time.py [--repeat N] [--top N]
+"""
+
+import argparse
+from collections import defaultdict
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+from _common import REPO_DIR, SCRIPT_PATH
+
+LAZY_MODULES = ["matplotlib", "folium", "skimage", "joblib"]
+
+LOAD_CODE = f"""
+import json, sys
+sys.path.insert(0, {str(REPO_DIR / "benchmarks")!r})
+from _common import load_script
+load_script()
+print(json.dumps([m for m in {LAZY_MODULES!r} if m in sys.modules]))
+"""
+
+
+def time_command(command, repeat):
+    """Return the wall times of running command in fresh interpreters."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, check=True, capture_output=True, cwd=REPO_DIR)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def import_times(top):
+    """Return the top-level packages with the longest cumulative import times."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", LOAD_CODE],
+        check=True,
+        capture_output=True,
+        text=True,
+        cwd=REPO_DIR,
+    )
+    # Lines look like 'import time:   self [us] | cumulative | imported package'
+    cumulative = defaultdict(int)
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, total, name = line[len("import time:") :].split("|")
+        # Only count top-level imports, which include their submodules
+        if not name.startswith("  "):
+            cumulative[name.strip().split(".")[0]] += int(total)
+    loaded = json.loads(result.stdout.strip().splitlines()[-1])
+    return sorted(cumulative.items(), key=lambda item: -item[1])[:top], loaded
+
+
+def main():
+    """Time the start of the script and list its slowest imports."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per command.")
+    parser.add_argument("--top", type=int, default=10, help="Imports to list.")
+    args = parser.parse_args()
+
+    commands = {
+        "load": [sys.executable, "-c", LOAD_CODE],
+        "--help": [sys.executable, str(SCRIPT_PATH), "--help"],
+    }
+    for name, command in commands.items():
+        timings = time_command(command, args.repeat)
+        print(
+            f"{name:>6}: median {statistics.median(timings):.3f} s,"
+            f" min {min(timings):.3f} s over {args.repeat} runs"
+        )
+
+    slowest, loaded = import_times(args.top)
+    print("\nSlowest top-level imports (cumulative):")
+    for name, total in slowest:
+        print(f"{name:>20}: {total / 1e6:.3f} s")
+    print(
+        "\nOptional modules imported by loading the script:"
+        f" {', '.join(loaded) if loaded else 'none'}"
+    )
+
+
+if __name__ == "__main__":
+    main()
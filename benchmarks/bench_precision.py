@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+bench_precision.py.
+
+Description
+-----------
+Check the statistics of the float32 and int16 NDVI precisions against float64.
+
+A synthetic watershed is generated with synthetic.py and its riparian buffer is
+created with vector_operations(). For every precision of NDVI_PRECISIONS, the NDVI
+image is created with create_ndvi_windowed(), classified with
+classify_ndvi_windowed() and measured with riparian_raster_stats(). The NDVI values,
+classes, areas, feature counts and perimeters are then compared with float64:
+
+    NDVI values
+        Differ by at most 1e-7 with float32 and by at most half of NDVI_INT16_SCALE
+        (plus the float32 error it is computed with) with int16.
+
+    Classes
+        Only pixels whose float64 NDVI is within that tolerance of the threshold
+        can change class.
+
+    Areas, feature counts and perimeters
+        Each pixel that changes class changes the vegetation and not-vegetation
+        areas by one pixel, their feature counts by at most 3 (it can join or split
+        up to four 4-connected features) and their perimeters by at most 4 pixel
+        edges. The riparian buffer measures are identical.
+
+The script exits with an error if any difference is beyond these bounds.
+
+Usage
+-----
+python benchmarks/bench_precision.py [--area KM2] [--pixel-size M] [--threshold T]
+    [--buffer-width M] [--seed N]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from _common import load_script, working_directory
+from synthetic import generate_watershed
+
+# Largest difference from the float64 NDVI value allowed for each precision
+FLOAT32_TOLERANCE = 1e-7
+
+# The measures of each class, and the number of pixels one changed pixel can move
+#   them by: areas by 1 pixel, feature counts by 3 and perimeters by 4 pixel edges
+CLASS_MEASURES = {
+    "Vegetation area (km2)": "area",
+    "Not-vegetation area (km2)": "area",
+    "Number of vegetation features": "features",
+    "Number of not-vegetation features": "features",
+    "Perimeter of vegetation features (km)": "perimeter",
+    "Perimeter of not-vegetation features (km)": "perimeter",
+}
+RIPARIAN_MEASURES = [
+    "Riparian buffer area (km2)",
+    "Number of riparian buffer features",
+    "Perimeter of riparian buffer (km)",
+]
+
+
+def run_precision(rc, precision, imagery_path, riparian_buff_geom, data_dict, args):
+    """Create, classify and measure the NDVI image in one precision."""
+    os.makedirs(precision)
+    with working_directory(precision), contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        ndvi_da = rc.create_ndvi_windowed(
+            imagery_path=imagery_path,
+            riparian_buff_geom=riparian_buff_geom,
+            log_filepath="benchmark-log.txt",
+            precision=precision,
+        )
+        riparian_da, _ = rc.classify_ndvi_windowed(
+            "2-riparian_buffer-NDVI.tiff", args.threshold, "benchmark-log.txt"
+        )
+        stats_df = rc.riparian_raster_stats(
+            watershed_name=data_dict["watershed_name"],
+            buffer_width=data_dict["buffer_width"],
+            ndvi_threshold=args.threshold,
+            watershed_gdf=data_dict["watershed"],
+            riparian_da=riparian_da,
+            log_filepath="benchmark-log.txt",
+        )
+        seconds = time.perf_counter() - start
+        ndvi = ndvi_da.values.astype("float64")
+        classes = riparian_da.values
+        disk_mb = os.path.getsize("2-riparian_buffer-NDVI.tiff") / 2**20
+    return ndvi, classes, stats_df.iloc[0], seconds, disk_mb
+
+
+def compare(reference, result, tolerance, threshold, pixel_width, pixel_height):
+    """Compare a precision's results with float64 and list the failed checks."""
+    ndvi_64, classes_64, stats_64 = reference
+    ndvi, classes, stats = result
+    failures = []
+
+    valid = ~np.isnan(ndvi_64)
+    if not np.array_equal(valid, ~np.isnan(ndvi)):
+        failures.append("the NDVI images have different nodata pixels")
+    ndvi_error = float(np.max(np.abs(ndvi[valid] - ndvi_64[valid]), initial=0))
+    if ndvi_error > tolerance:
+        failures.append(f"NDVI differs by {ndvi_error:.3g} > {tolerance:.3g}")
+
+    near = valid & (np.abs(ndvi_64 - threshold) <= tolerance)
+    changed = classes != classes_64
+    if np.any(changed & ~near):
+        failures.append(
+            f"{int(np.sum(changed & ~near))} pixels away from the threshold changed"
+            " class"
+        )
+
+    n_changed = int(changed.sum())
+    bounds = {
+        "area": n_changed * pixel_width * pixel_height / 1_000_000,
+        "features": 3 * n_changed,
+        "perimeter": 4 * n_changed * max(pixel_width, pixel_height) / 1000,
+    }
+    differences = {}
+    for column, measure in CLASS_MEASURES.items():
+        differences[column] = abs(stats[column] - stats_64[column])
+        if differences[column] > bounds[measure] + 1e-9:
+            failures.append(
+                f"{column} differs by {differences[column]:g} >"
+                f" {bounds[measure]:g} for {n_changed} changed pixels"
+            )
+    for column in RIPARIAN_MEASURES:
+        if not np.isclose(stats[column], stats_64[column]):
+            failures.append(f"{column} differs")
+
+    summary = {
+        "max NDVI error": ndvi_error,
+        "pixels near threshold": int(near.sum()),
+        "pixels changed class": n_changed,
+        **{f"|d| {column}": value for column, value in differences.items()},
+    }
+    return summary, failures
+
+
+def main():
+    """Run every precision and check the results against float64."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument(
+        "--area", type=float, default=10, help="Watershed area in km2 (default 10)."
+    )
+    parser.add_argument(
+        "--pixel-size", type=float, default=10, help="Pixel size in m (default 10)."
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.3,
+        help="NDVI threshold to classify with (default 0.3).",
+    )
+    parser.add_argument(
+        "--buffer-width",
+        type=float,
+        default=30,
+        help="Riparian buffer width in m (default 30).",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    args = parser.parse_args()
+
+    rc = load_script()
+    tolerances = {
+        "float64": 0,
+        "float32": FLOAT32_TOLERANCE,
+        "int16": rc.NDVI_INT16_SCALE / 2 + FLOAT32_TOLERANCE,
+    }
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir, working_directory(tmp_dir):
+        paths = generate_watershed(
+            os.path.join(tmp_dir, "inputs"),
+            args.area,
+            pixel_size=args.pixel_size,
+            seed=args.seed,
+        )
+        with contextlib.redirect_stdout(io.StringIO()):
+            data_dict = rc.load_data(
+                watershed_name="synthetic",
+                watershed_path=paths["watershed"],
+                waterbodies_path=paths["waterbodies"],
+                watercourses_path=paths["watercourses"],
+                imagery_path=paths["imagery"],
+                buffer_width=args.buffer_width,
+                output_dir=os.path.join(tmp_dir, "results"),
+            )
+            riparian_buff_geom = rc.vector_operations(
+                watershed_gdf=data_dict["watershed"],
+                waterbodies_gdf=data_dict["waterbodies_path"],
+                watercourses_gdf=data_dict["watercourses_path"],
+                imagery_crs=data_dict["imagery_crs"],
+                buffer_width=data_dict["buffer_width"],
+                log_filepath=data_dict["log_filepath"],
+            )
+        for precision in rc.NDVI_PRECISIONS:
+            results[precision] = run_precision(
+                rc, precision, paths["imagery"], riparian_buff_geom, data_dict, args
+            )
+
+    pixel_width = pixel_height = args.pixel_size
+    rows, failed = {}, False
+    for precision, (ndvi, classes, stats, seconds, disk_mb) in results.items():
+        summary, failures = compare(
+            results["float64"][:3],
+            (ndvi, classes, stats),
+            tolerances[precision],
+            args.threshold,
+            pixel_width,
+            pixel_height,
+        )
+        rows[precision] = {"seconds": seconds, "NDVI image (MB)": disk_mb, **summary}
+        for failure in failures:
+            print(f"{precision}: {failure}")
+        failed |= bool(failures)
+
+    print(pd.DataFrame(rows).to_string())
+    if failed:
+        raise SystemExit("Precision check failed")
+    print("Every precision is within the expected differences from float64.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+compare_benchmarks.py.
+
+Description
+-----------
+Compare the stage timings recorded by run_benchmarks.py across commits:
+
+    --base COMMIT --head COMMIT
+        Print the median time of every stage and scale measured at both commits,
+        and the ratio head / base. Ratios above --tolerance are flagged as
+        regressions and make the script exit with status 1.
+
+    --plot PATH
+        Plot the median time of every stage against the watershed area, on log-log
+        axes, for each commit given with --commits (default: all of them).
+
+When a commit was measured more than once at the same scale, the fastest of its
+median times is used.
+
+Usage
+-----
+python benchmarks/compare_benchmarks.py --base abc1234 --head def5678
+python benchmarks/compare_benchmarks.py --plot scaling.png [--commits abc1234,...]
+"""
+
+import argparse
+import sys
+
+import pandas as pd
+
+from run_benchmarks import RESULTS_PATH, STAGES, parse_list
+
+
+def best_times(results_df, commit):
+    """Return the fastest median time of each stage and scale measured at commit."""
+    commit_df = results_df[results_df["commit"] == commit]
+    if commit_df.empty:
+        sys.exit(f"No results for commit {commit}.")
+    return commit_df.groupby(["stage", "area_km2"])["median_s"].min()
+
+
+def compare(results_df, base, head, tolerance):
+    """Print the ratio of the head and base times and return the regressions."""
+    comparison_df = pd.concat(
+        {base: best_times(results_df, base), head: best_times(results_df, head)},
+        axis=1,
+    ).dropna()
+    comparison_df["ratio"] = comparison_df[head] / comparison_df[base]
+    comparison_df["regression"] = comparison_df["ratio"] > tolerance
+    comparison_df = comparison_df.reindex(STAGES, level="stage")
+    print(comparison_df.to_string(float_format=lambda value: f"{value:.3f}"))
+    return comparison_df[comparison_df["regression"]]
+
+
+def plot(results_df, commits, path):
+    """Plot the scaling curve of each stage for each commit."""
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    stages = [stage for stage in STAGES if stage in set(results_df["stage"])]
+    fig, axes = plt.subplots(
+        1, len(stages), figsize=(4 * len(stages), 4), sharey=True, squeeze=False
+    )
+    for ax, stage in zip(axes[0], stages):
+        for commit in commits:
+            times = best_times(results_df, commit).get(stage)
+            if times is not None:
+                ax.loglog(times.index, times.values, marker="o", label=commit)
+        ax.set_title(stage, fontsize=9)
+        ax.set_xlabel("Watershed area (km2)")
+    axes[0][0].set_ylabel("Median time (s)")
+    axes[0][-1].legend()
+    fig.tight_layout()
+    fig.savefig(path)
+    print(f"Scaling curves written to {path}")
+
+
+def main():
+    """Compare two commits or plot the scaling curves."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument(
+        "--results", default=str(RESULTS_PATH), help="CSV file of the results."
+    )
+    parser.add_argument("--base", help="Commit to compare against.")
+    parser.add_argument("--head", help="Commit to compare.")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=1.1,
+        help="Ratio of head / base time above which a stage has regressed"
+        " (default 1.1).",
+    )
+    parser.add_argument("--plot", metavar="PATH", help="Write scaling curves here.")
+    parser.add_argument(
+        "--commits", type=parse_list, default=None, help="Commits to plot."
+    )
+    args = parser.parse_args()
+
+    results_df = pd.read_csv(args.results, dtype={"commit": str})
+    if args.plot:
+        plot(results_df, args.commits or list(results_df["commit"].unique()), args.plot)
+    if args.base and args.head:
+        regressions = compare(results_df, args.base, args.head, args.tolerance)
+        if not regressions.empty:
+            print(f"\n{len(regressions)} stage(s) slower than {args.tolerance}x.")
+            sys.exit(1)
+    elif not args.plot:
+        parser.error("Give --base and --head, or --plot.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+run_benchmarks.py.
+
+Description
+-----------
+Time each stage of the riparian connectivity analysis on synthetic watersheds:
+
+    vector_operations, create_ndvi, otsu_threshold_suggestion,
+    classify_ndvi_windowed, extract_raster_features, riparian_stats, report
+
+For each --scales area (km2), a synthetic watershed is generated with synthetic.py
+and the stages run in order, each on the outputs of the previous one. Each selected
+stage is timed on its own over --repeat runs. Stages that are not selected run once,
+untimed, only to produce the inputs of the next ones.
+
+The results are appended to benchmarks/results/benchmarks.csv, one row per scale
+and stage, together with the git commit and host they were measured on. Use
+compare_benchmarks.py to compare two commits or plot the scaling curves.
+
+Usage
+-----
+python benchmarks/run_benchmarks.py [--scales 1,10,100] [--stages STAGE,...]
+    [--repeat N] [--pixel-size M] [--buffer-width M] [--results PATH]
+"""
+
+import argparse
+import contextlib
+from datetime import datetime
+import io
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+
+import pandas as pd
+
+from _common import REPO_DIR, load_script, time_call, working_directory
+from synthetic import generate_watershed
+
+STAGES = [
+    "vector_operations",
+    "create_ndvi",
+    "otsu_threshold_suggestion",
+    "classify_ndvi_windowed",
+    "extract_raster_features",
+    "riparian_stats",
+    "report",
+]
+RESULTS_PATH = REPO_DIR / "benchmarks" / "results" / "benchmarks.csv"
+
+
+def git_commit():
+    """Return the short hash of HEAD, suffixed with '-dirty' for local changes."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPO_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=REPO_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return f"{commit}-dirty" if dirty else commit
+
+
+class StageRunner:
+    """Run the stages in order, timing the selected ones."""
+
+    def __init__(self, stages, repeat, verbose):
+        self.stages = stages
+        self.repeat = repeat
+        self.verbose = verbose
+        self.rows = []
+
+    def run(self, stage, func, size, unit, **kwargs):
+        """
+        Call func, timed over self.repeat runs if stage is selected.
+
+        size is a function of the result returning the number of pixels or features
+        the stage processed, in the given unit.
+        """
+        quiet = contextlib.redirect_stdout(io.StringIO())
+        with contextlib.nullcontext() if self.verbose else quiet:
+            if stage in self.stages:
+                timings, result = time_call(func, repeat=self.repeat, **kwargs)
+            else:
+                timings, result = None, func(**kwargs)
+
+        if timings:
+            self.rows.append(
+                {
+                    "stage": stage,
+                    "median_s": statistics.median(timings),
+                    "min_s": min(timings),
+                    "repeat": self.repeat,
+                    "size": size(result),
+                    "unit": unit,
+                }
+            )
+            print(
+                f"{stage:>26}: median {statistics.median(timings):.3f} s,"
+                f" min {min(timings):.3f} s ({size(result)} {unit})"
+            )
+        return result
+
+
+def benchmark_scale(rc, area_km2, args):
+    """Generate a synthetic watershed of area_km2 and time its stages."""
+    runner = StageRunner(args.stages, args.repeat, args.verbose)
+    with tempfile.TemporaryDirectory() as tmp_dir, working_directory(tmp_dir):
+        paths = generate_watershed(
+            os.path.join(tmp_dir, "inputs"),
+            area_km2,
+            pixel_size=args.pixel_size,
+            seed=args.seed,
+        )
+        with contextlib.redirect_stdout(io.StringIO()):
+            data_dict = rc.load_data(
+                watershed_name="synthetic",
+                watershed_path=paths["watershed"],
+                waterbodies_path=paths["waterbodies"],
+                watercourses_path=paths["watercourses"],
+                imagery_path=paths["imagery"],
+                buffer_width=args.buffer_width,
+                output_dir=os.path.join(tmp_dir, "results"),
+            )
+        log_filepath = data_dict["log_filepath"]
+
+        riparian_buff_geom = runner.run(
+            "vector_operations",
+            rc.vector_operations,
+            size=len,
+            unit="features",
+            watershed_gdf=data_dict["watershed"],
+            waterbodies_gdf=data_dict["waterbodies_path"],
+            watercourses_gdf=data_dict["watercourses_path"],
+            imagery_crs=data_dict["imagery_crs"],
+            buffer_width=data_dict["buffer_width"],
+            log_filepath=log_filepath,
+        )
+        ndvi_da = runner.run(
+            "create_ndvi",
+            rc.create_ndvi,
+            size=lambda da: da.size,
+            unit="pixels",
+            imagery_da=data_dict["imagery"],
+            riparian_buff_geom=riparian_buff_geom,
+            log_filepath=log_filepath,
+        ).load()
+        threshold = runner.run(
+            "otsu_threshold_suggestion",
+            rc.otsu_threshold_suggestion,
+            size=lambda _: ndvi_da.size,
+            unit="pixels",
+            ndvi_da=ndvi_da,
+            log_filepath=log_filepath,
+        )
+        riparian_da, _ = runner.run(
+            "classify_ndvi_windowed",
+            rc.classify_ndvi_windowed,
+            size=lambda result: result[0].size,
+            unit="pixels",
+            ndvi_path="2-riparian_buffer-NDVI.tiff",
+            threshold=threshold,
+            log_filepath=log_filepath,
+        )
+        riparian_dict = runner.run(
+            "extract_raster_features",
+            rc.extract_raster_features,
+            size=lambda result: sum(len(gdf) for gdf in result.values()),
+            unit="features",
+            da=riparian_da,
+            log_filepath=log_filepath,
+        )
+        stats_df = runner.run(
+            "riparian_stats",
+            rc.riparian_stats,
+            size=lambda _: sum(len(gdf) for gdf in riparian_dict.values()),
+            unit="features",
+            watershed_name=data_dict["watershed_name"],
+            buffer_width=data_dict["buffer_width"],
+            ndvi_threshold=threshold,
+            watershed_gdf=data_dict["watershed"],
+            riparian_buffer_gdf=riparian_dict["riparian_buffer_gdf"],
+            vegetation_gdf=riparian_dict["vegetation_gdf"],
+            not_vegetation_gdf=riparian_dict["not_vegetation_gdf"],
+            log_filepath=log_filepath,
+        )
+        runner.run(
+            "report",
+            rc.report,
+            size=lambda _: len(riparian_dict["vegetation_gdf"])
+            + len(riparian_dict["not_vegetation_gdf"]),
+            unit="features",
+            stats_df=stats_df,
+            vegetation_gdf=riparian_dict["vegetation_gdf"],
+            not_vegetation_gdf=riparian_dict["not_vegetation_gdf"],
+            log_filepath=log_filepath,
+        )
+
+    return runner.rows
+
+
+def parse_list(text, cast=str):
+    """Parse a comma separated list."""
+    return [cast(item) for item in text.split(",") if item.strip()]
+
+
+def main():
+    """Benchmark the stages at every scale and append the results."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument(
+        "--scales",
+        type=lambda text: parse_list(text, float),
+        default=[1, 10, 100],
+        help="Comma separated watershed areas in km2 (default 1,10,100). Up to"
+        " 10000, for which a coarser --pixel-size keeps memory use reasonable.",
+    )
+    parser.add_argument(
+        "--stages",
+        type=parse_list,
+        default=STAGES,
+        help=f"Comma separated stages to time (default all: {','.join(STAGES)}).",
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per stage.")
+    parser.add_argument(
+        "--pixel-size", type=float, default=10, help="Pixel size in m (default 10)."
+    )
+    parser.add_argument(
+        "--buffer-width",
+        type=float,
+        default=30,
+        help="Riparian buffer width in m (default 30).",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    parser.add_argument(
+        "--results",
+        default=str(RESULTS_PATH),
+        help="CSV file the results are appended to.",
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="Show the output of the stages."
+    )
+    args = parser.parse_args()
+
+    unknown = set(args.stages) - set(STAGES)
+    if unknown:
+        parser.error(f"Unknown stages: {', '.join(sorted(unknown))}")
+
+    rc = load_script()
+    run = {
+        "commit": git_commit(),
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "pixel_size_m": args.pixel_size,
+        "buffer_width_m": args.buffer_width,
+    }
+    print(f"Commit {run['commit']} on {run['host']}")
+
+    rows = []
+    for area_km2 in args.scales:
+        print(f"\nSynthetic watershed of {area_km2:g} km2")
+        for row in benchmark_scale(rc, area_km2, args):
+            rows.append({**run, "area_km2": area_km2, **row})
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.results)), exist_ok=True)
+    results_df = pd.DataFrame(rows)
+    results_df.to_csv(
+        args.results,
+        mode="a",
+        header=not os.path.exists(args.results),
+        index=False,
+    )
+    print(f"\nResults appended to {args.results}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+synthetic.py.
+
+Description
+-----------
+Generate a synthetic watershed to benchmark the riparian connectivity script with:
+
+    watershed.gpkg
+        A square watershed boundary of --area km2.
+
+    waterbodies.gpkg
+        Irregular lakes scattered across the watershed, about --lake-density per km2.
+
+    watercourses.gpkg
+        Meandering streams, about --stream-density km of stream per km2.
+
+    imagery.tiff
+        A 12 band Sentinel-2 L2A-like GeoTiff (B1 to B12, uint16 reflectance scaled
+        by 10,000) covering the watershed at --pixel-size metres. Vegetation forms
+        smooth patches so that NDVI is bimodal, and lakes have negative NDVI.
+
+The layers are in UTM zone 18N (EPSG:32618), like the sample watershed. The imagery
+is written block by block, so scenes of 10,000 km2 can be generated with bounded
+memory. The same seed always produces the same watershed.
+
+Usage
+-----
+python benchmarks/synthetic.py OUT_DIR [--area KM2] [--pixel-size M] [--seed N]
+"""
+
+import argparse
+import os
+
+import geopandas as gpd
+import numpy as np
+import rasterio
+from rasterio.features import rasterize
+from rasterio.windows import Window, bounds as window_bounds
+from rasterio.windows import transform as window_transform
+import shapely
+
+CRS = "EPSG:32618"
+ORIGIN = (500000.0, 5000000.0)
+SENTINEL2_BANDS = [
+    "B1",
+    "B2",
+    "B3",
+    "B4",
+    "B5",
+    "B6",
+    "B7",
+    "B8",
+    "B8A",
+    "B9",
+    "B11",
+    "B12",
+]
+BLOCK_SIZE = 1024
+
+
+def _meander(rng, start, heading, length, step=50.0):
+    """Return a line that wanders from start with a randomly drifting heading."""
+    n_steps = max(2, int(length / step))
+    headings = heading + np.cumsum(rng.normal(0, 0.25, n_steps))
+    steps = step * np.column_stack([np.cos(headings), np.sin(headings)])
+    return shapely.linestrings(np.vstack([start, start + np.cumsum(steps, axis=0)]))
+
+
+def _lake(rng, centre):
+    """Return an irregular lake made of a few overlapping discs."""
+    radius = rng.lognormal(np.log(150), 0.5)
+    offsets = rng.normal(0, radius / 2, (rng.integers(1, 5), 2))
+    discs = shapely.buffer(shapely.points(centre + offsets), radius, quad_segs=8)
+    return shapely.union_all(discs)
+
+
+def write_layers(out_dir, area_km2, seed=0, stream_density=1.0, lake_density=0.5):
+    """
+    Write the watershed, water bodies and water courses layers.
+
+    Returns
+    -------
+    paths : dictionary
+        The paths of the 'watershed', 'waterbodies' and 'watercourses' layers.
+
+    watershed : shapely Polygon
+        The watershed boundary.
+
+    lakes : list of shapely Polygon
+        The water bodies, to be drawn into the imagery.
+    """
+    rng = np.random.default_rng(seed)
+    side = np.sqrt(area_km2) * 1000
+    watershed = shapely.box(ORIGIN[0], ORIGIN[1], ORIGIN[0] + side, ORIGIN[1] + side)
+
+    # Streams of 1 to 5 km, starting anywhere in the watershed
+    streams = []
+    stream_length = 0.0
+    while stream_length < stream_density * area_km2 * 1000:
+        start = np.array(ORIGIN) + rng.uniform(0, side, 2)
+        length = min(rng.uniform(1000, 5000), 2 * side)
+        stream = _meander(rng, start, rng.uniform(0, 2 * np.pi), length)
+        stream = shapely.intersection(stream, watershed)
+        if not stream.is_empty:
+            streams.append(stream)
+            stream_length += stream.length
+
+    lakes = []
+    for _ in range(max(1, rng.poisson(lake_density * area_km2))):
+        lake = _lake(rng, np.array(ORIGIN) + rng.uniform(0, side, 2))
+        lake = shapely.intersection(lake, watershed)
+        if not lake.is_empty:
+            lakes.append(lake)
+
+    os.makedirs(out_dir, exist_ok=True)
+    paths = {
+        "watershed": os.path.join(out_dir, "watershed.gpkg"),
+        "waterbodies": os.path.join(out_dir, "waterbodies.gpkg"),
+        "watercourses": os.path.join(out_dir, "watercourses.gpkg"),
+    }
+    gpd.GeoDataFrame(geometry=[watershed], crs=CRS).to_file(paths["watershed"])
+    gpd.GeoDataFrame(geometry=lakes, crs=CRS).explode(index_parts=False).to_file(
+        paths["waterbodies"]
+    )
+    gpd.GeoDataFrame(geometry=streams, crs=CRS).explode(index_parts=False).to_file(
+        paths["watercourses"]
+    )
+    return paths, watershed, lakes
+
+
+def _vegetation_fraction(rng, x, y, n_waves=12):
+    """Return a smooth field of vegetation fractions between 0 and 1."""
+    field = np.zeros(np.broadcast(x, y).shape)
+    for direction, wavelength, phase in zip(
+        rng.uniform(0, np.pi, n_waves),
+        rng.uniform(200, 3000, n_waves),
+        rng.uniform(0, 2 * np.pi, n_waves),
+    ):
+        field += np.cos(
+            2 * np.pi * (x * np.cos(direction) + y * np.sin(direction)) / wavelength
+            + phase
+        )
+    field /= np.sqrt(n_waves / 2)
+    return 1 / (1 + np.exp(-3 * field))
+
+
+def write_imagery(path, watershed, lakes, pixel_size=10.0, seed=0, margin=500.0):
+    """
+    Write a Sentinel-2 L2A-like GeoTiff covering the watershed, block by block.
+
+    Red and NIR reflectances blend those of vegetation and bare ground by a smooth
+    vegetation fraction, plus noise. Pixels within lakes get those of water. The other
+    bands are derived from the Red and NIR bands.
+    """
+    minx, miny, maxx, maxy = shapely.buffer(watershed, margin).bounds
+    width = int(np.ceil((maxx - minx) / pixel_size))
+    height = int(np.ceil((maxy - miny) / pixel_size))
+    transform = rasterio.transform.from_origin(minx, maxy, pixel_size, pixel_size)
+    profile = {
+        "driver": "GTiff",
+        "height": height,
+        "width": width,
+        "count": len(SENTINEL2_BANDS),
+        "dtype": "uint16",
+        "crs": CRS,
+        "transform": transform,
+        "tiled": True,
+        "blockxsize": 512,
+        "blockysize": 512,
+        "compress": "deflate",
+        "BIGTIFF": "IF_SAFER",
+    }
+
+    # The same waves are used for every block so that the patches are continuous
+    wave_seed = np.random.default_rng(seed).integers(2**32)
+    lakes_index = shapely.STRtree(lakes)
+    with rasterio.open(path, "w", **profile) as dst:
+        dst.descriptions = tuple(SENTINEL2_BANDS)
+        for row_off in range(0, height, BLOCK_SIZE):
+            for col_off in range(0, width, BLOCK_SIZE):
+                window = Window(
+                    col_off,
+                    row_off,
+                    min(BLOCK_SIZE, width - col_off),
+                    min(BLOCK_SIZE, height - row_off),
+                )
+                block_transform = window_transform(window, transform)
+                cols = np.arange(window.width) + 0.5
+                rows = np.arange(window.height)[:, None] + 0.5
+                x = block_transform.c + cols * pixel_size
+                y = block_transform.f - rows * pixel_size
+
+                vegetation = _vegetation_fraction(
+                    np.random.default_rng(wave_seed), x, y
+                )
+                noise = np.random.default_rng([seed, row_off, col_off]).normal(
+                    0, 120, (2,) + vegetation.shape
+                )
+                red = 1500 - 1100 * vegetation + noise[0]
+                nir = 2200 + 1300 * vegetation + noise[1]
+
+                block_box = shapely.box(*window_bounds(window, transform))
+                block_lakes = [
+                    lakes[i] for i in lakes_index.query(block_box, "intersects")
+                ]
+                if block_lakes:
+                    water = rasterize(
+                        block_lakes,
+                        out_shape=vegetation.shape,
+                        transform=block_transform,
+                        dtype="uint8",
+                    ).astype(bool)
+                    red[water] = 300 + noise[0][water] / 4
+                    nir[water] = 150 + noise[1][water] / 4
+
+                red = np.clip(red, 1, 10000)
+                nir = np.clip(nir, 1, 10000)
+                bands = {
+                    "B4": red,
+                    "B8": nir,
+                    "B8A": nir * 0.97,
+                    "B5": (red + nir) / 2,
+                    "B6": nir * 0.85,
+                    "B7": nir * 0.95,
+                }
+                for index, band in enumerate(SENTINEL2_BANDS, start=1):
+                    values = bands.get(band, red * 0.8)
+                    dst.write(values.astype("uint16"), index, window=window)
+
+    return path
+
+
+def generate_watershed(out_dir, area_km2, pixel_size=10.0, seed=0, **kwargs):
+    """
+    Write a synthetic watershed of area_km2 km2 and its imagery to out_dir.
+
+    Parameters
+    ----------
+    out_dir : str
+        The directory the layers and imagery are written to.
+
+    area_km2 : float
+        The area of the watershed in km2.
+
+    pixel_size : float, optional
+        The size of the imagery pixels in metres. The default is 10, that of the
+        Sentinel-2 Red and NIR bands.
+
+    seed : int, optional
+        The seed of the random generator. The default is 0.
+
+    **kwargs
+        stream_density and lake_density, passed to write_layers().
+
+    Returns
+    -------
+    paths : dictionary
+        The paths of the 'watershed', 'waterbodies', 'watercourses' and 'imagery'.
+    """
+    paths, watershed, lakes = write_layers(out_dir, area_km2, seed=seed, **kwargs)
+    paths["imagery"] = write_imagery(
+        os.path.join(out_dir, "imagery.tiff"),
+        watershed,
+        lakes,
+        pixel_size=pixel_size,
+        seed=seed,
+    )
+    return paths
+
+
+def main():
+    """Write a synthetic watershed to the given directory."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("out_dir", help="Directory to write the watershed to.")
+    parser.add_argument(
+        "--area", type=float, default=10, help="Watershed area in km2 (default 10)."
+    )
+    parser.add_argument(
+        "--pixel-size", type=float, default=10, help="Pixel size in m (default 10)."
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    parser.add_argument(
+        "--stream-density",
+        type=float,
+        default=1.0,
+        help="km of stream per km2 (default 1).",
+    )
+    parser.add_argument(
+        "--lake-density", type=float, default=0.5, help="Lakes per km2 (default 0.5)."
+    )
+    args = parser.parse_args()
+
+    paths = generate_watershed(
+        args.out_dir,
+        args.area,
+        pixel_size=args.pixel_size,
+        seed=args.seed,
+        stream_density=args.stream_density,
+        lake_density=args.lake_density,
+    )
+    for name, path in paths.items():
+        print(f"{name:>12}: {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,25 +7,25 @@ riparian_connectivity.py.
 Description
 -----------
 This script determines the location and extent of riparian connectivity in a watershed
-then outputs several riparian connectivity statistics and an interactive map of the 
+then outputs several riparian connectivity statistics and an interactive map of the
 watershed.
 
 Parameters (Inputs)
 ------
-a projected watershed raster file, 
-a watercourse line vector file, 
-a waterbodies polygon vector file and 
+a projected watershed raster file,
+a watercourse line vector file,
+a waterbodies polygon vector file and
 a watershed polygon vector file
 a user defined threshold
 
 Process
 -------
-The script takes the above inputs, creates a riparian buffer around the waterbodies and 
-watercourses. The Normalized Difference Vegetation Index is calculated on the buffer. 
-A threshold is suggested to the user based on the Otsu Threshold Method. A threshold is 
+The script takes the above inputs, creates a riparian buffer around the waterbodies and
+watercourses. The Normalized Difference Vegetation Index is calculated on the buffer.
+A threshold is suggested to the user based on the Otsu Threshold Method. A threshold is
 used to separate vegetated areas from non-vegetated areas and statistics computed on the
-result. The statistics and vegetated to non-vegetated buffers are integrated into an 
-interactive map, which aids in visualiztion of non-vegetated areas/ areas of low 
+result. The statistics and vegetated to non-vegetated buffers are integrated into an
+interactive map, which aids in visualiztion of non-vegetated areas/ areas of low
 riparian connectivity.
 
 Returns (Outputs)
@@ -35,7 +35,7 @@ Interactive Map
 
 About
 -----
-This script was created by a group of student from Carleton Universtity, in Ottawa, 
+This script was created by a group of student from Carleton Universtity, in Ottawa,
 Canada and was originally written for the Ottawa Riverkeeper to aid in their assessment
 of riparian connectivity, one of their fourteen (14) indicators of watershed health
 
@@ -45,29 +45,55 @@ Authors: John Foster (Lead), Benjamin Colbourne, Taji Hamilton, Haley Nicholson
 # %% Import modules
 
 # built-ins
+import argparse
+from contextlib import contextmanager
+import cProfile
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    as_completed,
+    wait,
+)
 from datetime import datetime
+import hashlib
+import json
 import os
 from pathlib import Path
+import shutil
 import sys
+import threading
+import time
+
+try:
+    # Not available on Windows, where peak memory is not measured
+    import resource
+except ImportError:
+    resource = None
 
 # data manipulation
 import geopandas as gpd
 import numpy as np
 import pandas as pd
+import rasterio
+import rasterio.shutil
+from rasterio.windows import Window
 import rioxarray as rxr
-import skimage
+import xarray as xr
 
-# plotting
-import matplotlib.pyplot as plt
-import folium
-from folium import plugins
+# The plotting (matplotlib, folium), image processing (skimage) and parallel
+# processing (joblib) modules are slow to import, so they are imported by the
+# functions that use them. Validating the inputs or calculating the statistics
+# then starts without loading them.
 
 # raster to vector function
 from ast import literal_eval
-from joblib import Parallel, delayed
 import multiprocessing
+from itertools import chain
 from rasterio import features
-from shapely.geometry import shape
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components, minimum_spanning_tree
+import shapely
+from shapely.geometry import GeometryCollection, shape
 
 # Suppress FutureWarning
 import warnings
@@ -92,8 +118,426 @@ def user_input(input_message):
 
 # %% 1) Function to read the vector and raster data - John
 
+# Formats the vector outputs can be written in, and their file extensions
+VECTOR_FORMATS = {"gpkg": ".gpkg", "parquet": ".parquet", "gpkg-arrow": ".gpkg"}
+
+
+def read_vector(path, **kwargs):
+    """
+    Read a vector file into a GeoDataFrame, including GeoParquet files.
+
+    Parameters
+    ----------
+    path : str
+        Path to a GeoParquet ('.parquet') file or to any file GeoPandas can read.
+
+    **kwargs
+        Keyword arguments passed to geopandas.read_file(), e.g. mask. Not used for
+        GeoParquet files.
+
+    Returns
+    -------
+    gdf : GeoPandas GeoDataFrame
+        The features read.
+    """
+    if Path(path).suffix.lower() == ".parquet":
+        return gpd.read_parquet(path)
+    return gpd.read_file(path, **kwargs)
+
+
+def write_vector(gdf, name, vector_format="gpkg"):
+    """
+    Write a GeoDataFrame to the working directory in one of VECTOR_FORMATS.
+
+    Parameters
+    ----------
+    gdf : GeoPandas GeoDataFrame
+        The features to write.
+
+    name : str
+        The name of the output without its extension, e.g. '1_riparian_buffer'.
+
+    vector_format : str, optional
+        'gpkg' (the default) writes a GeoPackage with GeoPandas' default engine.
+        'gpkg-arrow' writes the same GeoPackage through pyogrio's Arrow interface,
+        which is much faster for many features. 'parquet' writes a GeoParquet file,
+        the fastest to write and read back.
+
+    Returns
+    -------
+    path : str
+        The path of the output.
+    """
+    path = name + VECTOR_FORMATS[vector_format]
+    if vector_format == "parquet":
+        gdf.to_parquet(path)
+    elif vector_format == "gpkg-arrow":
+        gdf.to_file(path, driver="GPKG", engine="pyogrio", use_arrow=True)
+    else:
+        gdf.to_file(filename=path, driver="GPKG")
+
+    return path
+
+
+def read_layer(path, search_area=None):
+    """
+    Read a vector file, optionally only the features that intersect a search area.
+
+    Parameters
+    ----------
+    path : str
+        Path to the shapefile/geopackage/GeoParquet file.
+
+    search_area : GeoPandas GeoSeries, optional
+        Only features intersecting it are read. The file is first read with it as a
+        spatial filter, then the features are filtered exactly with
+        prefilter_to_search_area(). The default is None, which reads every feature.
+
+    Returns
+    -------
+    gdf : GeoPandas GeoDataFrame
+        The features read.
+    """
+    if search_area is None:
+        return read_vector(path)
+
+    gdf = read_vector(path, mask=search_area)
+    return prefilter_to_search_area(gdf, search_area)
+
+
+def read_layer_info(path):
+    """
+    Read the metadata of a vector file without reading its features.
+
+    Parameters
+    ----------
+    path : str
+        Path to the shapefile/geopackage/GeoParquet file.
+
+    Returns
+    -------
+    info : dictionary
+        The 'geometry_types' of the layer as a list of names such as 'Polygon' (empty
+        if the file does not declare them), the number of 'features', the 'crs' (None
+        if the layer has none) and the 'bounds' (None if unknown). pyogrio reads them
+        without reading the features. When it is not installed, the features are read.
+    """
+    if Path(path).suffix.lower() == ".parquet":
+        import pyarrow.parquet
+
+        metadata = pyarrow.parquet.read_metadata(path)
+        geo = json.loads(metadata.metadata[b"geo"])
+        column = geo["columns"][geo["primary_column"]]
+        return {
+            "geometry_types": column.get("geometry_types", []),
+            "features": metadata.num_rows,
+            # Without a crs member the GeoParquet specification implies OGC:CRS84
+            "crs": column.get("crs", "OGC:CRS84"),
+            "bounds": column.get("bbox"),
+        }
+
+    try:
+        import pyogrio
+    except ImportError:
+        # Without pyogrio the metadata is taken from the features themselves
+        gdf = read_vector(path)
+        return {
+            "geometry_types": list(gdf.geom_type.dropna().unique()),
+            "features": len(gdf),
+            "crs": gdf.crs,
+            "bounds": gdf.total_bounds if len(gdf) else None,
+        }
+
+    info = pyogrio.read_info(path, force_feature_count=True)
+    geometry_type = info["geometry_type"] or ""
+    return {
+        # e.g. 'Polygon Z' is a Polygon, 'Unknown' is any geometry type
+        "geometry_types": (
+            []
+            if geometry_type in ["", "Unknown", "Geometry"]
+            else [geometry_type.split(" ")[0]]
+        ),
+        "features": info["features"],
+        "crs": info["crs"],
+        "bounds": info.get("total_bounds"),
+    }
+
+
+def check_layer(path, geometry_types):
+    """
+    Check the geometry type and CRS of a vector file from its metadata.
+
+    The features are not read, so the check takes the same time for any number of
+    features. Layers that do not declare their geometry type pass the geometry type
+    check.
+
+    Parameters
+    ----------
+    path : str
+        Path to the shapefile/geopackage/GeoParquet file.
+
+    geometry_types : list of str
+        The expected geometry types, e.g. ['Polygon', 'MultiPolygon'].
+
+    Returns
+    -------
+    info : dictionary
+        The metadata of the layer returned by read_layer_info().
+    """
+    info = read_layer_info(path)
+    unexpected = [gt for gt in info["geometry_types"] if gt not in geometry_types]
+    if unexpected:
+        raise Exception(
+            f"Error: Wrong geometry type. Expected '{geometry_types[0]}' but"
+            f" received '{unexpected[0]}'."
+        )
+    elif info["crs"] is None:
+        raise Exception("Error: Missing coordinate reference system (CRS).")
+
+    return info
+
+
+def read_watershed(watershed_path, multiple=False):
+    """
+    Read and check the watershed boundary vector data.
+
+    Parameters
+    ----------
+    watershed_path : str
+        Path to the watershed boundary polygon shapefile/geopackage.
+
+    multiple : bool, optional
+        Whether the layer may hold several watersheds, one per feature, for
+        zonal_riparian_stats(). The default is False, which requires 1 feature.
+
+    Returns
+    -------
+    watershed_gdf : GeoPandas GeoDataFrame
+        The watershed boundary.
+    """
+    watershed_gdf = gpd.read_file(watershed_path)
+    # Check for errors
+    if watershed_gdf["geometry"].any().geom_type not in [
+        "Polygon",
+        "MultiPolygon",
+    ]:
+        raise Exception(
+            "Error: Wrong geometry type. Expected 'Polygon' or "
+            "'MultiPolygon' but received"
+            f"{watershed_gdf['geometry'].all().geom_type}."
+        )
+    elif len(watershed_gdf) > 1 and not multiple:
+        raise Exception(
+            "Error: Too many features. Expected 1 feature but"
+            f" received {len(watershed_gdf)} features."
+        )
+
+    return watershed_gdf
+
+
+def read_waterbodies(waterbodies_path, search_area=None):
+    """
+    Read and check the water bodies vector data.
+
+    Parameters
+    ----------
+    waterbodies_path : str
+        Path to the water bodies polygon shapefile/geopackage.
+
+    search_area : GeoPandas GeoSeries, optional
+        When given, only the features intersecting it are read. See
+        watershed_search_area(). The default is None, which reads every feature.
+
+    Returns
+    -------
+    waterbodies_gdf : GeoPandas GeoDataFrame
+        The water bodies.
+    """
+    waterbodies_gdf = read_layer(waterbodies_path, search_area)
+    # Check for errors
+    if len(waterbodies_gdf) and waterbodies_gdf["geometry"].any().geom_type not in [
+        "Polygon",
+        "MultiPolygon",
+    ]:
+        raise Exception(
+            "Error: Wrong geometry type. Expected 'Polygon' but"
+            f" received '{waterbodies_gdf['geometry'].all().geom_type}'."
+        )
+
+    return waterbodies_gdf
+
+
+def read_watercourses(watercourses_path, search_area=None):
+    """
+    Read and check the water courses vector data.
+
+    Parameters
+    ----------
+    watercourses_path : str
+        Path to the water courses line shapefile/geopackage.
+
+    search_area : GeoPandas GeoSeries, optional
+        When given, only the features intersecting it are read. See
+        watershed_search_area(). The default is None, which reads every feature.
+
+    Returns
+    -------
+    watercourses_gdf : GeoPandas GeoDataFrame
+        The water courses.
+    """
+    watercourses_gdf = read_layer(watercourses_path, search_area)
+    # Check for errors
+    if len(watercourses_gdf) and watercourses_gdf["geometry"].any().geom_type not in [
+        "LineString",
+        "MultiLineString",
+    ]:
+        raise Exception(
+            "Error: Wrong geometry type. Expected 'LineString' but"
+            f" received '{watercourses_gdf['geometry'].all().geom_type}'."
+        )
+
+    return watercourses_gdf
+
+
+def read_imagery(imagery_path, watershed_gdf):
+    """
+    Check the Sentinel-2 imagery and lazily open its Red and NIR bands.
+
+    The checks are made from the file's metadata before any pixels are read.
+
+    Parameters
+    ----------
+    imagery_path : str
+        Path to the Sentinel-2 multispectral GeoTiff imagery file.
+
+    watershed_gdf : GeoPandas GeoDataFrame
+        The watershed boundary. The imagery is clipped to its bounding box.
+
+    Returns
+    -------
+    imagery_da : RioXarray DataArray
+        Lazily loaded DataArray containing band 4 and band 8 of the imagery.
+
+    imagery_crs : CRS
+        The coordinate reference system of the imagery.
+    """
+    # Validate from the file's metadata before reading any pixels
+    with rasterio.open(imagery_path) as src:
+        imagery_crs = src.crs
+        imagery_band_count = src.count
+    # Check for errors
+    if imagery_crs == None:
+        raise Exception(
+            "Error: Missing coordinate reference system. Expected imagery"
+            f" with a valid CRS but received '{imagery_crs}'."
+        )
+    elif imagery_crs.is_projected == False:
+        raise Exception(
+            "Error: Coordinate reference system is not projected. Expected"
+            f" imagery with a projected CRS but received '{imagery_crs}'."
+        )
+    elif imagery_crs.linear_units != "metre":
+        raise Exception(
+            "Error: Coordinate reference system linear units are not in"
+            " meters. Expected imagery with linear units of 'metre' but"
+            f" received '{imagery_crs.linear_units}'."
+        )
+
+    elif imagery_band_count < 4:
+        raise Exception(
+            "Error: Missing Band 4 (Red). Band 4 required for the"
+            " calculation of the Normalized Vegetation Difference Index."
+        )
+    elif imagery_band_count < 8:
+        raise Exception(
+            "Error: Missing Band 8 (NIR). Band 8 required for the"
+            " calculation of the Normalized Vegetation Difference Index."
+        )
+
+    # Lazily open only the Red and NIR bands over the watershed
+    imagery_da = open_imagery(
+        imagery_path=imagery_path,
+        bounds=watershed_gdf.to_crs(imagery_crs).total_bounds,
+    )
+
+    return imagery_da, imagery_crs
+
+
+def create_results_dir(watershed_name, output_dir="results"):
+    """
+    Create a uniquely named directory to hold the results of an analysis.
+
+    If a directory named after the watershed already exists a number is appended to
+    the name, e.g. 'results/my_watershed_2'.
+
+    Parameters
+    ----------
+    watershed_name : str
+        Name of the watershed being evaluated.
+
+    output_dir : str, optional
+        The directory in which the results directory is created. It is created if it
+        does not exist. The default is 'results'.
+
+    Returns
+    -------
+    results_dir : str
+        Absolute path to the new results directory.
+    """
+    # Create a directory to hold the results
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Create a unique directory to hold the results from the current analysis
+    # Modified from https://stackoverflow.com/a/56680778
+    results_dir_name = watershed_name.replace(" ", "_")
+    results_dir = os.path.join(output_dir, results_dir_name)
+    counter = 2
+    while True:
+        try:
+            os.mkdir(results_dir)
+            break
+        except FileExistsError:
+            results_dir = os.path.join(output_dir, f"{results_dir_name}_{counter}")
+            counter += 1
+
+    return os.path.abspath(results_dir)
+
+
+def start_log(
+    results_dir,
+    watershed_name,
+    watershed_path,
+    waterbodies_path,
+    watercourses_path,
+    imagery_path,
+    imagery_crs,
+    buffer_width,
+):
+    """
+    Write the initial entries of the log file to the results directory.
+
+    Returns
+    -------
+    log_filepath : str
+        Absolute path to the log file.
+    """
+    log_filename = watershed_name.replace(" ", "_") + "-log.txt"
+    log_filepath = os.path.join(results_dir, log_filename)
+    with open(log_filepath, "a") as file:
+        file.write(datetime.now().strftime("%d/%m/%Y %H:%M:%S\n\n"))
+        file.write(f"Riparian connectivity log:\n{watershed_name}\n\n")
+        file.write(f"Results directory:\n{results_dir}\n\n")
+        file.write(f"Watershed boundary input:\n{watershed_path}\n\n")
+        file.write(f"Water bodies input:\n{waterbodies_path}\n\n")
+        file.write(f"Water courses input:\n{watercourses_path}\n\n")
+        file.write(f"Imagery input:\n{imagery_path}\n\n")
+        file.write(f"Imagery coordinate reference system: {imagery_crs}\n\n")
+        file.write(f"Riparian buffer width (m) input: {buffer_width}\n\n")
+
+    return log_filepath
 
-def load_data_ui():
+
+def load_data_ui(validate_only=False, multiple_watersheds=False):
     """
     Provide a textual user interface for the loading of the required data.
 
@@ -105,9 +549,15 @@ def load_data_ui():
 
         Water bodies
             - Geometry type must be 'Polygon'
+            - Must have a coordinate reference system (CRS)
 
         Water courses
             - Geometry type must be 'LineString'
+            - Must have a coordinate reference system (CRS)
+
+    The water bodies and water courses are checked from the metadata of their files
+    only. Their features are read by vector_operations(), and only those that can
+    reach the watershed's riparian buffer.
 
         Sentinel-2 imagery
             - Must have a corodinate reference system (CRS)
@@ -116,11 +566,21 @@ def load_data_ui():
             - Must have band 4 (Red)
             - Must have band 8 (NIR)
 
+    Parameters
+    ----------
+    validate_only : bool, optional
+        Whether to stop once the inputs are checked, without creating a results
+        directory. The default is False.
+
+    multiple_watersheds : bool, optional
+        Whether the watershed boundary may have more than 1 feature, for
+        zonal_riparian_stats(). The default is False.
+
     Returns
     -------
     data_dict : dictionary
         Returns a dictionary with each of the data objects as the value of an
-        appropriately named key.
+        appropriately named key, or None if validate_only is True.
     """
     print("\nRiparian Connectivity")
     print("-------------------------------------------------")
@@ -142,27 +602,11 @@ def load_data_ui():
         )
         if input_path:
             try:
-                watershed_path = os.path.join(*Path(input_path).parts)
+                watershed_path = os.path.abspath(os.path.join(*Path(input_path).parts))
                 print("\nReading file...", end="")
-                watershed_gdf = gpd.read_file(watershed_path)
-                # Check for errors
-                if watershed_gdf["geometry"].any().geom_type not in [
-                    "Polygon",
-                    "MultiPolygon",
-                ]:
-                    raise Exception(
-                        "Error: Wrong geometry type. Expected 'Polygon' or "
-                        "'MultiPolygon' but received"
-                        f"{watershed_gdf['geometry'].all().geom_type}."
-                    )
-                elif len(watershed_gdf) > 1:
-                    raise Exception(
-                        "Error: Too many features. Expected 1 feature but"
-                        f" received {len(watershed_gdf)} features."
-                    )
-                else:
-                    print("done")
-                    loaded = True
+                watershed_gdf = read_watershed(watershed_path, multiple_watersheds)
+                print("done")
+                loaded = True
             except Exception as e:
                 print("\n")
                 print(e, "\n")
@@ -179,21 +623,13 @@ def load_data_ui():
         )
         if input_path:
             try:
-                waterbodies_path = os.path.join(*Path(input_path).parts)
-                print("\nReading file...", end="")
-                waterbodies_gdf = gpd.read_file(waterbodies_path)
-                # Check for errors
-                if waterbodies_gdf["geometry"].any().geom_type not in [
-                    "Polygon",
-                    "MultiPolygon",
-                ]:
-                    raise Exception(
-                        "Error: Wrong geometry type. Expected 'Polygon' but"
-                        f" received '{waterbodies_gdf['geometry'].all().geom_type}'."
-                    )
-                else:
-                    print("done")
-                    loaded = True
+                waterbodies_path = os.path.abspath(
+                    os.path.join(*Path(input_path).parts)
+                )
+                print("\nChecking file...", end="")
+                info = check_layer(waterbodies_path, ["Polygon", "MultiPolygon"])
+                print(f"done ({info['features']} features)")
+                loaded = True
             except Exception as e:
                 print("\n")
                 print(e, "\n")
@@ -210,21 +646,13 @@ def load_data_ui():
         )
         if input_path:
             try:
-                watercourses_path = os.path.join(*Path(input_path).parts)
-                print("\nReading file...", end="")
-                watercourses_gdf = gpd.read_file(watercourses_path)
-                # Check for errors
-                if watercourses_gdf["geometry"].any().geom_type not in [
-                    "LineString",
-                    "MultiLineString",
-                ]:
-                    raise Exception(
-                        "Error: Wrong geometry type. Expected 'LineString' but"
-                        f" received '{watercourses_gdf['geometry'].all().geom_type}'."
-                    )
-                else:
-                    print("done")
-                    loaded = True
+                watercourses_path = os.path.abspath(
+                    os.path.join(*Path(input_path).parts)
+                )
+                print("\nChecking file...", end="")
+                info = check_layer(watercourses_path, ["LineString", "MultiLineString"])
+                print(f"done ({info['features']} features)")
+                loaded = True
             except Exception as e:
                 print("\n")
                 print(e, "\n")
@@ -241,41 +669,11 @@ def load_data_ui():
         )
         if input_path:
             try:
-                imagery_path = os.path.join(*Path(input_path).parts)
+                imagery_path = os.path.abspath(os.path.join(*Path(input_path).parts))
                 print("\nReading file...", end="")
-                imagery_da = rxr.open_rasterio(filename=imagery_path)
-                imagery_crs = imagery_da.rio.crs
-                # Check for errors
-                if imagery_crs == None:
-                    raise Exception(
-                        "Error: Missing coordinate reference system. Expected imagery"
-                        f" with a valid CRS but received '{imagery_crs}'."
-                    )
-                elif imagery_crs.is_projected == False:
-                    raise Exception(
-                        "Error: Coordinate reference system is not projected. Expected"
-                        f" imagery with a projected CRS but received '{imagery_crs}'."
-                    )
-                elif imagery_crs.linear_units != "metre":
-                    raise Exception(
-                        "Error: Coordinate reference system linear units are not in"
-                        " meters. Expected imagery with linear units of 'metre' but"
-                        f" received '{imagery_crs.linear_units}'."
-                    )
-
-                elif 4 not in imagery_da["band"]:
-                    raise Exception(
-                        "Error: Missing Band 4 (Red). Band 4 required for the"
-                        " calculation of the Normalized Vegetation Difference Index."
-                    )
-                elif 8 not in imagery_da["band"]:
-                    raise Exception(
-                        "Error: Missing Band 8 (NIR). Band 8 required for the"
-                        " calculation of the Normalized Vegetation Difference Index."
-                    )
-                else:
-                    print("done")
-                    loaded = True
+                imagery_da, imagery_crs = read_imagery(imagery_path, watershed_gdf)
+                print("done")
+                loaded = True
             except Exception as e:
                 print("\n")
                 print(e, "\n")
@@ -299,895 +697,5509 @@ def load_data_ui():
                 print("\nError: Buffer width must be a valid integer or float > 0\n")
 
     print("\nAll input data loaded successfully.\n")
+    if validate_only:
+        return None
 
     # Create a directory to hold the results
-    try:
-        os.mkdir("results")
-    except FileExistsError:
-        pass
-    os.chdir("results")
-
-    # Create a unique directory to hold the results from the current analysis
-    # Modified from https://stackoverflow.com/a/56680778
-    results_dir_name = watershed_name.replace(" ", "_")
-    try:
-        os.mkdir(f"{results_dir_name}")
-    except FileExistsError:
-        counter = 2
-        while os.path.isdir(f"{results_dir_name}_{counter}"):
-            counter += 1
-        os.mkdir(f"{results_dir_name}_{counter}")
-        results_dir_name = f"{results_dir_name}_{counter}"
+    results_dir = create_results_dir(watershed_name)
 
     print("\nA log file and outputs will be found here:")
-    print(os.path.abspath(results_dir_name) + "\n")
+    print(results_dir + "\n")
 
     user_input("Press 'Enter' or 'Return' to proceed or 'q' to quit: ")
 
     # Change the working directory to the results directory for the current session
-    os.chdir(results_dir_name)
+    os.chdir(results_dir)
 
     # Write intial entries to the log file
-    log_filename = watershed_name.replace(" ", "_") + "-log.txt"
-    log_filepath = os.path.abspath(log_filename)
-    with open(log_filepath, "a") as file:
-        file.write(datetime.now().strftime("%d/%m/%Y %H:%M:%S\n\n"))
-        file.write(f"Riparian connectivity log:\n{watershed_name}\n\n")
-        file.write(f"Results directory:\nf{os.path.abspath(results_dir_name)}\n\n")
-        file.write(f"Watershed boundary input:\n{os.path.abspath(watershed_path)}\n\n")
-        file.write(f"Water bodies input:\n{os.path.abspath(waterbodies_path)}\n\n")
-        file.write(f"Water courses input:\n{os.path.abspath(watercourses_path)}\n\n")
-        file.write(f"Imagery input:\n{os.path.abspath(imagery_path)}\n\n")
-        file.write(f"Imagery coordinate reference system: {imagery_crs}\n\n")
-        file.write(f"Riparian buffer width (m) input: {buffer_width}\n\n")
+    log_filepath = start_log(
+        results_dir=results_dir,
+        watershed_name=watershed_name,
+        watershed_path=watershed_path,
+        waterbodies_path=waterbodies_path,
+        watercourses_path=watercourses_path,
+        imagery_path=imagery_path,
+        imagery_crs=imagery_crs,
+        buffer_width=buffer_width,
+    )
 
     # Add the inputs to a dictionary
     data_dict = {
         "watershed_name": watershed_name,
         "watershed": watershed_gdf,
-        "waterbodies": waterbodies_gdf,
-        "watercourses": watercourses_gdf,
+        "watershed_path": watershed_path,
+        "waterbodies_path": waterbodies_path,
+        "watercourses_path": watercourses_path,
         "imagery": imagery_da,
+        "imagery_path": imagery_path,
         "imagery_crs": imagery_crs,
         "buffer_width": buffer_width,
+        "results_dir": results_dir,
         "log_filepath": log_filepath,
     }
 
     return data_dict
 
 
-# %% 2) Function to perform vector operations to create riparian zone - Ben
-
-
-def vector_operations(
-    watershed_gdf,
-    waterbodies_gdf,
-    watercourses_gdf,
-    imagery_crs,
-    buffer_width,
-    log_filepath,
+def validate_inputs(
+    watershed_path,
+    waterbodies_path,
+    watercourses_path,
+    imagery_path,
+    multiple_watersheds=False,
 ):
     """
-    Perform vector operations to create a riparian buffer.
+    Check the input layers and imagery of an analysis.
 
-    Create a riparian buffer from the watershed's waterbodies and watercourses.
+    Performs the checks of load_data_ui() on the watershed boundary, the metadata of
+    the water bodies and water courses, and the metadata of the imagery, raising an
+    Exception when one fails. No water features or pixels are read.
 
     Parameters
     ----------
-    watershed_gdf : GeoPandas GeoDataFrame
-        The watershed boundary. Geometry type must be Polygon.
-
-    waterbodies_gdf : GeoPandas GeoDataFrame
-        The water bodies within the watershed. Geometry type must be Polygon.
+    watershed_path : str
+        Path to the watershed boundary polygon shapefile/geopackage.
 
-    watercourses_gdf : GeoPandas GeoDataFrame
-        The water courses within the watershed. Geometry type must be LineString.
+    waterbodies_path : str
+        Path to the water bodies polygon shapefile/geopackage.
 
-    imagery_crs : CRS
-        The coordinate reference system of the Sentinel-2 imagery. The GeoDataFrames
-        will be reprojected to this CRS.
+    watercourses_path : str
+        Path to the water courses line shapefile/geopackage.
 
-    buffer_width : float
-        The width in meters of the riparian buffer. The buffer will be applied to the
-        water bodies and water courses and will be clipped to the watershed boundary.
+    imagery_path : str
+        Path to the Sentinel-2 multispectral GeoTiff imagery file.
 
-    log_filepath : str
-        Path to the log file.
+    multiple_watersheds : bool, optional
+        Whether the watershed boundary may have more than 1 feature. The default is
+        False.
 
     Returns
     -------
-    riparian_buff_geom : GeoPandas GeoSeries
-        The geometry of the watershed's riparian buffer.
+    watershed_gdf : GeoPandas GeoDataFrame
+        The watershed boundary.
+
+    imagery_da : RioXarray DataArray
+        Lazily loaded DataArray containing band 4 and band 8 of the imagery.
 
+    imagery_crs : CRS
+        The coordinate reference system of the imagery.
     """
-    print("\nCreating riparian buffer...", end="")
+    watershed_gdf = read_watershed(watershed_path, multiple_watersheds)
+    check_layer(waterbodies_path, ["Polygon", "MultiPolygon"])
+    check_layer(watercourses_path, ["LineString", "MultiLineString"])
+    imagery_da, imagery_crs = read_imagery(imagery_path, watershed_gdf)
 
-    with open(log_filepath, "a") as file:
-        file.write(
-            "Computations started @" f" {datetime.now().strftime('%H:%M:%S')}\n\n"
-        )
+    return watershed_gdf, imagery_da, imagery_crs
 
-    # Reproject the GeoDataFrames
-    watershed_gdf = watershed_gdf.to_crs(imagery_crs)
-    waterbodies_gdf = waterbodies_gdf.to_crs(imagery_crs)
-    watercourses_gdf = watercourses_gdf.to_crs(imagery_crs)
 
-    # Dissolve the GeoDataFrames
-    watershed_gdf = watershed_gdf[["geometry"]].dissolve()
-    waterbodies_gdf = waterbodies_gdf[["geometry"]].dissolve()
-    watercourses_gdf = watercourses_gdf[["geometry"]].dissolve()
+def load_data(
+    watershed_name,
+    watershed_path,
+    waterbodies_path,
+    watercourses_path,
+    imagery_path,
+    buffer_width,
+    output_dir="results",
+    multiple_watersheds=False,
+):
+    """
+    Load the required data without user interaction.
 
-    # Access the dissolved geometries
-    watershed_geom = watershed_gdf["geometry"]
-    waterbodies_geom = waterbodies_gdf["geometry"]
-    watercourses_geom = watercourses_gdf["geometry"]
-
-    # Create water bodies and water courses buffer geometry
-    waterbodies_buff_geom = waterbodies_geom.buffer(buffer_width)
-    watercourses_buff_geom = watercourses_geom.buffer(buffer_width)
+    Performs the same checks as load_data_ui(), raising an Exception instead of
+    prompting again when one fails. A results directory is created within output_dir
+    and becomes the working directory.
 
-    # Perform union between the water bodies and water courses buffer geometry
-    water_buff_geom = waterbodies_buff_geom.union(other=watercourses_buff_geom)
+    Parameters
+    ----------
+    watershed_name : str
+        Name of the watershed being evaluated.
 
-    # Clip to watershed boundary
-    water_buff_geom = water_buff_geom.clip(mask=watershed_geom)
+    watershed_path : str
+        Path to the watershed boundary polygon shapefile/geopackage.
 
-    # Get difference of unioned buffers and water bodies to get the outer buffer
-    riparian_buff_geom = water_buff_geom.difference(waterbodies_geom)
+    waterbodies_path : str
+        Path to the water bodies polygon shapefile/geopackage.
 
-    print("done\n")
+    watercourses_path : str
+        Path to the water courses line shapefile/geopackage.
 
-    # Write intermediate data to file
-    print("Exporting riparian buffer...", end="")
+    imagery_path : str
+        Path to the Sentinel-2 multispectral GeoTiff imagery file.
 
-    # Create new GeoDataFrame containing the difference of the geometries
-    # NOTE: This GeoDataFrame is just for saving this intermediate result
-    riparian_buff_gdf = gpd.GeoDataFrame(geometry=riparian_buff_geom)
+    buffer_width : float
+        The width in meters of the riparian buffer. Must be > 0.
 
-    riparian_buff_gdf.to_file(filename="1_riparian_buffer.gpkg", driver="GPKG")
-    print("done\n")
+    output_dir : str, optional
+        The directory in which the results directory is created. The default is
+        'results'.
 
-    print("Riparian buffer can be found here:")
-    print(os.path.abspath("1-riparian_buffer.gpkg") + "\n")
+    multiple_watersheds : bool, optional
+        Whether the watershed boundary may have more than 1 feature. The default is
+        False.
 
-    # Write a log entry
-    with open(log_filepath, "a") as file:
-        file.write(
-            "Riparian buffer completed @ " f" {datetime.now().strftime('%H:%M:%S')}\n\n"
-        )
+    Returns
+    -------
+    data_dict : dictionary
+        The same dictionary as returned by load_data_ui().
+    """
+    watershed_path = os.path.abspath(watershed_path)
+    waterbodies_path = os.path.abspath(waterbodies_path)
+    watercourses_path = os.path.abspath(watercourses_path)
+    imagery_path = os.path.abspath(imagery_path)
+
+    buffer_width = float(buffer_width)
+    if buffer_width <= 0:
+        raise Exception("Error: Buffer width must be a valid integer or float > 0")
+
+    watershed_gdf, imagery_da, imagery_crs = validate_inputs(
+        watershed_path,
+        waterbodies_path,
+        watercourses_path,
+        imagery_path,
+        multiple_watersheds,
+    )
 
-    return riparian_buff_geom
+    results_dir = create_results_dir(watershed_name, output_dir)
+    os.chdir(results_dir)
+
+    log_filepath = start_log(
+        results_dir=results_dir,
+        watershed_name=watershed_name,
+        watershed_path=watershed_path,
+        waterbodies_path=waterbodies_path,
+        watercourses_path=watercourses_path,
+        imagery_path=imagery_path,
+        imagery_crs=imagery_crs,
+        buffer_width=buffer_width,
+    )
 
+    data_dict = {
+        "watershed_name": watershed_name,
+        "watershed": watershed_gdf,
+        "watershed_path": watershed_path,
+        "waterbodies_path": waterbodies_path,
+        "watercourses_path": watercourses_path,
+        "imagery": imagery_da,
+        "imagery_path": imagery_path,
+        "imagery_crs": imagery_crs,
+        "buffer_width": buffer_width,
+        "results_dir": results_dir,
+        "log_filepath": log_filepath,
+    }
 
-# %% 3) Function to perform NDVI image processing - Haley
+    return data_dict
 
 
-def create_ndvi(imagery_da, riparian_buff_geom, log_filepath):
+def open_imagery(imagery_path, bounds=None):
     """
-    Create a Normalized Difference Vegetation Index (NDVI) image of the riparian buffer.
+    Lazily open the Red and NIR bands of a Sentinel-2 GeoTiff.
+
+    Only bands 4 (Red) and 8 (NIR) are selected and, when bounds are given, the
+    DataArray is clipped to them. No pixels are read from disk until the values of the
+    returned DataArray are needed, and then only those of the two bands within the
+    bounds are read.
 
     Parameters
     ----------
+    imagery_path : str
+        Path to the Sentinel-2 GeoTiff where band 4 is the Red band and band 8 is the
+        NIR band.
+
+    bounds : array-like, optional
+        The (minx, miny, maxx, maxy) bounding box, in the imagery's CRS, to clip the
+        imagery to. Usually the bounds of the watershed. The default is None, which
+        keeps the full extent of the scene.
+
+    Returns
+    -------
     imagery_da : RioXarray DataArray
-        Sentinel-2 DataArray where band 4 is the Red band and band 8 is the NIR band.
+        Lazily loaded DataArray containing band 4 and band 8 of the imagery.
+    """
+    imagery_da = rxr.open_rasterio(filename=imagery_path).sel(band=[4, 8])
+    if bounds is not None:
+        imagery_da = imagery_da.rio.clip_box(*bounds)
 
-    riparian_buff_geom : GeoPandas GeoSeries
-        Geometry of the riparian buffer.
+    return imagery_da
 
-    log_filepath : str
-        Path to the log file.
+
+# %% 2) Function to perform vector operations to create riparian zone - Ben
+
+
+def watershed_search_area(watershed_gdf, imagery_crs, buffer_width):
+    """
+    Get the area within which water bodies and water courses affect the buffer.
+
+    Only features within buffer_width of the watershed can contribute to its riparian
+    buffer. The watershed is grown by twice the buffer width so that no such feature
+    is missed when the search area is reprojected to the CRS of another layer.
+
+    Parameters
+    ----------
+    watershed_gdf : GeoPandas GeoDataFrame
+        The watershed boundary.
+
+    imagery_crs : CRS
+        The coordinate reference system of the Sentinel-2 imagery, in meters.
+
+    buffer_width : float
+        The width in meters of the riparian buffer.
 
     Returns
     -------
-    ndvi_da : RioXarray DataArray
-        Normalized Difference Vegetation Index (NDVI) image of the riparian buffer.
+    search_area : GeoPandas GeoSeries
+        A single polygon, in the imagery CRS.
+    """
+    watershed_geom = shapely.union_all(watershed_gdf.to_crs(imagery_crs).geometry)
+    return gpd.GeoSeries([watershed_geom.buffer(2 * buffer_width)], crs=imagery_crs)
 
-        NDVI = (NIR band - Red band) / (NIR band + Red band)
+
+def prefilter_to_search_area(gdf, search_area):
     """
-    print("\nCreating NDVI image of the riparian buffer...")
-    # Set the nodata value to be nan
-    imagery_da.attrs["_FillValue"] = np.nan
+    Keep only the features of a GeoDataFrame that intersect the search area.
 
-    # Clip the DataArray
-    riparian_buff_da = imagery_da.rio.clip(geometries=riparian_buff_geom)
+    The search area is reprojected to the CRS of the GeoDataFrame, rather than the
+    other way around, and the features are selected with its STRtree spatial index.
 
-    # Select the Red band and keep only its long name attribute
-    red_da = riparian_buff_da.sel(band=4)
-    red_da.attrs["long_name"] = red_da.attrs["long_name"][3]
+    Parameters
+    ----------
+    gdf : GeoPandas GeoDataFrame
+        The water bodies or water courses.
 
-    # Select the NIR band and keep only its long name attribute
-    nir_da = riparian_buff_da.sel(band=8)
-    nir_da.attrs["long_name"] = nir_da.attrs["long_name"][7]
+    search_area : GeoPandas GeoSeries
+        The search area returned by watershed_search_area().
 
-    # Calculate NDVI
-    ndvi_da = (nir_da - red_da) / (nir_da + red_da)
-    ndvi_da.attrs["long_name"] = "NDVI (Normalized Difference Vegetation Index)"
+    Returns
+    -------
+    gdf : GeoPandas GeoDataFrame
+        The features of gdf intersecting the search area.
+    """
+    search_geom = search_area.to_crs(gdf.crs).iloc[0]
+    index = gdf.sindex.query(search_geom, predicate="intersects")
+    return gdf.iloc[np.sort(index)]
 
-    print("done\n")
 
-    # Write intermediate data to file
-    print("Exporting NDVI image of riparian buffer...", end="")
-    ndvi_da.rio.to_raster("2-riparian_buffer-NDVI.tiff")
-    print("done\n")
+def _buffer_union(geoms, buffer_width):
+    """Buffer a chunk of geometries and merge the buffers into one geometry."""
+    return shapely.union_all(shapely.buffer(geoms, buffer_width))
 
-    print("Riparian buffer NDVI image can be found here:")
-    print(os.path.abspath("2-riparian_buffer-NDVI.tiff") + "\n")
 
-    # Write a log entry
-    with open(log_filepath, "a") as file:
-        file.write(
-            "Riprian buffer NDVI image completed @"
-            f" {datetime.now().strftime('%H:%M:%S')}\n\n"
-        )
-    # ---------------------------------------------------------------------
+def _cascaded_union(geoms, n_jobs=1):
+    """
+    Merge geometries into one with a hierarchical union.
 
-    return ndvi_da
+    Neighbouring geometries are merged in pairs, then the results in pairs, and so on
+    until one geometry remains, so each union only involves two pieces of similar
+    size. The unions of each level are run in parallel on the same pool of workers.
+    """
+    from joblib import Parallel, delayed
 
+    geoms = list(geoms)
+    if not geoms:
+        return GeometryCollection()
 
-# %% 4) a. Machine suggested threshold using the Otsu Method - Taji
-#  Function to suggest a threshold to separated vegetatedd from non-veg - Taji
+    with Parallel(n_jobs=n_jobs) as parallel:
+        while len(geoms) > 1:
+            pairs = [geoms[i : i + 2] for i in range(0, len(geoms), 2)]
+            geoms = parallel(delayed(shapely.union_all)(pair) for pair in pairs)
+
+    return geoms[0]
 
 
-def otsu_threshold_suggestion(ndvi_da, log_filepath):
+def parallel_buffer(geoms, buffer_width, n_jobs=-1):
     """
-    Suggest a NDVI threshold using the Otsu thresholding method.
+    Buffer geometries and merge the buffers on a pool of worker processes.
+
+    The geometries are ordered along a Hilbert curve and split into spatially compact
+    chunks. Each chunk is buffered and merged by a worker, and the merged chunks are
+    then combined with a hierarchical union. The result is the same as buffering the
+    dissolved geometries.
 
     Parameters
     ----------
-    ndvi_da : RioXarray DataArray
-        Normalized Difference Vegetation Index (NDVI) image of the riparian buffer.
+    geoms : GeoPandas GeoSeries
+        The geometries to buffer.
 
-    log_filepath : str
-        Path to the log file.
+    buffer_width : float
+        The buffer width in the units of the geometries' CRS.
+
+    n_jobs : int, optional
+        The number of worker processes. The default is -1, which uses all available
+        processors. As with joblib, other negative values leave -n_jobs - 1 of them
+        unused.
 
     Returns
     -------
-    None.
+    buffer_geom : Shapely geometry
+        The union of the buffers of all geometries.
     """
-    # Change the nodata values (i.e. _FillValue) to 0 for the threshold_otsu() function
-    #   to work. This must be done on a copy otherwise those changes somehow leak out of
-    #   this function's namespace into the ndvi_da that resides in main()
-    _ndvi_da = ndvi_da.copy()
-    _ndvi_da.attrs["_FillValue"] = 0
-    _ndvi_da.values[np.isnan(_ndvi_da.values)] = 0
+    from joblib import Parallel, delayed
 
-    ## Get Otsu-threshold suggested value
-    ## Code adapted from :
-    # https://scikit-image.org/docs/stable/auto_examples/applications/plot_thresholding.html
+    if n_jobs < 0:
+        n_jobs = max(1, multiprocessing.cpu_count() + 1 + n_jobs)
 
-    # perform automatic local thresholding then give user the suggested threshold
-    suggested_threshold = skimage.filters.threshold_otsu(_ndvi_da.values)
-    suggested_thresh_str = round(float(suggested_threshold), 4)
+    geoms = geoms[~(geoms.is_empty | geoms.isna())]
+    if len(geoms) == 0:
+        return GeometryCollection()
 
-    print(f"Otsu-generated threshold suggestion: {suggested_thresh_str}\n")
+    # Spatially group the geometries so each chunk's buffers overlap one another
+    geoms = geoms.iloc[np.argsort(geoms.hilbert_distance().to_numpy())].to_numpy()
 
-    # Write a log entry
-    with open(log_filepath, "a") as file:
-        file.write(f"Otsu-generated threshold suggestion: {suggested_thresh_str}\n\n")
+    # Several chunks per worker balance the load between dense and sparse areas
+    chunks = [chunk for chunk in np.array_split(geoms, 4 * n_jobs) if len(chunk)]
+    pieces = Parallel(n_jobs=n_jobs)(
+        delayed(_buffer_union)(chunk, buffer_width) for chunk in chunks
+    )
 
+    return _cascaded_union(pieces, n_jobs=n_jobs)
 
-# %% 4) Function to create Riparian Vegetation DataArray - Taji
+
+def _dissolve(gdf):
+    """Dissolve all features into one, which is empty if there are no features."""
+    if len(gdf) == 0:
+        return gpd.GeoDataFrame(geometry=[GeometryCollection()], crs=gdf.crs)
+    return gdf[["geometry"]].dissolve()
 
 
-def create_binary_riparian_da(ndvi_da, log_filepath):
+def vector_operations(
+    watershed_gdf,
+    waterbodies_gdf,
+    watercourses_gdf,
+    imagery_crs,
+    buffer_width,
+    log_filepath,
+    buffer_workers=None,
+    vector_format="gpkg",
+):
     """
-    Create a binary DataArray of riparian vegetation and not-vegetation.
+    Perform vector operations to create a riparian buffer.
 
-    Use the user input NDVI threshold as the break point. Pixel values of the NDVI
-    DataArray that are equal to or over the threshold will be considered vegetation.
-    Pixel values of the NDVI DataArray that are under the threshold will be considered
-    not-vegetation.
+    Create a riparian buffer from the watershed's waterbodies and watercourses.
 
     Parameters
     ----------
-    ndvi_da : RioXarray DataArray
-        Normalized Difference Vegetation Index (NDVI) image of the riparian buffer.
+    watershed_gdf : GeoPandas GeoDataFrame
+        The watershed boundary. Geometry type must be Polygon.
+
+    waterbodies_gdf : GeoPandas GeoDataFrame or str
+        The water bodies within the watershed, or the path to read them from. Geometry
+        type must be Polygon. Only the features that can reach the riparian buffer are
+        read from a path.
+
+    watercourses_gdf : GeoPandas GeoDataFrame or str
+        The water courses within the watershed, or the path to read them from.
+        Geometry type must be LineString. Only the features that can reach the
+        riparian buffer are read from a path.
+
+    imagery_crs : CRS
+        The coordinate reference system of the Sentinel-2 imagery. The GeoDataFrames
+        will be reprojected to this CRS.
+
+    buffer_width : float
+        The width in meters of the riparian buffer. The buffer will be applied to the
+        water bodies and water courses and will be clipped to the watershed boundary.
 
     log_filepath : str
         Path to the log file.
 
+    buffer_workers : int, optional
+        When given, the water bodies and water courses are buffered in spatially
+        grouped chunks on this many worker processes with parallel_buffer(), instead of
+        buffering their dissolved geometries at once. -1 uses all available
+        processors. The default is None.
+
+    vector_format : str, optional
+        The format of the '1_riparian_buffer' output, one of VECTOR_FORMATS. See
+        write_vector(). The default is 'gpkg'.
+
     Returns
     -------
-    riparian_da : RioXarray DataArray
-
-        Riparian buffer pixels classified into vegetation (1) and non-vegetation (2).
-        Nodata is 0.
+    riparian_buff_geom : GeoPandas GeoSeries
+        The geometry of the watershed's riparian buffer.
 
     """
-    # Plot riparian NDVI histogram
-    ndvi_da.plot.hist(bins=50, figsize=(10, 10))
-    plt.title("Histogram of Riparian Zone NDVI Values")
-    plt.savefig("3-riparian_buffer-NDVI_histogram.png")
+    print("\nCreating riparian buffer...", end="")
 
-    # Provide threshold suggestions to the user
-    print("A Histogram of the riparian buffer NDVI values has been saved here:")
-    print(os.path.abspath("4_NDVI_histogram.png") + "\n")
+    with open(log_filepath, "a") as file:
+        file.write(
+            "Computations started @" f" {datetime.now().strftime('%H:%M:%S')}\n\n"
+        )
 
-    print(
-        "Please refer to it and Otsu-generated threshold suggestion to determine an"
-        " appropriate NDVI threshold.\n"
-    )
+    # Drop the water bodies and water courses that cannot reach the watershed's
+    #   riparian buffer before the costly reprojection, dissolve and buffer
+    search_area = watershed_search_area(watershed_gdf, imagery_crs, buffer_width)
+    if isinstance(waterbodies_gdf, str):
+        waterbodies_gdf = read_waterbodies(waterbodies_gdf, search_area)
+    else:
+        waterbodies_gdf = prefilter_to_search_area(waterbodies_gdf, search_area)
+    if isinstance(watercourses_gdf, str):
+        watercourses_gdf = read_watercourses(watercourses_gdf, search_area)
+    else:
+        watercourses_gdf = prefilter_to_search_area(watercourses_gdf, search_area)
 
-    # Input the NDVI threshold
-    loaded = False
-    while loaded == False:
-        threshold = user_input("Please enter the NDVI threshold: ")
-        try:
-            threshold = float(threshold)
-            if threshold > 0 and threshold < 1:
-                loaded = True
-            else:
-                raise Exception
-        except:
-            print("\nError: NDVI threshold must be a decimal number between 0 and 1")
+    # Reproject the GeoDataFrames
+    watershed_gdf = watershed_gdf.to_crs(imagery_crs)
+    waterbodies_gdf = waterbodies_gdf.to_crs(imagery_crs)
+    watercourses_gdf = watercourses_gdf.to_crs(imagery_crs)
 
-    # Write a log entry
-    with open(log_filepath, "a") as file:
-        file.write(f"NDVI threshold input: {threshold}\n\n")
+    if buffer_workers:
+        # Buffer chunks of both layers in parallel and merge them into one geometry
+        water_buff_geom = gpd.GeoSeries(
+            [
+                parallel_buffer(
+                    pd.concat([waterbodies_gdf.geometry, watercourses_gdf.geometry]),
+                    buffer_width,
+                    n_jobs=buffer_workers,
+                )
+            ],
+            crs=imagery_crs,
+        )
 
-    # Specify a threshold and create a binary riparian vegetation DataArray
-    # ------------------------------------------------------------------------
+    # Dissolve the GeoDataFrames
+    watershed_gdf = _dissolve(watershed_gdf)
+    waterbodies_gdf = _dissolve(waterbodies_gdf)
 
-    print("Creating image of riparian buffer vegetation...", end="")
+    # Access the dissolved geometries
+    watershed_geom = watershed_gdf["geometry"]
+    waterbodies_geom = waterbodies_gdf["geometry"]
 
-    # Boolean vegetation DataArray
-    veg_da = ndvi_da >= threshold
+    if not buffer_workers:
+        watercourses_gdf = _dissolve(watercourses_gdf)
+        watercourses_geom = watercourses_gdf["geometry"]
 
-    # Reassign vegetation pixels from True to 1
-    veg_da.values = np.where(veg_da.values == True, 1, 0)
-    veg_da = veg_da.astype("uint8")
+        # Create water bodies and water courses buffer geometry
+        waterbodies_buff_geom = waterbodies_geom.buffer(buffer_width)
+        watercourses_buff_geom = watercourses_geom.buffer(buffer_width)
 
-    # Boolean not-vegetation DataArray
-    not_veg_da = ndvi_da < threshold
+        # Perform union between the water bodies and water courses buffer geometry
+        water_buff_geom = waterbodies_buff_geom.union(other=watercourses_buff_geom)
 
-    # Reassign not-vegetation pixels from True to 2
-    not_veg_da.values = np.where(not_veg_da.values == True, 2, 0)
-    not_veg_da = not_veg_da.astype("uint8")
+    # Clip to watershed boundary
+    water_buff_geom = water_buff_geom.clip(mask=watershed_geom)
 
-    # Create a riparian vegetation/not vegeation DataArray
-    riparian_da = veg_da + not_veg_da
+    # Get difference of unioned buffers and water bodies to get the outer buffer
+    riparian_buff_geom = water_buff_geom.difference(waterbodies_geom)
 
     print("done\n")
 
     # Write intermediate data to file
-    print("Exporting image of riparian buffer vegetation...", end="")
-    riparian_da.rio.to_raster("3-riparian_buffer-vegetation.tiff")
+    print("Exporting riparian buffer...", end="")
+
+    # Create new GeoDataFrame containing the difference of the geometries
+    # NOTE: This GeoDataFrame is just for saving this intermediate result
+    riparian_buff_gdf = gpd.GeoDataFrame(geometry=riparian_buff_geom)
+
+    riparian_buff_path = write_vector(
+        riparian_buff_gdf, "1_riparian_buffer", vector_format
+    )
     print("done\n")
 
-    print("Riparian buffer vegetation image can be found here:")
-    print(os.path.abspath("3-riparian_buffer-vegetation.tiff") + "\n")
+    print("Riparian buffer can be found here:")
+    print(os.path.abspath(riparian_buff_path) + "\n")
 
     # Write a log entry
     with open(log_filepath, "a") as file:
         file.write(
-            "Riprian buffer vegetation image completed @"
-            f" {datetime.now().strftime('%H:%M:%S')}\n\n"
+            "Riparian buffer completed @ " f" {datetime.now().strftime('%H:%M:%S')}\n\n"
         )
 
-    return riparian_da, threshold
+    return riparian_buff_geom
 
 
-# %% 5) Function to convert Riparian Vegetation DataArray to GeoDataFrame - John
+# %% 2) b. Function to create the riparian zone with a distance transform - Ben / John
 
+# The ways the riparian buffer can be created, see raster_buffer()
+BUFFER_MODES = ["vector", "raster"]
 
-def extract_raster_features(da, log_filepath, n_jobs=-1):
-    """
-    Convert a RioXarray DataArray to a GeoPandas GeoDataFrame.
 
-    Contiguous pixels of the same value are turned into polygons with a column named
-    'value' which represents the values of the source pixels. The boundary of the
-    polygons matches the boundary of the pixels.
+def _burn(geoms, out_shape, transform, all_touched=False):
+    """Rasterize geometries into a boolean mask, empty if there are none."""
+    shapes = [geom for geom in geoms if geom is not None and not geom.is_empty]
+    if not shapes:
+        return np.zeros(out_shape, dtype=bool)
+    return features.rasterize(
+        shapes,
+        out_shape=out_shape,
+        transform=transform,
+        all_touched=all_touched,
+        dtype="uint8",
+    ).astype(bool)
 
-    Based on: https://pysal.org/tobler/generated/tobler.dasymetric.extract_raster_features.html
+
+def raster_buffer(
+    watershed_gdf,
+    waterbodies_gdf,
+    watercourses_gdf,
+    imagery_path,
+    buffer_width,
+    log_filepath,
+    block_size=1024,
+):
+    """
+    Create the riparian buffer on the imagery grid with a distance transform.
+
+    Produces the riparian buffer of vector_operations() without buffering, merging or
+    clipping any geometry. The water bodies and water courses are rasterized onto the
+    grid of the imagery, and every pixel whose centre is within buffer_width of the
+    centre of a water pixel, within the watershed and not in a water body is part of
+    the buffer. Each block of block_size pixels is rasterized and distance transformed
+    with a padding of the buffer width, which gives the same distances as a single
+    transform of the whole grid, and written to '1_riparian_buffer.tiff'. Memory use
+    is therefore bounded by the block size rather than by the size of the watershed.
+    The NDVI image is then masked with '1_riparian_buffer.tiff' block by block, so the
+    buffer is never converted to polygons.
 
     Parameters
     ----------
-    da : DataArray
-        The RioXarray DataArray to be converted to a GeoPandas GeoDataFrame. Must
-        have a valid Rasterio CRS (e.g. da.rio.crs).
+    watershed_gdf : GeoPandas GeoDataFrame
+        The watershed boundary. Geometry type must be Polygon.
 
-    n_jobs : int, optional
-        The default is -1. This will then count the number of available processes for
-        multiprocessing.
+    waterbodies_gdf : GeoPandas GeoDataFrame or str
+        The water bodies within the watershed, or the path to read them from. See
+        vector_operations().
+
+    watercourses_gdf : GeoPandas GeoDataFrame or str
+        The water courses within the watershed, or the path to read them from. See
+        vector_operations().
+
+    imagery_path : str
+        Path to the Sentinel-2 GeoTiff whose grid the buffer is created on.
+
+    buffer_width : float
+        The width in meters of the riparian buffer.
 
     log_filepath : str
         Path to the log file.
 
+    block_size : int, optional
+        The width and height in pixels of the blocks of the distance transform. The
+        default is 1024.
+
     Returns
     -------
-    gdf : GeoDataFrame
-        A GeoDataFrame containing Shapely polygons and pixel values.
+    riparian_buff_path : str
+        The path to '1_riparian_buffer.tiff', where the pixels of the watershed's
+        riparian buffer are 1 and the other pixels are 0.
     """
-    # Print initial log message
-    print("Converting the riparian vegetation DataArray to a GeoDataFrame...", end="")
+    from scipy import ndimage
 
-    def _chunk_dfs(geoms_to_chunk, n_jobs):
-        chunk_size = geoms_to_chunk.shape[0] // n_jobs + 1
-        for i in range(n_jobs):
-            start = i * chunk_size
-            yield geoms_to_chunk.iloc[start : start + chunk_size]
+    print("\nCreating riparian buffer with a distance transform...", end="")
 
-    def _apply_parser(df):
-        return df.apply(_parse_geom)
+    with open(log_filepath, "a") as file:
+        file.write(
+            "Computations started @" f" {datetime.now().strftime('%H:%M:%S')}\n\n"
+        )
 
-    def _parse_geom(geom_str):
-        return shape(literal_eval(geom_str))
+    with rasterio.open(imagery_path) as src:
+        imagery_crs = src.crs
+        search_area = watershed_search_area(watershed_gdf, imagery_crs, buffer_width)
 
-    # CRS of the DataArray
-    raster_crs = da.rio.crs
-
-    # Convert regions to polygons
-    shapes = list(features.shapes(da.values, transform=da.rio.transform()))
+        # Pixel window of the imagery covering the features that reach the buffer
+        window = features.geometry_window(src, search_area)
+        transform = src.window_transform(window)
+        out_shape = (int(window.height), int(window.width))
 
-    # Get number of processes for multiprocessing
-    if n_jobs == -1:
-        n_jobs = multiprocessing.cpu_count()
+    if isinstance(waterbodies_gdf, str):
+        waterbodies_gdf = read_waterbodies(waterbodies_gdf, search_area)
+    else:
+        waterbodies_gdf = prefilter_to_search_area(waterbodies_gdf, search_area)
+    if isinstance(watercourses_gdf, str):
+        watercourses_gdf = read_watercourses(watercourses_gdf, search_area)
+    else:
+        watercourses_gdf = prefilter_to_search_area(watercourses_gdf, search_area)
+
+    waterbodies_geoms = waterbodies_gdf.geometry.to_crs(imagery_crs)
+    watercourses_geoms = watercourses_gdf.geometry.to_crs(imagery_crs)
+    watershed_geoms = watershed_gdf.geometry.to_crs(imagery_crs)
+
+    # Any water pixel within buffer_width of a block is within its padding
+    pixel_width, pixel_height = abs(transform.a), abs(transform.e)
+    pad = int(np.ceil(buffer_width / min(pixel_width, pixel_height)))
+    grid = Window(0, 0, out_shape[1], out_shape[0])
+    profile = {
+        "driver": "GTiff",
+        "height": out_shape[0],
+        "width": out_shape[1],
+        "count": 1,
+        "dtype": "uint8",
+        "crs": imagery_crs,
+        "transform": transform,
+        "nodata": 0,
+        **_tiled_profile("deflate"),
+    }
+    with rasterio.open("1_riparian_buffer.tiff", "w", **profile) as dst:
+        for block in _block_windows(out_shape[0], out_shape[1], block_size):
+            padded = Window(
+                block.col_off - pad,
+                block.row_off - pad,
+                block.width + 2 * pad,
+                block.height + 2 * pad,
+            ).intersection(grid)
+            padded_shape = (int(padded.height), int(padded.width))
+            padded_transform = rasterio.windows.transform(padded, transform)
+            padded_box = shapely.box(*rasterio.windows.bounds(padded, transform))
+            row_start = block.row_off - padded.row_off
+            col_start = block.col_off - padded.col_off
+            inner = (
+                slice(row_start, row_start + block.height),
+                slice(col_start, col_start + block.width),
+            )
+
+            # Only the features near the block are rasterized. Water courses mark
+            #   every pixel they touch, as they are thinner than a pixel
+            waterbodies = _burn(
+                waterbodies_geoms.iloc[waterbodies_geoms.sindex.query(padded_box)],
+                padded_shape,
+                padded_transform,
+            )
+            water = waterbodies | _burn(
+                watercourses_geoms.iloc[watercourses_geoms.sindex.query(padded_box)],
+                padded_shape,
+                padded_transform,
+                all_touched=True,
+            )
+            riparian = ~waterbodies[inner] & _burn(
+                watershed_geoms,
+                (block.height, block.width),
+                rasterio.windows.transform(block, transform),
+            )
+            if water.any() and riparian.any():
+                distance = ndimage.distance_transform_edt(
+                    ~water, sampling=(pixel_height, pixel_width)
+                )
+                riparian &= distance[inner] <= buffer_width
+            else:
+                riparian[:] = False
+            dst.write(riparian.astype("uint8"), 1, window=block)
 
-    res = list(zip(*shapes))
-    geoms = pd.Series(res[0], name="geometry").astype(str)
-    pieces = _chunk_dfs(geoms, n_jobs)
-    geoms = pd.concat(
-        Parallel(n_jobs=n_jobs)(delayed(_apply_parser)(i) for i in pieces)
-    )
+    print("done\n")
 
-    geoms = gpd.GeoSeries(geoms).buffer(0)  # we sometimes get self-intersecting rings
-    vals = pd.Series(res[1], name="value")
-    riparian_gdf = gpd.GeoDataFrame(vals, geometry=geoms, crs=raster_crs)
+    print("Riparian buffer can be found here:")
+    print(os.path.abspath("1_riparian_buffer.tiff") + "\n")
 
     # Write a log entry
     with open(log_filepath, "a") as file:
         file.write(
-            "Riprian buffer vegetation image converted to vector @"
+            "Riparian buffer completed with a distance transform of"
+            f" {out_shape[0] * out_shape[1]} pixels @"
             f" {datetime.now().strftime('%H:%M:%S')}\n\n"
         )
 
-    # Subset by vegetation and not-vegetation features
-    vegetation_gdf = riparian_gdf.loc[riparian_gdf["value"] == 1]
-    not_vegetation_gdf = riparian_gdf.loc[riparian_gdf["value"] == 2]
-
-    # Dissolve all riparian features into unique contiguous features
-    riparian_buffer_gdf = (
-        riparian_gdf.loc[(riparian_gdf["value"] == 1) | (riparian_gdf["value"] == 2)]
-        .dissolve()
-        .explode(ignore_index=True)
-    )
-
-    # Print completed log message
-    print("done\n")
-
-    # Save the results to a dictionary
-
-    riparian_dict = {
-        "riparian_buffer_gdf": riparian_buffer_gdf,
-        "vegetation_gdf": vegetation_gdf,
-        "not_vegetation_gdf": not_vegetation_gdf,
-    }
-
-    # Write intermediate data to file
-    print("Exporting riparian buffer vegetation geopackages...", end="")
-    vegetation_gdf.to_file(filename="4-riparian_buffer-vegetation.gpkg", driver="GPKG")
-    not_vegetation_gdf.to_file(
-        filename="4-riparian_buffer-not_vegetation.gpkg", driver="GPKG"
-    )
-    riparian_buffer_gdf.to_file(filename="4-riparian_buffer.gpkg", driver="GPKG")
-
-    print("done\n")
-
-    return riparian_dict
-
+    return "1_riparian_buffer.tiff"
 
-# %% 6) Function to calculate Riparian Connectivity Statistics - John / team
 
+def _buffer_mask_windows(mask_path, transform):
+    """
+    Find the pixel windows of the extent of the buffer pixels of a raster_buffer() mask.
 
-def riparian_stats(
-    watershed_name,
-    buffer_width,
-    ndvi_threshold,
-    watershed_gdf,
-    riparian_buffer_gdf,
-    vegetation_gdf,
-    not_vegetation_gdf,
-    log_filepath,
-):
+    The mask is read one block at a time. Returns the window of the extent on the grid
+    of transform and the window of the extent on the mask.
     """
-    Generate statistics related to the riparian buffer.
+    with rasterio.open(mask_path) as src:
+        rows, cols = [], []
+        for _, block in src.block_windows(1):
+            inside = src.read(1, window=block).astype(bool)
+            if inside.any():
+                block_rows = np.flatnonzero(inside.any(axis=1)) + block.row_off
+                block_cols = np.flatnonzero(inside.any(axis=0)) + block.col_off
+                rows += [block_rows[0], block_rows[-1] + 1]
+                cols += [block_cols[0], block_cols[-1] + 1]
+        if rows:
+            mask_window = Window.from_slices(
+                (min(rows), max(rows)), (min(cols), max(cols))
+            )
+        else:
+            mask_window = Window(0, 0, src.width, src.height)
+        bounds = rasterio.windows.bounds(mask_window, src.transform)
+
+    window = rasterio.windows.from_bounds(*bounds, transform=transform)
+    return window.round_offsets().round_lengths(), mask_window
 
-    Parameters
-    ----------
-    watershed_name : str
-        Name of the watershed being evaluated.
 
-    buffer_width : float
-        The width in meters of the riparian buffer. Included in the table of statistics
-        for reference purposes.
+# %% 3) Function to perform NDVI image processing - Haley
 
-    ndvi_threshold : float
-        The NDVI threshold used to classify pixels as vegetation and not-vegetation.
-        Included in the table of statistics for reference purposes.
+# Data types the NDVI image can be computed and stored in. int16 NDVI values are
+#   stored scaled, i.e. NDVI = value * NDVI_INT16_SCALE
+NDVI_PRECISIONS = ["float64", "float32", "int16"]
+NDVI_INT16_SCALE = 1e-4
+NDVI_INT16_NODATA = -32768
 
-    watershed_gdf : GeoPandas GeoDataFrame
-        The watershed being evaluated. Needed for the calculation of the watershed's
-        total area.
 
-    riparian_buffer_gdf : GeoPandas GeoDataFrame
-        The riparian buffer features. Needed for the calculation of the number of
-        riparian buffer features, area, and perimeter.
+def _compute_dtype(precision):
+    """Return the floating point data type NDVI values are computed in."""
+    return "float64" if precision == "float64" else "float32"
 
-    vegetation_gdf : GeoPandas GeoDataFrame
-        The vegetation features that fall within the riparian buffer. Needed for the
-        calculation of the number of riparian vegetation features, area, and perimeter.
 
-    not_vegetation_gdf : GeoPandas GeoDataFrame
-        The not-vegetation features that fall within the riparian buffer. Needed for the
-        calculation of the number of riparian not-vegetation features, area, and
-        perimeter.
+def _encode_ndvi(ndvi, precision):
+    """Convert NDVI values, with nan nodata, to the data type they are stored in."""
+    if precision != "int16":
+        return ndvi.astype(precision, copy=False)
 
-    log_filepath : str
-        Path to the log file.
+    encoded = np.full(ndvi.shape, NDVI_INT16_NODATA, dtype="int16")
+    valid = ~np.isnan(ndvi)
+    encoded[valid] = np.rint(ndvi[valid] / NDVI_INT16_SCALE)
+    return encoded
 
 
-    Returns
-    -------
-    stats_df : Pandas DataFrame
-        A DataFrame with the following column names and associated values:
+# Compression codecs of Cloud-Optimized GeoTIFF outputs
+COG_COMPRESSIONS = ["deflate", "zstd"]
 
-        'Watershed name'
-            The name of the watershed being evaluated.
+# Size in pixels of the internal tiles of Cloud-Optimized GeoTIFF outputs
+COG_BLOCK_SIZE = 512
 
-        'Watershed area (km2)'
-            The area of the watershed (km2).
 
-        'Riparian buffer area (km2)'
-            The area of the riparian buffer (km2).
+def _tiled_profile(cog):
+    """
+    Return the creation options of an internally tiled, compressed GeoTIFF.
 
-        'Vegetation area (km2)'
-            The area of the riparian buffer classified as vegetation (km2).
+    Used for outputs written block by block before their conversion by to_cog().
+    Returns an empty dictionary, i.e. the default stripped and uncompressed layout,
+    when cog is None.
+    """
+    if cog is None:
+        return {}
+    return {
+        "tiled": True,
+        "blockxsize": COG_BLOCK_SIZE,
+        "blockysize": COG_BLOCK_SIZE,
+        "compress": cog,
+    }
 
-        'Not-vegetation area (km2)'
-            The area of the riparian buffer classified as not-vegetation (km2).
 
-        'Vegetation coverage (%)'
-            The percentage of the riparian buffer's area that is covered by vegetation.
-            (Vegetation area / Riparian area) * 100
+def to_cog(path, compression="deflate", overview_resampling="nearest", nodata=None):
+    """
+    Convert a GeoTIFF in place to a Cloud-Optimized GeoTIFF (COG).
 
-        'Not-vegetation coverage (%)'
-            The percentage of the riparian buffer's area that is not covered by
-            vegetation.
-            (Not-vegetation area / Riparian area) * 100
+    The COG is internally tiled, compressed with a predictor and has internal
+    overviews. GDAL's COG driver streams the pixels from the source file, so memory
+    use does not grow with the size of the image.
 
-        'Mean area of not-vegetation patches (km2)'
-            The mean area (km2) of the not-vegetation features in the riparian buffer.
+    Parameters
+    ----------
+    path : str
+        Path to the GeoTIFF, which is replaced by the COG.
 
-        'Number of riparian buffer features'
-            The number of separate riparian buffer features.
+    compression : str, optional
+        One of COG_COMPRESSIONS. The default is 'deflate'.
 
-        'Number of vegetation features'
-            The number of separate vegetation features in the riparian buffer.
+    overview_resampling : str, optional
+        The resampling method of the overviews, e.g. 'average' for continuous values
+        or 'mode' for classes. The default is 'nearest'.
 
-        'Number of not-vegetation features'
-            The number of separate not-vegetation features in the riparian buffer.
+    nodata : float, optional
+        A nodata value to set on an output that has none. The default is None, which
+        keeps the nodata value of the GeoTIFF.
+    """
+    if nodata is not None:
+        with rasterio.open(path, "r+") as dst:
+            dst.nodata = nodata
+
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    rasterio.shutil.copy(
+        path,
+        temp_path,
+        driver="COG",
+        compress=compression,
+        # Horizontal differencing for integers, floating point prediction for floats
+        predictor="YES",
+        blocksize=COG_BLOCK_SIZE,
+        overviews="AUTO",
+        overview_resampling=overview_resampling,
+        bigtiff="IF_SAFER",
+    )
+    os.replace(temp_path, path)
 
-        'Perimeter of riparian buffer (km)'
-            The total perimeter (km) of the riparian buffer features.
 
-        'Perimeter of vegetation features (km)'
-            The total perimeter (km) of the vegetation features.
+def _read_ndvi(src, window=None):
+    """Read NDVI values from an open NDVI image as floats, with nan nodata."""
+    ndvi = src.read(1, window=window, masked=True)
+    if np.issubdtype(ndvi.dtype, np.integer):
+        ndvi = ndvi.astype("float32") * np.float32(src.scales[0])
+    return ndvi.filled(np.nan)
 
-        'Perimeter of not-vegetation features (km)'
-            The total perimeter (km) of the not-vegetation features.
 
-        'Vegetation Connectivity'
-            A rough metric to quantifiy the connectivity of the riparian features.
-            Number of riparian buffer features / Number of vegetation features
+def create_ndvi(
+    imagery_da, riparian_buff_geom, log_filepath, precision="float64", cog=None
+):
+    """
+    Create a Normalized Difference Vegetation Index (NDVI) image of the riparian buffer.
 
-        'Vegetation Compactness'
-            An attempt to quantify the the compactness of the riparian vegetation
-            features. The long name of this could be 'normalized isoperimetric ratio'.
-            See script README.md for more info.
+    Parameters
+    ----------
+    imagery_da : RioXarray DataArray
+        Sentinel-2 DataArray where band 4 is the Red band and band 8 is the NIR band.
 
-            # Reference compactness i.e. riparian buffer compactness
-            riparian_compactness =  riparian_perimeter**2 / riparian_area
+    riparian_buff_geom : GeoPandas GeoSeries or str
+        Geometry of the riparian buffer, or the path to the raster mask of the buffer
+        written by raster_buffer().
 
-            # Actual compactness i.e. riparian vegetation compactness
-            vegetation_compactness = veg_perimeter**2 / veg_area
+    log_filepath : str
+        Path to the log file.
 
-            # Normalized compactness
-            compactness =  riparian_compactness / actual_compactness
+    precision : str, optional
+        One of NDVI_PRECISIONS. 'float64' (the default) computes and stores the NDVI
+        image in 64 bit floats, 'float32' in 32 bit floats and 'int16' computes it in
+        32 bit floats and stores it as 16 bit integers scaled by NDVI_INT16_SCALE.
 
-    """
-    # Print initial log message
-    print("Calculating riparian statistics...", end="")
+    cog : str, optional
+        When given, the output is written as a Cloud-Optimized GeoTIFF compressed with
+        this codec, one of COG_COMPRESSIONS. See to_cog(). The default is None, which
+        writes a plain GeoTIFF.
 
-    # Area of features
-    veg_area = vegetation_gdf["geometry"].area.sum() / 1_000_000
-    not_veg_area = not_vegetation_gdf["geometry"].area.sum() / 1_000_000
-    riparian_area = riparian_buffer_gdf["geometry"].area.sum() / 1_000_000
-    watershed_area = watershed_gdf["geometry"].area.sum() / 1_000_000
+    Returns
+    -------
+    ndvi_da : RioXarray DataArray
+        Normalized Difference Vegetation Index (NDVI) image of the riparian buffer.
 
-    # Mean patch size of not-vegetation features
-    not_veg_mean_size = not_vegetation_gdf["geometry"].area.mean() / 1_000_000
+        NDVI = (NIR band - Red band) / (NIR band + Red band)
+    """
+    print("\nCreating NDVI image of the riparian buffer...")
+    # Compute in the requested floating point precision
+    imagery_da = imagery_da.astype(_compute_dtype(precision))
 
-    # Perimeter of features
-    veg_perimeter = vegetation_gdf["geometry"].length.sum() / 1000
-    not_veg_perimeter = not_vegetation_gdf["geometry"].length.sum() / 1000
-    riparian_perimeter = riparian_buffer_gdf["geometry"].length.sum() / 1000
+    # Set the nodata value to be nan
+    imagery_da.attrs["_FillValue"] = np.nan
 
-    # Number of features
-    veg_n_feature = len(vegetation_gdf)
-    not_veg_n_feature = len(not_vegetation_gdf)
-    riparian_n_feature = len(riparian_buffer_gdf)  # Not used yet
+    # Clip the DataArray
+    if isinstance(riparian_buff_geom, str):
+        # The imagery is clipped to the watershed, which contains every buffer pixel
+        buffer_window, mask_window = _buffer_mask_windows(
+            riparian_buff_geom, imagery_da.rio.transform()
+        )
+        height, width = imagery_da.rio.shape
+        window = buffer_window.intersection(Window(0, 0, width, height))
+        with rasterio.open(riparian_buff_geom) as src:
+            inside = src.read(
+                1,
+                window=Window(
+                    mask_window.col_off + window.col_off - buffer_window.col_off,
+                    mask_window.row_off + window.row_off - buffer_window.row_off,
+                    window.width,
+                    window.height,
+                ),
+            )
+        riparian_buff_da = imagery_da.rio.isel_window(window).where(
+            xr.DataArray(inside.astype(bool), dims=("y", "x"))
+        )
+    else:
+        riparian_buff_da = imagery_da.rio.clip(geometries=riparian_buff_geom)
 
-    # Coverage of total riparian area
-    veg_coverage = veg_area / riparian_area * 100
-    not_veg_coverage = not_veg_area / riparian_area * 100
+    # Select the Red band and keep only its long name attribute
+    red_da = riparian_buff_da.sel(band=4)
+    red_da.attrs["long_name"] = red_da.attrs["long_name"][3]
 
-    # Connectivity
-    connectivity = riparian_n_feature / veg_n_feature
+    # Select the NIR band and keep only its long name attribute
+    nir_da = riparian_buff_da.sel(band=8)
+    nir_da.attrs["long_name"] = nir_da.attrs["long_name"][7]
 
-    # Compactness aka normalized isoperimetric ratio
-    # Adapted from p21 of: http://www.cyto.purdue.edu/cdroms/micro2/content/education/wirth10.pdf
-    riparian_compactness = riparian_perimeter**2 / riparian_area
-    vegetation_compactness = veg_perimeter**2 / veg_area
-    compactness = riparian_compactness / vegetation_compactness
+    # Calculate NDVI
+    ndvi_da = (nir_da - red_da) / (nir_da + red_da)
+    ndvi_da.attrs["long_name"] = "NDVI (Normalized Difference Vegetation Index)"
 
-    data = {
-        "Watershed name": [watershed_name],
-        "Buffer width:": [buffer_width],
-        "NDVI threshold": [ndvi_threshold],
-        "Watershed area (km2)": [watershed_area],
-        "Riparian buffer area (km2)": [riparian_area],
-        "Vegetation area (km2)": [veg_area],
-        "Not-vegetation area (km2)": [not_veg_area],
-        "Vegetation coverage (%)": [veg_coverage],
-        "Not-vegetation coverage (%)": [not_veg_coverage],
-        "Mean area of not-vegetation patches (km2)": [not_veg_mean_size],
-        "Number of riparian buffer features": [riparian_n_feature],
-        "Number of vegetation features": [veg_n_feature],
-        "Number of not-vegetation features": [not_veg_n_feature],
-        "Perimeter of riparian buffer (km)": [riparian_perimeter],
-        "Perimeter of vegetation features (km)": [veg_perimeter],
-        "Perimeter of not-vegetation features (km)": [not_veg_perimeter],
-        "Vegetation Connectivity": [connectivity],
-        "Vegetation Compactness": [compactness],
-    }
+    print("done\n")
 
-    stats_df = pd.DataFrame.from_dict(data=data)
+    # Write intermediate data to file
+    print("Exporting NDVI image of riparian buffer...", end="")
+    if precision == "int16":
+        encoded_da = ndvi_da.copy(data=_encode_ndvi(ndvi_da.values, precision))
+        encoded_da.rio.write_nodata(NDVI_INT16_NODATA, inplace=True)
+        encoded_da.rio.to_raster("2-riparian_buffer-NDVI.tiff", **_tiled_profile(cog))
+        with rasterio.open("2-riparian_buffer-NDVI.tiff", "r+") as dst:
+            dst.scales = (NDVI_INT16_SCALE,)
+    else:
+        ndvi_da.rio.to_raster("2-riparian_buffer-NDVI.tiff", **_tiled_profile(cog))
+    if cog:
+        to_cog("2-riparian_buffer-NDVI.tiff", cog, overview_resampling="average")
+    if precision == "int16":
+        # Continue with the NDVI values as they are stored
+        ndvi_da = open_ndvi("2-riparian_buffer-NDVI.tiff")
+    print("done\n")
 
-    print("done")
+    print("Riparian buffer NDVI image can be found here:")
+    print(os.path.abspath("2-riparian_buffer-NDVI.tiff") + "\n")
 
     # Write a log entry
     with open(log_filepath, "a") as file:
         file.write(
-            "Riparian statistics completed @"
+            "Riprian buffer NDVI image completed @"
             f" {datetime.now().strftime('%H:%M:%S')}\n\n"
         )
-        file.write("Results:\n")
-        file.write(stats_df.transpose().to_string())
+    # ---------------------------------------------------------------------
 
-    # FOR DEBUGGING ------------------------------------------------------
-    # Write intermediate data to file for debugging
-    print("\nExporting results...", end="")
+    return ndvi_da
 
-    stats_df.to_csv("4-statistics_table.csv")
 
-    print("done\n")
+def _block_windows(height, width, block_size):
+    """Yield windows of at most block_size x block_size pixels covering a grid."""
+    for row_off in range(0, height, block_size):
+        for col_off in range(0, width, block_size):
+            yield Window(
+                col_off=col_off,
+                row_off=row_off,
+                width=min(block_size, width - col_off),
+                height=min(block_size, height - row_off),
+            )
 
-    return stats_df
 
+# State shared with the functions run by _map_blocks(), set once per worker process
+_WORKER_STATE = {}
 
-# %% 7) Function to produce a report - John & Haley
+
+def _init_worker(state):
+    """Store the state needed by the functions run in a worker process."""
+    _WORKER_STATE.update(state)
 
 
-def report(stats_df, vegetation_gdf, not_vegetation_gdf, log_filepath):
+def _map_blocks(func, blocks, n_jobs=1, state=None):
     """
-    Write an HTML report to the results directory.
+    Apply a function to blocks of a raster, optionally on a pool of processes.
 
-    The report contains the statistical results and an interactive folium map.
+    At most 2 * n_jobs blocks are in flight at any time so that the memory used by
+    blocks waiting to be processed, or their results waiting to be consumed, stays
+    bounded. Results are yielded in the order they complete.
 
     Parameters
     ----------
-    stats_df : Pandas DataFrame
-        The DataFrame containing the riparian connectivity statistics. Displayed as an
-        HTML table in the report.
+    func : callable
+        A module level function taking a single block as its argument. It can access
+        the state through _WORKER_STATE.
 
-    vegetation_gdf : GeoPandas GeoDataFrame
-        The GeoDataFrame containing the riparian buffer vegetation features. Displayed
-        in an interactive Folium map.
+    blocks : iterable
+        The blocks to process, e.g. Rasterio windows.
 
-    not_vegetation_gdf : GeoPandas GeoDataFrame
-        The GeoDataFrame containing the riparian buffer not-vegetation features.
-        Displayed in an interactive Folium map.
+    n_jobs : int, optional
+        The number of worker processes. The default is 1, which processes the blocks
+        in the current process. -1 uses all available processors and, as with joblib,
+        other negative values leave -n_jobs - 1 of them unused.
 
-    log_filepath : str
-        Path to the log file.
+    state : dictionary, optional
+        State made available to func through _WORKER_STATE in each worker.
 
-    Returns
-    -------
+    Yields
+    ------
+    result : object
+        The result of func for each block.
+    """
+    if n_jobs == 0:
+        raise Exception("Error: The number of worker processes cannot be 0.")
+    if n_jobs < 0:
+        n_jobs = max(1, multiprocessing.cpu_count() + 1 + n_jobs)
+
+    if n_jobs == 1:
+        _init_worker(state or {})
+        for block in blocks:
+            yield func(block)
+        return
+
+    with ProcessPoolExecutor(
+        max_workers=n_jobs, initializer=_init_worker, initargs=(state or {},)
+    ) as executor:
+        pending = set()
+        for block in blocks:
+            pending.add(executor.submit(func, block))
+            if len(pending) >= 2 * n_jobs:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        for future in as_completed(pending):
+            yield future.result()
+
+
+def _ndvi_block(block):
+    """
+    Compute one block of the NDVI image of the riparian buffer.
+
+    Uses the imagery_path, geoms or mask_path and mask_window, clip_window and
+    precision of _WORKER_STATE.
+
+    Parameters
+    ----------
+    block : Rasterio Window
+        The block, relative to the clip window of the riparian buffer.
+
+    Returns
+    -------
+    block : Rasterio Window
+        The block, unchanged.
+
+    ndvi : numpy.ndarray
+        The NDVI values of the block in the data type of the precision. Pixels outside
+        of the riparian buffer are nodata.
+    """
+    clip_window = _WORKER_STATE["clip_window"]
+    src_block = Window(
+        col_off=clip_window.col_off + block.col_off,
+        row_off=clip_window.row_off + block.row_off,
+        width=block.width,
+        height=block.height,
+    )
+    precision = _WORKER_STATE["precision"]
+    with rasterio.open(_WORKER_STATE["imagery_path"]) as src:
+        red = src.read(4, window=src_block, out_dtype=_compute_dtype(precision))
+        nir = src.read(8, window=src_block, out_dtype=_compute_dtype(precision))
+        block_transform = src.window_transform(src_block)
+
+    # Pixels of the block that fall within the riparian buffer
+    if "mask_path" in _WORKER_STATE:
+        mask_window = _WORKER_STATE["mask_window"]
+        with rasterio.open(_WORKER_STATE["mask_path"]) as src:
+            inside = src.read(
+                1,
+                window=Window(
+                    col_off=mask_window.col_off + block.col_off,
+                    row_off=mask_window.row_off + block.row_off,
+                    width=block.width,
+                    height=block.height,
+                ),
+            ).astype(bool)
+    else:
+        inside = features.geometry_mask(
+            _WORKER_STATE["geoms"],
+            out_shape=red.shape,
+            transform=block_transform,
+            invert=True,
+        )
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ndvi = (nir - red) / (nir + red)
+    ndvi[~inside] = np.nan
+
+    return block, _encode_ndvi(ndvi, precision)
+
+
+def create_ndvi_windowed(
+    imagery_path,
+    riparian_buff_geom,
+    log_filepath,
+    block_size=1024,
+    n_jobs=1,
+    precision="float64",
+    cog=None,
+):
+    """
+    Create an NDVI image of the riparian buffer one block of pixels at a time.
+
+    Produces the same NDVI image as create_ndvi() but never holds more than one
+    block_size x block_size block of the Red, NIR and NDVI arrays in memory. The
+    imagery is read from disk with Rasterio windows and each block of NDVI values is
+    written straight to the '2-riparian_buffer-NDVI.tiff' output, so peak memory is
+    bounded by the block size rather than by the size of the scene.
+
+    Parameters
+    ----------
+    imagery_path : str
+        Path to the Sentinel-2 GeoTiff where band 4 is the Red band and band 8 is the
+        NIR band.
+
+    riparian_buff_geom : GeoPandas GeoSeries or str
+        Geometry of the riparian buffer, or the path to the raster mask of the buffer
+        written by raster_buffer(), which is read one block at a time.
+
+    log_filepath : str
+        Path to the log file.
+
+    block_size : int, optional
+        The width and height in pixels of the blocks that are read, processed and
+        written. The default is 1024.
+
+    n_jobs : int, optional
+        The number of processes computing blocks in parallel. The default is 1. -1
+        uses all available processors.
+
+    precision : str, optional
+        The data type the NDVI image is computed and stored in. See create_ndvi().
+        The default is 'float64'.
+
+    cog : str, optional
+        When given, the output is written as a Cloud-Optimized GeoTIFF compressed with
+        this codec. See create_ndvi(). The default is None.
+
+    Returns
+    -------
+    ndvi_da : RioXarray DataArray
+        Normalized Difference Vegetation Index (NDVI) image of the riparian buffer,
+        lazily opened from the '2-riparian_buffer-NDVI.tiff' output.
+
+        NDVI = (NIR band - Red band) / (NIR band + Red band)
+    """
+    print(f"\nCreating NDVI image of the riparian buffer in {block_size} px blocks...")
+
+    if isinstance(riparian_buff_geom, str):
+        state = {"mask_path": riparian_buff_geom}
+    else:
+        state = {
+            "geoms": [
+                geom
+                for geom in riparian_buff_geom
+                if geom is not None and not geom.is_empty
+            ]
+        }
+
+    with rasterio.open(imagery_path) as src:
+        # Pixel window of the imagery covered by the riparian buffer
+        if "mask_path" in state:
+            clip_window, state["mask_window"] = _buffer_mask_windows(
+                state["mask_path"], src.transform
+            )
+        else:
+            clip_window = features.geometry_window(src, state["geoms"])
+        clip_transform = src.window_transform(clip_window)
+        height, width = int(clip_window.height), int(clip_window.width)
+
+        profile = {
+            "driver": "GTiff",
+            "height": height,
+            "width": width,
+            "count": 1,
+            "dtype": precision,
+            "crs": src.crs,
+            "transform": clip_transform,
+            "nodata": NDVI_INT16_NODATA if precision == "int16" else np.nan,
+            **_tiled_profile(cog),
+        }
+
+    state.update(
+        imagery_path=imagery_path, clip_window=clip_window, precision=precision
+    )
+    with rasterio.open("2-riparian_buffer-NDVI.tiff", "w", **profile) as dst:
+        dst.set_band_description(1, "NDVI (Normalized Difference Vegetation Index)")
+        if precision == "int16":
+            dst.scales = (NDVI_INT16_SCALE,)
+
+        for block, ndvi in _map_blocks(
+            _ndvi_block,
+            _block_windows(height, width, block_size),
+            n_jobs=n_jobs,
+            state=state,
+        ):
+            dst.write(ndvi, 1, window=block)
+
+    if cog:
+        to_cog("2-riparian_buffer-NDVI.tiff", cog, overview_resampling="average")
+
+    print("done\n")
+
+    print("Riparian buffer NDVI image can be found here:")
+    print(os.path.abspath("2-riparian_buffer-NDVI.tiff") + "\n")
+
+    # Write a log entry
+    with open(log_filepath, "a") as file:
+        file.write(
+            f"Riprian buffer NDVI image completed in {block_size} px blocks @"
+            f" {datetime.now().strftime('%H:%M:%S')}\n\n"
+        )
+
+    # Lazily open the output so it is only read when its values are needed
+    return open_ndvi("2-riparian_buffer-NDVI.tiff")
+
+
+def open_ndvi(ndvi_path):
+    """Lazily open an NDVI image of the riparian buffer as a 2D float DataArray."""
+    ndvi_da = rxr.open_rasterio(ndvi_path, mask_and_scale=True).squeeze(
+        "band", drop=True
+    )
+    ndvi_da.attrs["long_name"] = "NDVI (Normalized Difference Vegetation Index)"
+
+    return ndvi_da
+
+
+# %% 3) b. Functions to composite the NDVI of a time series of scenes - Haley / John
+
+# Composites of the NDVI time series that can be used as the NDVI image
+NDVI_COMPOSITES = ["median", "max"]
+
+# Metadata tags holding the acquisition date of a scene, in order of preference
+SCENE_DATE_TAGS = [
+    "ACQUISITION_DATE",
+    "DATATAKE_1_DATATAKE_SENSING_START",
+    "TIFFTAG_DATETIME",
+]
+
+
+def _scene_date(path):
+    """Return the acquisition date of a scene from its tags, or None."""
+    with rasterio.open(path) as src:
+        tags = src.tags()
+    for tag in SCENE_DATE_TAGS:
+        if tags.get(tag):
+            return tags[tag]
+    return None
+
+
+def open_imagery_stack(imagery_paths, bounds=None, chunk_size=1024):
+    """
+    Lazily open the Red and NIR bands of several Sentinel-2 scenes as one stack.
+
+    The scenes must share the grid of the first scene, i.e. be acquisitions of the
+    same Sentinel-2 tile. This is checked from their metadata before any pixels are
+    read. The stack is chunked so that every chunk holds all the dates of its pixels,
+    as needed to composite them, and the chunks are made smaller as the number of
+    scenes grows so that a chunk holds as many values as a chunk_size x chunk_size
+    chunk of one scene.
+
+    Parameters
+    ----------
+    imagery_paths : list of str
+        Paths to the Sentinel-2 GeoTiffs where band 4 is the Red band and band 8 is
+        the NIR band.
+
+    bounds : array-like, optional
+        The (minx, miny, maxx, maxy) bounding box, in the imagery's CRS, to clip the
+        stack to. The default is None, which keeps the full extent of the scenes.
+
+    chunk_size : int, optional
+        The size in pixels of the chunks of one scene. The default is 1024.
+
+    Returns
+    -------
+    imagery_da : RioXarray DataArray
+        Dask-backed DataArray with dimensions (time, band, y, x), where the time
+        coordinate is the index of each scene in imagery_paths.
+    """
+    with rasterio.open(imagery_paths[0]) as src:
+        reference = (src.crs, src.transform, src.width, src.height)
+    for path in imagery_paths:
+        with rasterio.open(path) as src:
+            if src.count < 8:
+                raise Exception(
+                    f"Error: Missing Band 8 (NIR) in '{path}'. Bands 4 and 8 are"
+                    " required for the calculation of the Normalized Vegetation"
+                    " Difference Index."
+                )
+            if (src.crs, src.transform, src.width, src.height) != reference:
+                raise Exception(
+                    f"Error: The grid of '{path}' does not match that of"
+                    f" '{imagery_paths[0]}'. Expected scenes of the same Sentinel-2"
+                    " tile with the same CRS, extent and resolution."
+                )
+
+    # Keep the values of one chunk of the stack about as many as one scene's chunk
+    chunk_size = max(128, int(chunk_size / np.sqrt(len(imagery_paths))))
+    scenes = []
+    for path in imagery_paths:
+        scene_da = rxr.open_rasterio(
+            path, chunks={"band": -1, "y": chunk_size, "x": chunk_size}, lock=False
+        ).sel(band=[4, 8])
+        if bounds is not None:
+            scene_da = scene_da.rio.clip_box(*bounds)
+        scenes.append(scene_da)
+
+    imagery_da = xr.concat(scenes, dim="time").chunk({"time": -1})
+    imagery_da = imagery_da.assign_coords(time=np.arange(len(imagery_paths)))
+
+    return imagery_da
+
+
+def create_ndvi_composite(
+    imagery_paths,
+    riparian_buff_geom,
+    log_filepath,
+    composite="median",
+    chunk_size=1024,
+    precision="float64",
+    cog=None,
+):
+    """
+    Create NDVI composites of the riparian buffer from a time series of scenes.
+
+    The NDVI of every date is computed lazily, chunk by chunk, from a stack of the
+    scenes opened with open_imagery_stack(). A single pass over the chunks writes the
+    composites and calculates the statistics of each date, so each pixel of each
+    scene is read once, and memory use is bounded by the size of the chunks rather
+    than by the number of scenes.
+
+    The requested composite is written to '2-riparian_buffer-NDVI.tiff' and used as
+    the NDVI image by the rest of the analysis. The other composites of
+    NDVI_COMPOSITES are written to '2-riparian_buffer-NDVI_<composite>.tiff', and the
+    statistics of each date to '2-riparian_buffer-NDVI_dates.csv'.
+
+    Parameters
+    ----------
+    imagery_paths : list of str
+        Paths to the Sentinel-2 GeoTiffs of the same tile, one per date.
+
+    riparian_buff_geom : GeoPandas GeoSeries or str
+        Geometry of the riparian buffer, or the path to the raster mask of the buffer
+        written by raster_buffer(), which is read chunk by chunk.
+
+    log_filepath : str
+        Path to the log file.
+
+    composite : str, optional
+        One of NDVI_COMPOSITES: the 'median' (the default) of the NDVI values of each
+        pixel over the dates, which is robust to clouds and shadows in some of the
+        scenes, or their 'max', which represents the peak of the growing season.
+        Nodata values are ignored.
+
+    chunk_size : int, optional
+        The size in pixels of the chunks of one scene. See open_imagery_stack(). The
+        default is 1024.
+
+    precision : str, optional
+        One of NDVI_PRECISIONS. See create_ndvi(). The default is 'float64'.
+
+    cog : str, optional
+        When given, the composites are written as Cloud-Optimized GeoTIFFs compressed
+        with this codec. See to_cog(). The default is None.
+
+    Returns
+    -------
+    ndvi_da : RioXarray DataArray
+        The requested composite, lazily opened from '2-riparian_buffer-NDVI.tiff'.
+    """
+    import dask
+
+    print(f"\nCreating NDVI composites of {len(imagery_paths)} scenes...", end="")
+
+    # Compute in the requested floating point precision
+    if isinstance(riparian_buff_geom, str):
+        imagery_da = open_imagery_stack(imagery_paths, chunk_size=chunk_size)
+        buffer_window, mask_window = _buffer_mask_windows(
+            riparian_buff_geom, imagery_da.rio.transform()
+        )
+        imagery_da = imagery_da.rio.isel_window(buffer_window)
+    else:
+        imagery_da = open_imagery_stack(
+            imagery_paths,
+            bounds=riparian_buff_geom.total_bounds,
+            chunk_size=chunk_size,
+        )
+    imagery_da = imagery_da.astype(_compute_dtype(precision))
+
+    # NDVI of every date, with nan where the Red and NIR bands are both 0 (nodata)
+    red_da = imagery_da.sel(band=4, drop=True)
+    nir_da = imagery_da.sel(band=8, drop=True)
+    ndvi_da = (nir_da - red_da) / (nir_da + red_da)
+
+    # Clip the NDVI of every date to the riparian buffer, with nan nodata
+    ndvi_da = ndvi_da.rio.write_nodata(np.nan)
+    if isinstance(riparian_buff_geom, str):
+        mask_da = (
+            rxr.open_rasterio(
+                riparian_buff_geom,
+                chunks={"y": chunk_size, "x": chunk_size},
+                lock=False,
+            )
+            .squeeze("band", drop=True)
+            .rio.isel_window(mask_window)
+        )
+        ndvi_da = ndvi_da.where(
+            xr.DataArray(mask_da.data.astype(bool), dims=("y", "x"))
+        )
+    else:
+        ndvi_da = ndvi_da.rio.clip(geometries=riparian_buff_geom)
+
+    # Lazily write every composite
+    paths = {
+        name: (
+            "2-riparian_buffer-NDVI.tiff"
+            if name == composite
+            else f"2-riparian_buffer-NDVI_{name}.tiff"
+        )
+        for name in NDVI_COMPOSITES
+    }
+    writes = []
+    lock = threading.Lock()
+    for name, path in paths.items():
+        composite_da = getattr(ndvi_da, name)("time", skipna=True)
+        composite_da = composite_da.copy(
+            data=composite_da.data.map_blocks(_encode_ndvi, precision, dtype=precision)
+        )
+        composite_da.rio.write_nodata(
+            NDVI_INT16_NODATA if precision == "int16" else np.nan, inplace=True
+        )
+        composite_da.attrs["long_name"] = f"NDVI {name} composite"
+        writes.append(
+            composite_da.rio.to_raster(
+                path, lock=lock, compute=False, **_tiled_profile(cog)
+            )
+        )
+
+    # Statistics of each date, calculated in the same pass
+    dims = ("y", "x")
+    date_stats = [
+        ndvi_da.notnull().sum(dims),
+        ndvi_da.mean(dims),
+        ndvi_da.std(dims),
+        ndvi_da.min(dims),
+        ndvi_da.max(dims),
+    ]
+    *_, n_valid, mean, std, minimum, maximum = dask.compute(*writes, *date_stats)
+
+    for name, path in paths.items():
+        if precision == "int16":
+            with rasterio.open(path, "r+") as dst:
+                dst.scales = (NDVI_INT16_SCALE,)
+        if cog:
+            to_cog(path, cog, overview_resampling="average")
+    print("done\n")
+
+    dates_df = pd.DataFrame(
+        {
+            "Scene": [os.path.basename(path) for path in imagery_paths],
+            "Date": [_scene_date(path) for path in imagery_paths],
+            "Valid pixels": n_valid.values,
+            "Mean NDVI": mean.values,
+            "Standard deviation of NDVI": std.values,
+            "Minimum NDVI": minimum.values,
+            "Maximum NDVI": maximum.values,
+        }
+    )
+    dates_df.to_csv("2-riparian_buffer-NDVI_dates.csv", index=False)
+    print(dates_df.to_string(index=False) + "\n")
+
+    print(f"Riparian buffer NDVI {composite} composite can be found here:")
+    print(os.path.abspath("2-riparian_buffer-NDVI.tiff") + "\n")
+
+    # Write a log entry
+    with open(log_filepath, "a") as file:
+        file.write(
+            f"Riparian buffer NDVI {composite} composite of {len(imagery_paths)}"
+            f" scenes completed @ {datetime.now().strftime('%H:%M:%S')}\n\n"
+        )
+        file.write("Scenes:\n")
+        file.write(dates_df.to_string(index=False) + "\n\n")
+
+    return open_ndvi("2-riparian_buffer-NDVI.tiff")
+
+
+# %% 4) a. Machine suggested threshold using the Otsu Method - Taji
+#  Function to suggest a threshold to separated vegetatedd from non-veg - Taji
+
+
+# Fixed bins of the NDVI histograms, 0.001 wide over the range of NDVI values
+NDVI_HISTOGRAM_BINS = 2000
+NDVI_HISTOGRAM_RANGE = (-1, 1)
+
+
+def histogram_block(ndvi):
+    """
+    Count the valid NDVI values of a block of pixels in the fixed histogram bins.
+
+    The histograms of the blocks of an image add up to the histogram of the image,
+    so blocks and tiles can be counted separately, in any order or process.
+
+    Parameters
+    ----------
+    ndvi : numpy.ndarray
+        Block of NDVI values. Nodata pixels are nan and are not counted.
+
+    Returns
+    -------
+    counts : numpy.ndarray
+        1D int64 array of the number of values in each of the NDVI_HISTOGRAM_BINS
+        bins.
+    """
+    counts, _ = np.histogram(
+        ndvi[~np.isnan(ndvi)], bins=NDVI_HISTOGRAM_BINS, range=NDVI_HISTOGRAM_RANGE
+    )
+    return counts
+
+
+def ndvi_histogram(ndvi_da, block_size=1024):
+    """
+    Build the histogram of the valid NDVI values of an image block by block.
+
+    Only one block of rows is read or held in memory at a time, and the image is
+    never copied, so a lazily opened image is streamed from disk.
+
+    Parameters
+    ----------
+    ndvi_da : RioXarray DataArray
+        Normalized Difference Vegetation Index (NDVI) image of the riparian buffer.
+
+    block_size : int, optional
+        The number of rows per block. The default is 1024.
+
+    Returns
+    -------
+    counts : numpy.ndarray
+        1D int64 array of the number of values in each bin.
+
+    bin_edges : numpy.ndarray
+        1D array of the NDVI_HISTOGRAM_BINS + 1 edges of the bins.
+    """
+    counts = np.zeros(NDVI_HISTOGRAM_BINS, dtype="int64")
+    for row in range(0, ndvi_da.shape[0], block_size):
+        counts += histogram_block(ndvi_da[row : row + block_size].values)
+
+    bin_edges = np.linspace(*NDVI_HISTOGRAM_RANGE, NDVI_HISTOGRAM_BINS + 1)
+
+    return counts, bin_edges
+
+
+def otsu_from_histogram(counts, bin_edges):
+    """Compute the Otsu threshold of a histogram given as bin counts and edges."""
+    import skimage.filters
+
+    bin_centers = (bin_edges[:-1] + bin_edges[1:]) / 2
+    return float(skimage.filters.threshold_otsu(hist=(counts, bin_centers)))
+
+
+def otsu_threshold_suggestion(ndvi_da, log_filepath, histogram=None):
+    """
+    Suggest a NDVI threshold using the Otsu thresholding method.
+
+    The threshold is computed from a histogram of the valid NDVI values, so the
+    pixels outside the riparian buffer do not affect it.
+
+    Parameters
+    ----------
+    ndvi_da : RioXarray DataArray
+        Normalized Difference Vegetation Index (NDVI) image of the riparian buffer.
+
+    log_filepath : str
+        Path to the log file.
+
+    histogram : tuple of numpy.ndarray, optional
+        The (counts, bin_edges) histogram of ndvi_da from ndvi_histogram(). The
+        default is None, which builds it.
+
+    Returns
+    -------
+    suggested_threshold : float
+        The Otsu-generated NDVI threshold suggestion.
+    """
+    if histogram is None:
+        histogram = ndvi_histogram(ndvi_da)
+
+    ## Get Otsu-threshold suggested value
+    ## Code adapted from :
+    # https://scikit-image.org/docs/stable/auto_examples/applications/plot_thresholding.html
+
+    # perform automatic thresholding then give user the suggested threshold
+    suggested_threshold = otsu_from_histogram(*histogram)
+    suggested_thresh_str = round(suggested_threshold, 4)
+
+    print(f"Otsu-generated threshold suggestion: {suggested_thresh_str}\n")
+
+    # Write a log entry
+    with open(log_filepath, "a") as file:
+        file.write(f"Otsu-generated threshold suggestion: {suggested_thresh_str}\n\n")
+
+    return suggested_threshold
+
+
+# %% 4) Function to create Riparian Vegetation DataArray - Taji
+
+
+def select_ndvi_threshold(ndvi_da, log_filepath, threshold=None, histogram=None):
+    """
+    Save a histogram of the NDVI values and get the NDVI threshold from the user.
+
+    Parameters
+    ----------
+    ndvi_da : RioXarray DataArray
+        Normalized Difference Vegetation Index (NDVI) image of the riparian buffer.
+
+    log_filepath : str
+        Path to the log file.
+
+    threshold : float, optional
+        The NDVI threshold. The default is None, which prompts the user for it.
+
+    histogram : tuple of numpy.ndarray, optional
+        The (counts, bin_edges) histogram of ndvi_da from ndvi_histogram(). The
+        default is None, which builds it.
+
+    Returns
+    -------
+    threshold : float
+        The NDVI threshold.
+    """
+    import matplotlib.pyplot as plt
+
+    if histogram is None:
+        histogram = ndvi_histogram(ndvi_da)
+    counts, bin_edges = histogram
+
+    # Plot riparian NDVI histogram in 50 bins over the range of the NDVI values
+    nonzero = np.flatnonzero(counts)
+    plt.figure(figsize=(10, 10))
+    if len(nonzero):
+        plt.hist(
+            (bin_edges[:-1] + bin_edges[1:]) / 2,
+            bins=50,
+            range=(bin_edges[nonzero[0]], bin_edges[nonzero[-1] + 1]),
+            weights=counts,
+        )
+    plt.xlabel(ndvi_da.attrs.get("long_name", "NDVI"))
+    plt.title("Histogram of Riparian Zone NDVI Values")
+    plt.savefig("3-riparian_buffer-NDVI_histogram.png")
+    plt.close()
+
+    print("A Histogram of the riparian buffer NDVI values has been saved here:")
+    print(os.path.abspath("3-riparian_buffer-NDVI_histogram.png") + "\n")
+
+    if threshold is None:
+        # Provide threshold suggestions to the user
+        print(
+            "Please refer to it and Otsu-generated threshold suggestion to determine"
+            " an appropriate NDVI threshold.\n"
+        )
+
+        # Input the NDVI threshold
+        loaded = False
+        while loaded == False:
+            threshold = user_input("Please enter the NDVI threshold: ")
+            try:
+                threshold = float(threshold)
+                if threshold > 0 and threshold < 1:
+                    loaded = True
+                else:
+                    raise Exception
+            except:
+                print(
+                    "\nError: NDVI threshold must be a decimal number between 0 and 1"
+                )
+
+    # Write a log entry
+    with open(log_filepath, "a") as file:
+        file.write(f"NDVI threshold input: {threshold}\n\n")
+
+    return threshold
+
+
+def classify_ndvi_windowed(
+    ndvi_path, threshold, log_filepath, block_size=1024, cog=None
+):
+    """
+    Classify an NDVI image and build its histogram in a single blockwise pass.
+
+    Writes the '3-riparian_buffer-vegetation.tiff' classified image, where pixels
+    equal to or over the threshold are vegetation and the others not-vegetation. Each
+    block of NDVI values is read from disk once, counted into the histogram and
+    classified straight into a block of uint8 values that is written to the output,
+    so no full-size boolean or integer array is ever created.
+
+    Parameters
+    ----------
+    ndvi_path : str
+        Path to the NDVI image of the riparian buffer.
+
+    threshold : float
+        The NDVI threshold. Pixels equal to or over it are vegetation.
+
+    log_filepath : str
+        Path to the log file.
+
+    block_size : int, optional
+        The width and height in pixels of the blocks that are read, classified and
+        written. The default is 1024.
+
+    cog : str, optional
+        When given, the output is written as a Cloud-Optimized GeoTIFF compressed with
+        this codec, with 0 as its nodata value. See to_cog(). The default is None.
+
+    Returns
+    -------
+    riparian_da : RioXarray DataArray
+        Riparian buffer pixels classified into vegetation (1) and non-vegetation (2).
+        Nodata is 0. Lazily opened from the output.
+
+    histogram : tuple of numpy.ndarray
+        The (counts, bin_edges) histogram of the valid NDVI values, the same as
+        returned by ndvi_histogram().
+    """
+    print("Creating image of riparian buffer vegetation...", end="")
+
+    counts = np.zeros(NDVI_HISTOGRAM_BINS, dtype="int64")
+    # Classified blocks are written from preallocated buffers, one per block shape
+    buffers = {}
+    with rasterio.open(ndvi_path) as src:
+        profile = src.profile
+        profile.update(dtype="uint8", nodata=None, **_tiled_profile(cog))
+
+        with rasterio.open("3-riparian_buffer-vegetation.tiff", "w", **profile) as dst:
+            for block in _block_windows(src.height, src.width, block_size):
+                ndvi = _read_ndvi(src, window=block)
+                counts += histogram_block(ndvi)
+                if ndvi.shape not in buffers:
+                    buffers[ndvi.shape] = np.empty(ndvi.shape, "uint8")
+                dst.write(
+                    _classify_ndvi(ndvi, threshold, out=buffers[ndvi.shape]),
+                    1,
+                    window=block,
+                )
+
+    if cog:
+        to_cog(
+            "3-riparian_buffer-vegetation.tiff",
+            cog,
+            overview_resampling="mode",
+            nodata=0,
+        )
+
+    print("done\n")
+
+    print("Riparian buffer vegetation image can be found here:")
+    print(os.path.abspath("3-riparian_buffer-vegetation.tiff") + "\n")
+
+    # Write a log entry
+    with open(log_filepath, "a") as file:
+        file.write(
+            "Riprian buffer vegetation image completed @"
+            f" {datetime.now().strftime('%H:%M:%S')}\n\n"
+        )
+
+    riparian_da = rxr.open_rasterio("3-riparian_buffer-vegetation.tiff").squeeze(
+        "band", drop=True
+    )
+    bin_edges = np.linspace(*NDVI_HISTOGRAM_RANGE, NDVI_HISTOGRAM_BINS + 1)
+
+    return riparian_da, (counts, bin_edges)
+
+
+# %% 4) c. Functions to classify the NDVI image and measure its features in tiles - John
+
+
+def _classify_ndvi(ndvi, threshold, out=None):
+    """
+    Classify NDVI values as vegetation (1), not-vegetation (2) or nodata (0).
+
+    The classes are written in place into out, a uint8 array of the shape of ndvi,
+    which is allocated if not given.
+    """
+    if out is None:
+        out = np.empty(ndvi.shape, dtype="uint8")
+
+    # Comparisons with nan are False, so nodata pixels stay 0
+    out.fill(0)
+    np.copyto(out, 1, where=ndvi >= threshold)
+    np.copyto(out, 2, where=ndvi < threshold)
+    return out
+
+
+def _tile_feature_measures(mask):
+    """
+    Measure the features of a tile from a boolean mask that includes a 1 pixel halo.
+
+    Returns
+    -------
+    measures : dictionary
+        The number of feature pixels, features and perimeter edges of the tile, and
+        the feature labels along each edge of the tile, which are needed to merge the
+        features that straddle tile edges.
+    """
+    import skimage.measure
+
+    core = mask[1:-1, 1:-1]
+    labels, n_features = skimage.measure.label(core, connectivity=1, return_num=True)
+
+    # Perimeter edges are the sides of feature pixels facing a non-feature pixel. The
+    #   halo provides the neighbours of the pixels along the edges of the tile.
+    n_vertical_edges = np.count_nonzero(core & ~mask[1:-1, :-2]) + np.count_nonzero(
+        core & ~mask[1:-1, 2:]
+    )
+    n_horizontal_edges = np.count_nonzero(core & ~mask[:-2, 1:-1]) + np.count_nonzero(
+        core & ~mask[2:, 1:-1]
+    )
+
+    return {
+        "n_pixels": np.count_nonzero(core),
+        "n_features": n_features,
+        "n_vertical_edges": n_vertical_edges,
+        "n_horizontal_edges": n_horizontal_edges,
+        "top": labels[0, :].copy(),
+        "bottom": labels[-1, :].copy(),
+        "left": labels[:, 0].copy(),
+        "right": labels[:, -1].copy(),
+    }
+
+
+def _classify_tile(tile):
+    """
+    Classify one tile of the NDVI image and measure its features.
+
+    Uses the ndvi_path, threshold, height and width of _WORKER_STATE.
+
+    Parameters
+    ----------
+    tile : tuple
+        The (row, column) index of the tile in the grid of tiles and its Rasterio
+        Window.
+
+    Returns
+    -------
+    tile : tuple
+        The tile, unchanged.
+
+    classified : numpy.ndarray
+        The classified pixels of the tile (without the halo).
+
+    measures : dictionary
+        The measures of the 'veg', 'not_veg' and 'riparian' features of the tile.
+    """
+    (_, _), block = tile
+    height, width = _WORKER_STATE["height"], _WORKER_STATE["width"]
+
+    # Read the tile with a 1 pixel halo, clamped to the extent of the image
+    row_start = max(block.row_off - 1, 0)
+    row_stop = min(block.row_off + block.height + 1, height)
+    col_start = max(block.col_off - 1, 0)
+    col_stop = min(block.col_off + block.width + 1, width)
+    with rasterio.open(_WORKER_STATE["ndvi_path"]) as src:
+        ndvi = _read_ndvi(
+            src,
+            window=Window(
+                col_off=col_start,
+                row_off=row_start,
+                width=col_stop - col_start,
+                height=row_stop - row_start,
+            ),
+        )
+
+    # Beyond the extent of the image the halo is nodata
+    pad_top = row_start - (block.row_off - 1)
+    pad_bottom = block.row_off + block.height + 1 - row_stop
+    pad_left = col_start - (block.col_off - 1)
+    pad_right = block.col_off + block.width + 1 - col_stop
+    ndvi = np.pad(
+        ndvi,
+        ((pad_top, pad_bottom), (pad_left, pad_right)),
+        constant_values=np.nan,
+    )
+
+    classified = _classify_ndvi(ndvi, _WORKER_STATE["threshold"])
+
+    measures = {
+        "veg": _tile_feature_measures(classified == 1),
+        "not_veg": _tile_feature_measures(classified == 2),
+        "riparian": _tile_feature_measures(classified > 0),
+    }
+
+    return tile, classified[1:-1, 1:-1], measures
+
+
+def _count_merged_features(tile_measures):
+    """
+    Count the features of a grid of tiles, merging those that straddle tile edges.
+
+    The features of every tile are nodes of a graph. Features on either side of a
+    tile edge that share at least one pixel edge are joined, and the number of
+    connected components of the graph is the number of features of the whole image.
+
+    Parameters
+    ----------
+    tile_measures : dictionary
+        The measures returned by _tile_feature_measures() for one class of features,
+        keyed by the (row, column) index of each tile.
+
+    Returns
+    -------
+    n_features : int
+        The number of features.
+    """
+    # Give the features of each tile a unique node number
+    offsets = {}
+    n_nodes = 0
+    for index, measures in tile_measures.items():
+        offsets[index] = n_nodes
+        n_nodes += measures["n_features"]
+
+    if n_nodes == 0:
+        return 0
+
+    sources = [np.empty(0, dtype=np.intp)]
+    targets = [np.empty(0, dtype=np.intp)]
+    for (row, col), measures in tile_measures.items():
+        for neighbour, edge, neighbour_edge in [
+            ((row, col + 1), "right", "left"),
+            ((row + 1, col), "bottom", "top"),
+        ]:
+            if neighbour not in tile_measures:
+                continue
+            labels = measures[edge]
+            neighbour_labels = tile_measures[neighbour][neighbour_edge]
+            touching = (labels > 0) & (neighbour_labels > 0)
+            sources.append(labels[touching] - 1 + offsets[(row, col)])
+            targets.append(neighbour_labels[touching] - 1 + offsets[neighbour])
+
+    sources = np.concatenate(sources)
+    targets = np.concatenate(targets)
+    graph = coo_matrix(
+        (np.ones(len(sources), dtype="uint8"), (sources, targets)),
+        shape=(n_nodes, n_nodes),
+    )
+    n_features, _ = connected_components(graph, directed=False)
+
+    return n_features
+
+
+def tiled_riparian_stats(
+    watershed_name,
+    buffer_width,
+    ndvi_threshold,
+    watershed_gdf,
+    ndvi_path,
+    log_filepath,
+    tile_size=1024,
+    n_jobs=-1,
+    cog=None,
+):
+    """
+    Classify the NDVI image and generate the riparian statistics tile by tile.
+
+    The NDVI image is split into tiles that are classified and measured on a pool of
+    processes, each tile read with a 1 pixel halo so the perimeter of features along
+    tile edges is measured correctly. The per tile results are then merged, including
+    features that straddle tile edges, giving the same classified image and statistics
+    as classify_ndvi_windowed() followed by riparian_raster_stats().
+
+    Parameters
+    ----------
+    watershed_name : str
+        Name of the watershed being evaluated.
+
+    buffer_width : float
+        The width in meters of the riparian buffer. Included in the table of statistics
+        for reference purposes.
+
+    ndvi_threshold : float
+        The NDVI threshold used to classify pixels as vegetation and not-vegetation.
+
+    watershed_gdf : GeoPandas GeoDataFrame
+        The watershed being evaluated. Needed for the calculation of the watershed's
+        total area.
+
+    ndvi_path : str
+        Path to the NDVI image of the riparian buffer.
+
+    log_filepath : str
+        Path to the log file.
+
+    tile_size : int, optional
+        The width and height in pixels of the tiles. The default is 1024.
+
+    n_jobs : int, optional
+        The number of processes classifying tiles in parallel. The default is -1,
+        which uses all available processors.
+
+    cog : str, optional
+        When given, the classified image is written as a Cloud-Optimized GeoTIFF
+        compressed with this codec, with 0 as its nodata value. See to_cog(). The
+        default is None.
+
+    Returns
+    -------
+    riparian_da : RioXarray DataArray
+        Riparian buffer pixels classified into vegetation (1) and non-vegetation (2),
+        lazily opened from the '3-riparian_buffer-vegetation.tiff' output. Nodata is 0.
+
+    stats_df : Pandas DataFrame
+        A DataFrame with the same columns as the one returned by riparian_stats().
+    """
+    print(f"Classifying the riparian buffer in {tile_size} px tiles...", end="")
+
+    with rasterio.open(ndvi_path) as src:
+        profile = src.profile
+        height, width = src.height, src.width
+        transform = src.transform
+
+    profile.update(dtype="uint8", nodata=None, **_tiled_profile(cog))
+
+    tiles = [
+        ((block.row_off // tile_size, block.col_off // tile_size), block)
+        for block in _block_windows(height, width, tile_size)
+    ]
+    state = {
+        "ndvi_path": ndvi_path,
+        "threshold": ndvi_threshold,
+        "height": height,
+        "width": width,
+    }
+
+    # Keep only the measures of each tile, the classified pixels are written to disk
+    tile_measures = {"veg": {}, "not_veg": {}, "riparian": {}}
+    with rasterio.open("3-riparian_buffer-vegetation.tiff", "w", **profile) as dst:
+        for (index, block), classified, measures in _map_blocks(
+            _classify_tile, tiles, n_jobs=n_jobs, state=state
+        ):
+            dst.write(classified, 1, window=block)
+            for name in tile_measures:
+                tile_measures[name][index] = measures[name]
+
+    if cog:
+        to_cog(
+            "3-riparian_buffer-vegetation.tiff",
+            cog,
+            overview_resampling="mode",
+            nodata=0,
+        )
+
+    print("done\n")
+
+    print("Riparian buffer vegetation image can be found here:")
+    print(os.path.abspath("3-riparian_buffer-vegetation.tiff") + "\n")
+
+    # Write a log entry
+    with open(log_filepath, "a") as file:
+        file.write(
+            f"Riprian buffer vegetation image completed in {tile_size} px tiles @"
+            f" {datetime.now().strftime('%H:%M:%S')}\n\n"
+        )
+
+    # Merge the measures of the tiles
+    print("Calculating riparian statistics from the tiles...", end="")
+
+    pixel_width, pixel_height = abs(transform.a), abs(transform.e)
+    merged = {}
+    for name, measures in tile_measures.items():
+        n_pixels = sum(m["n_pixels"] for m in measures.values())
+        n_vertical_edges = sum(m["n_vertical_edges"] for m in measures.values())
+        n_horizontal_edges = sum(m["n_horizontal_edges"] for m in measures.values())
+        merged[name] = {
+            "area": n_pixels * pixel_width * pixel_height / 1_000_000,
+            "n_features": _count_merged_features(measures),
+            "perimeter": (
+                n_vertical_edges * pixel_height + n_horizontal_edges * pixel_width
+            )
+            / 1000,
+        }
+
+    # Mean patch size of not-vegetation features
+    if merged["not_veg"]["n_features"]:
+        not_veg_mean_size = merged["not_veg"]["area"] / merged["not_veg"]["n_features"]
+    else:
+        not_veg_mean_size = np.nan
+
+    stats_df = _statistics_table(
+        watershed_name=watershed_name,
+        buffer_width=buffer_width,
+        ndvi_threshold=ndvi_threshold,
+        watershed_area=watershed_gdf["geometry"].area.sum() / 1_000_000,
+        riparian_area=merged["riparian"]["area"],
+        veg_area=merged["veg"]["area"],
+        not_veg_area=merged["not_veg"]["area"],
+        not_veg_mean_size=not_veg_mean_size,
+        riparian_n_feature=merged["riparian"]["n_features"],
+        veg_n_feature=merged["veg"]["n_features"],
+        not_veg_n_feature=merged["not_veg"]["n_features"],
+        riparian_perimeter=merged["riparian"]["perimeter"],
+        veg_perimeter=merged["veg"]["perimeter"],
+        not_veg_perimeter=merged["not_veg"]["perimeter"],
+    )
+
+    print("done")
+
+    _export_statistics(stats_df, log_filepath)
+
+    riparian_da = rxr.open_rasterio("3-riparian_buffer-vegetation.tiff").squeeze(
+        "band", drop=True
+    )
+
+    return riparian_da, stats_df
+
+
+# %% 5) Function to convert Riparian Vegetation DataArray to GeoDataFrame - John
+
+
+def _polygons_from_shapes(shapes):
+    """
+    Build Shapely polygons straight from the ring coordinates of features.shapes().
+
+    All rings are gathered into a single coordinate array and converted with the
+    vectorized Shapely 2 constructors, avoiding any text or per-geometry round-trip.
+
+    Parameters
+    ----------
+    shapes : list
+        (geometry, value) pairs as yielded by rasterio.features.shapes(), where each
+        geometry is a GeoJSON-like Polygon dictionary.
+
+    Returns
+    -------
+    polygons : numpy.ndarray
+        Array of Shapely Polygons, one per shape.
+
+    values : numpy.ndarray
+        The pixel value of each polygon.
+    """
+    rings = []
+    ring_polygon_index = []
+    values = []
+    for polygon_index, (geom, value) in enumerate(shapes):
+        for ring in geom["coordinates"]:
+            rings.append(ring)
+            ring_polygon_index.append(polygon_index)
+        values.append(value)
+
+    if not rings:
+        return np.empty(0, dtype=object), np.asarray(values)
+
+    ring_lengths = np.fromiter(map(len, rings), dtype=np.intp, count=len(rings))
+    coords = np.array(list(chain.from_iterable(rings)), dtype="float64")
+
+    # The first ring of each polygon is its shell, any following rings are holes
+    linearrings = shapely.linearrings(
+        coords, indices=np.repeat(np.arange(len(rings)), ring_lengths)
+    )
+    polygons = shapely.polygons(linearrings, indices=np.asarray(ring_polygon_index))
+
+    return polygons, np.asarray(values)
+
+
+def extract_raster_features(
+    da, log_filepath, n_jobs=-1, method="shapely", vector_format="gpkg"
+):
+    """
+    Convert a RioXarray DataArray to a GeoPandas GeoDataFrame.
+
+    Contiguous pixels of the same value are turned into polygons with a column named
+    'value' which represents the values of the source pixels. The boundary of the
+    polygons matches the boundary of the pixels.
+
+    Based on: https://pysal.org/tobler/generated/tobler.dasymetric.extract_raster_features.html
+
+    Parameters
+    ----------
+    da : DataArray
+        The RioXarray DataArray to be converted to a GeoPandas GeoDataFrame. Must
+        have a valid Rasterio CRS (e.g. da.rio.crs).
+
+    n_jobs : int, optional
+        The default is -1. This will then count the number of available processes for
+        multiprocessing. Only used by the 'joblib' method.
+
+    log_filepath : str
+        Path to the log file.
+
+    method : str, optional
+        How the shapes are converted to polygons. The default is 'shapely', which
+        builds the polygons straight from their ring coordinates with the vectorized
+        Shapely constructors. 'joblib' parses the string representation of each shape
+        across n_jobs processes.
+
+    vector_format : str, optional
+        The format of the '4-riparian_buffer*' outputs, one of VECTOR_FORMATS. See
+        write_vector(). The default is 'gpkg'.
+
+    Returns
+    -------
+    gdf : GeoDataFrame
+        A GeoDataFrame containing Shapely polygons and pixel values.
+    """
+    # Print initial log message
+    print("Converting the riparian vegetation DataArray to a GeoDataFrame...", end="")
+
+    def _chunk_dfs(geoms_to_chunk, n_jobs):
+        chunk_size = geoms_to_chunk.shape[0] // n_jobs + 1
+        for i in range(n_jobs):
+            start = i * chunk_size
+            yield geoms_to_chunk.iloc[start : start + chunk_size]
+
+    def _apply_parser(df):
+        return df.apply(_parse_geom)
+
+    def _parse_geom(geom_str):
+        return shape(literal_eval(geom_str))
+
+    # CRS of the DataArray
+    raster_crs = da.rio.crs
+
+    # Convert regions to polygons
+    shapes = list(features.shapes(da.values, transform=da.rio.transform()))
+
+    if method == "shapely":
+        geoms, vals = _polygons_from_shapes(shapes)
+        geoms = gpd.GeoSeries(geoms)
+        vals = pd.Series(vals, name="value")
+    elif method == "joblib":
+        from joblib import Parallel, delayed
+
+        # Get number of processes for multiprocessing
+        if n_jobs == -1:
+            n_jobs = multiprocessing.cpu_count()
+
+        res = list(zip(*shapes))
+        geoms = pd.Series(res[0], name="geometry").astype(str)
+        pieces = _chunk_dfs(geoms, n_jobs)
+        geoms = pd.concat(
+            Parallel(n_jobs=n_jobs)(delayed(_apply_parser)(i) for i in pieces)
+        )
+        geoms = gpd.GeoSeries(geoms)
+        vals = pd.Series(res[1], name="value")
+    else:
+        raise ValueError(f"Unknown method '{method}'. Expected 'shapely' or 'joblib'.")
+
+    geoms = geoms.buffer(0)  # we sometimes get self-intersecting rings
+    riparian_gdf = gpd.GeoDataFrame(vals, geometry=geoms, crs=raster_crs)
+
+    # Write a log entry
+    with open(log_filepath, "a") as file:
+        file.write(
+            "Riprian buffer vegetation image converted to vector @"
+            f" {datetime.now().strftime('%H:%M:%S')}\n\n"
+        )
+
+    # Subset by vegetation and not-vegetation features
+    vegetation_gdf = riparian_gdf.loc[riparian_gdf["value"] == 1]
+    not_vegetation_gdf = riparian_gdf.loc[riparian_gdf["value"] == 2]
+
+    # Dissolve all riparian features into unique contiguous features
+    riparian_buffer_gdf = (
+        riparian_gdf.loc[(riparian_gdf["value"] == 1) | (riparian_gdf["value"] == 2)]
+        .dissolve()
+        .explode(ignore_index=True)
+    )
+
+    # Print completed log message
+    print("done\n")
+
+    # Save the results to a dictionary
+
+    riparian_dict = {
+        "riparian_buffer_gdf": riparian_buffer_gdf,
+        "vegetation_gdf": vegetation_gdf,
+        "not_vegetation_gdf": not_vegetation_gdf,
+    }
+
+    # Write intermediate data to file
+    print("Exporting riparian buffer vegetation features...", end="")
+    write_vector(vegetation_gdf, "4-riparian_buffer-vegetation", vector_format)
+    write_vector(not_vegetation_gdf, "4-riparian_buffer-not_vegetation", vector_format)
+    write_vector(riparian_buffer_gdf, "4-riparian_buffer", vector_format)
+
+    print("done\n")
+
+    return riparian_dict
+
+
+# %% 6) Function to calculate Riparian Connectivity Statistics - John / team
+
+
+def riparian_stats(
+    watershed_name,
+    buffer_width,
+    ndvi_threshold,
+    watershed_gdf,
+    riparian_buffer_gdf,
+    vegetation_gdf,
+    not_vegetation_gdf,
+    log_filepath,
+):
+    """
+    Generate statistics related to the riparian buffer.
+
+    Parameters
+    ----------
+    watershed_name : str
+        Name of the watershed being evaluated.
+
+    buffer_width : float
+        The width in meters of the riparian buffer. Included in the table of statistics
+        for reference purposes.
+
+    ndvi_threshold : float
+        The NDVI threshold used to classify pixels as vegetation and not-vegetation.
+        Included in the table of statistics for reference purposes.
+
+    watershed_gdf : GeoPandas GeoDataFrame
+        The watershed being evaluated. Needed for the calculation of the watershed's
+        total area.
+
+    riparian_buffer_gdf : GeoPandas GeoDataFrame
+        The riparian buffer features. Needed for the calculation of the number of
+        riparian buffer features, area, and perimeter.
+
+    vegetation_gdf : GeoPandas GeoDataFrame
+        The vegetation features that fall within the riparian buffer. Needed for the
+        calculation of the number of riparian vegetation features, area, and perimeter.
+
+    not_vegetation_gdf : GeoPandas GeoDataFrame
+        The not-vegetation features that fall within the riparian buffer. Needed for the
+        calculation of the number of riparian not-vegetation features, area, and
+        perimeter.
+
+    log_filepath : str
+        Path to the log file.
+
+
+    Returns
+    -------
+    stats_df : Pandas DataFrame
+        A DataFrame with the following column names and associated values:
+
+        'Watershed name'
+            The name of the watershed being evaluated.
+
+        'Watershed area (km2)'
+            The area of the watershed (km2).
+
+        'Riparian buffer area (km2)'
+            The area of the riparian buffer (km2).
+
+        'Vegetation area (km2)'
+            The area of the riparian buffer classified as vegetation (km2).
+
+        'Not-vegetation area (km2)'
+            The area of the riparian buffer classified as not-vegetation (km2).
+
+        'Vegetation coverage (%)'
+            The percentage of the riparian buffer's area that is covered by vegetation.
+            (Vegetation area / Riparian area) * 100
+
+        'Not-vegetation coverage (%)'
+            The percentage of the riparian buffer's area that is not covered by
+            vegetation.
+            (Not-vegetation area / Riparian area) * 100
+
+        'Mean area of not-vegetation patches (km2)'
+            The mean area (km2) of the not-vegetation features in the riparian buffer.
+
+        'Number of riparian buffer features'
+            The number of separate riparian buffer features.
+
+        'Number of vegetation features'
+            The number of separate vegetation features in the riparian buffer.
+
+        'Number of not-vegetation features'
+            The number of separate not-vegetation features in the riparian buffer.
+
+        'Perimeter of riparian buffer (km)'
+            The total perimeter (km) of the riparian buffer features.
+
+        'Perimeter of vegetation features (km)'
+            The total perimeter (km) of the vegetation features.
+
+        'Perimeter of not-vegetation features (km)'
+            The total perimeter (km) of the not-vegetation features.
+
+        'Vegetation Connectivity'
+            A rough metric to quantifiy the connectivity of the riparian features.
+            Number of riparian buffer features / Number of vegetation features
+
+        'Vegetation Compactness'
+            An attempt to quantify the the compactness of the riparian vegetation
+            features. The long name of this could be 'normalized isoperimetric ratio'.
+            See script README.md for more info.
+
+            # Reference compactness i.e. riparian buffer compactness
+            riparian_compactness =  riparian_perimeter**2 / riparian_area
+
+            # Actual compactness i.e. riparian vegetation compactness
+            vegetation_compactness = veg_perimeter**2 / veg_area
+
+            # Normalized compactness
+            compactness =  riparian_compactness / actual_compactness
+
+    """
+    # Print initial log message
+    print("Calculating riparian statistics...", end="")
+
+    # Area of features
+    veg_area = vegetation_gdf["geometry"].area.sum() / 1_000_000
+    not_veg_area = not_vegetation_gdf["geometry"].area.sum() / 1_000_000
+    riparian_area = riparian_buffer_gdf["geometry"].area.sum() / 1_000_000
+    watershed_area = watershed_gdf["geometry"].area.sum() / 1_000_000
+
+    # Mean patch size of not-vegetation features
+    not_veg_mean_size = not_vegetation_gdf["geometry"].area.mean() / 1_000_000
+
+    # Perimeter of features
+    veg_perimeter = vegetation_gdf["geometry"].length.sum() / 1000
+    not_veg_perimeter = not_vegetation_gdf["geometry"].length.sum() / 1000
+    riparian_perimeter = riparian_buffer_gdf["geometry"].length.sum() / 1000
+
+    # Number of features
+    veg_n_feature = len(vegetation_gdf)
+    not_veg_n_feature = len(not_vegetation_gdf)
+    riparian_n_feature = len(riparian_buffer_gdf)  # Not used yet
+
+    stats_df = _statistics_table(
+        watershed_name=watershed_name,
+        buffer_width=buffer_width,
+        ndvi_threshold=ndvi_threshold,
+        watershed_area=watershed_area,
+        riparian_area=riparian_area,
+        veg_area=veg_area,
+        not_veg_area=not_veg_area,
+        not_veg_mean_size=not_veg_mean_size,
+        riparian_n_feature=riparian_n_feature,
+        veg_n_feature=veg_n_feature,
+        not_veg_n_feature=not_veg_n_feature,
+        riparian_perimeter=riparian_perimeter,
+        veg_perimeter=veg_perimeter,
+        not_veg_perimeter=not_veg_perimeter,
+    )
+
+    print("done")
+
+    _export_statistics(stats_df, log_filepath)
+
+    return stats_df
+
+
+def _statistics_table(
+    watershed_name,
+    buffer_width,
+    ndvi_threshold,
+    watershed_area,
+    riparian_area,
+    veg_area,
+    not_veg_area,
+    not_veg_mean_size,
+    riparian_n_feature,
+    veg_n_feature,
+    not_veg_n_feature,
+    riparian_perimeter,
+    veg_perimeter,
+    not_veg_perimeter,
+):
+    """
+    Derive the coverage, connectivity and compactness and tabulate all statistics.
+
+    Areas are in km2 and perimeters in km. See riparian_stats() for a description of
+    the columns of the returned DataFrame.
+    """
+    # Coverage of total riparian area
+    veg_coverage = veg_area / riparian_area * 100
+    not_veg_coverage = not_veg_area / riparian_area * 100
+
+    # Connectivity
+    connectivity = riparian_n_feature / veg_n_feature
+
+    # Compactness aka normalized isoperimetric ratio
+    # Adapted from p21 of: http://www.cyto.purdue.edu/cdroms/micro2/content/education/wirth10.pdf
+    riparian_compactness = riparian_perimeter**2 / riparian_area
+    vegetation_compactness = veg_perimeter**2 / veg_area
+    compactness = riparian_compactness / vegetation_compactness
+
+    data = {
+        "Watershed name": [watershed_name],
+        "Buffer width:": [buffer_width],
+        "NDVI threshold": [ndvi_threshold],
+        "Watershed area (km2)": [watershed_area],
+        "Riparian buffer area (km2)": [riparian_area],
+        "Vegetation area (km2)": [veg_area],
+        "Not-vegetation area (km2)": [not_veg_area],
+        "Vegetation coverage (%)": [veg_coverage],
+        "Not-vegetation coverage (%)": [not_veg_coverage],
+        "Mean area of not-vegetation patches (km2)": [not_veg_mean_size],
+        "Number of riparian buffer features": [riparian_n_feature],
+        "Number of vegetation features": [veg_n_feature],
+        "Number of not-vegetation features": [not_veg_n_feature],
+        "Perimeter of riparian buffer (km)": [riparian_perimeter],
+        "Perimeter of vegetation features (km)": [veg_perimeter],
+        "Perimeter of not-vegetation features (km)": [not_veg_perimeter],
+        "Vegetation Connectivity": [connectivity],
+        "Vegetation Compactness": [compactness],
+    }
+
+    return pd.DataFrame.from_dict(data=data)
+
+
+def _export_statistics(stats_df, log_filepath):
+    """Write the statistics to the log file and to '4-statistics_table.csv'."""
+    # Write a log entry
+    with open(log_filepath, "a") as file:
+        file.write(
+            "Riparian statistics completed @"
+            f" {datetime.now().strftime('%H:%M:%S')}\n\n"
+        )
+        file.write("Results:\n")
+        file.write(stats_df.transpose().to_string())
+
+    # FOR DEBUGGING ------------------------------------------------------
+    # Write intermediate data to file for debugging
+    print("\nExporting results...", end="")
+
+    stats_df.to_csv("4-statistics_table.csv")
+
+    print("done\n")
+
+
+# %% 6) b. Function to calculate the statistics from the raster directly - John
+
+
+def _raster_feature_measures(mask, pixel_width, pixel_height):
+    """
+    Measure the features formed by the contiguous True pixels of a boolean array.
+
+    Features are 4-connected, matching the polygons created by
+    rasterio.features.shapes() in extract_raster_features().
+
+    Parameters
+    ----------
+    mask : numpy.ndarray
+        2D boolean array where True pixels belong to the features.
+
+    pixel_width : float
+        Width of a pixel in meters.
+
+    pixel_height : float
+        Height of a pixel in meters.
+
+    Returns
+    -------
+    area : float
+        Total area of the features (km2), from the count of True pixels.
+
+    n_features : int
+        Number of features, from connected-component labeling.
+
+    perimeter : float
+        Total perimeter of the features (km), from the count of pixel edges between a
+        True pixel and a False pixel (or the edge of the array).
+    """
+    import skimage.measure
+
+    area = np.count_nonzero(mask) * pixel_width * pixel_height / 1_000_000
+
+    _, n_features = skimage.measure.label(mask, connectivity=1, return_num=True)
+
+    # Pad with False so that edges along the border of the array are counted
+    padded = np.pad(mask, 1)
+    # Changes between horizontal neighbours are vertical edges, one pixel high
+    n_vertical_edges = np.count_nonzero(padded[:, 1:] != padded[:, :-1])
+    # Changes between vertical neighbours are horizontal edges, one pixel wide
+    n_horizontal_edges = np.count_nonzero(padded[1:, :] != padded[:-1, :])
+    perimeter = (
+        n_vertical_edges * pixel_height + n_horizontal_edges * pixel_width
+    ) / 1000
+
+    return area, n_features, perimeter
+
+
+def riparian_raster_stats(
+    watershed_name,
+    buffer_width,
+    ndvi_threshold,
+    watershed_gdf,
+    riparian_da,
+    log_filepath,
+):
+    """
+    Generate statistics related to the riparian buffer directly from its pixels.
+
+    Produces the same table of statistics as riparian_stats() without converting the
+    riparian vegetation DataArray to polygons first. Areas are computed from pixel
+    counts, the number of features from connected-component labeling and perimeters
+    from the number of pixel edges on the boundary of the features.
+
+    Parameters
+    ----------
+    watershed_name : str
+        Name of the watershed being evaluated.
+
+    buffer_width : float
+        The width in meters of the riparian buffer. Included in the table of statistics
+        for reference purposes.
+
+    ndvi_threshold : float
+        The NDVI threshold used to classify pixels as vegetation and not-vegetation.
+        Included in the table of statistics for reference purposes.
+
+    watershed_gdf : GeoPandas GeoDataFrame
+        The watershed being evaluated. Needed for the calculation of the watershed's
+        total area.
+
+    riparian_da : RioXarray DataArray
+        Riparian buffer pixels classified into vegetation (1) and non-vegetation (2).
+        Nodata is 0.
+
+    log_filepath : str
+        Path to the log file.
+
+    Returns
+    -------
+    stats_df : Pandas DataFrame
+        A DataFrame with the same columns as the one returned by riparian_stats().
+    """
+    # Print initial log message
+    print("Calculating riparian statistics from the raster...", end="")
+
+    transform = riparian_da.rio.transform()
+    pixel_width, pixel_height = abs(transform.a), abs(transform.e)
+    values = riparian_da.values
+
+    veg_area, veg_n_feature, veg_perimeter = _raster_feature_measures(
+        values == 1, pixel_width, pixel_height
+    )
+    not_veg_area, not_veg_n_feature, not_veg_perimeter = _raster_feature_measures(
+        values == 2, pixel_width, pixel_height
+    )
+    riparian_area, riparian_n_feature, riparian_perimeter = _raster_feature_measures(
+        values > 0, pixel_width, pixel_height
+    )
+    watershed_area = watershed_gdf["geometry"].area.sum() / 1_000_000
+
+    # Mean patch size of not-vegetation features
+    if not_veg_n_feature:
+        not_veg_mean_size = not_veg_area / not_veg_n_feature
+    else:
+        not_veg_mean_size = np.nan
+
+    stats_df = _statistics_table(
+        watershed_name=watershed_name,
+        buffer_width=buffer_width,
+        ndvi_threshold=ndvi_threshold,
+        watershed_area=watershed_area,
+        riparian_area=riparian_area,
+        veg_area=veg_area,
+        not_veg_area=not_veg_area,
+        not_veg_mean_size=not_veg_mean_size,
+        riparian_n_feature=riparian_n_feature,
+        veg_n_feature=veg_n_feature,
+        not_veg_n_feature=not_veg_n_feature,
+        riparian_perimeter=riparian_perimeter,
+        veg_perimeter=veg_perimeter,
+        not_veg_perimeter=not_veg_perimeter,
+    )
+
+    print("done")
+
+    _export_statistics(stats_df, log_filepath)
+
+    return stats_df
+
+
+# %% 6) c. Function to calculate the statistics for many NDVI thresholds - John
+
+
+def _count_at_thresholds(values, thresholds):
+    """Count the values that are greater than or equal to each threshold."""
+    return len(values) - np.searchsorted(np.sort(values), thresholds, side="left")
+
+
+def _forest_edge_values(node_values, rows, cols, edge_values, maximum):
+    """
+    Find the values of the edges of a minimum or maximum spanning forest.
+
+    Parameters
+    ----------
+    node_values : numpy.ndarray
+        1D array of the values of the nodes, used for the size of the graph.
+
+    rows, cols : numpy.ndarray
+        1D arrays of the nodes joined by each edge.
+
+    edge_values : numpy.ndarray
+        1D array of the value of each edge, in [-1, 1].
+
+    maximum : bool
+        Whether to find a maximum spanning forest rather than a minimum one.
+
+    Returns
+    -------
+    forest_values : numpy.ndarray
+        1D array of the values of the edges of the spanning forest.
+    """
+    # Spanning forests are found on positive weights, as zero weights are no edge.
+    #   They are 64 bit, so the close values of a 32 bit NDVI image stay distinct
+    edge_values = edge_values.astype("float64")
+    weights = 2 - edge_values if maximum else 2 + edge_values
+    graph = coo_matrix(
+        (weights, (rows, cols)), shape=(len(node_values), len(node_values))
+    ).tocsr()
+    forest = minimum_spanning_tree(graph).tocoo()
+
+    # Read the values from the nodes of the forest edges to avoid rounding errors
+    if maximum:
+        return np.minimum(node_values[forest.row], node_values[forest.col])
+    return np.maximum(node_values[forest.row], node_values[forest.col])
+
+
+def threshold_sweep(
+    watershed_name,
+    buffer_width,
+    thresholds,
+    watershed_gdf,
+    ndvi_da,
+    log_filepath,
+):
+    """
+    Generate the riparian statistics for many NDVI thresholds from a single pass.
+
+    Produces one row of the table of riparian_raster_stats() per threshold without
+    classifying the NDVI image for each one:
+
+    - Areas come from the cumulative count of NDVI values at each threshold.
+    - Perimeters come from the pairs of neighbouring pixels. An edge between two
+      pixels of the buffer is on the boundary of the vegetation (and of the
+      not-vegetation) features for the thresholds between their two NDVI values.
+      An edge between a pixel of the buffer and the outside is on the boundary of
+      the vegetation features for the thresholds up to the pixel's value, and of the
+      not-vegetation features above it.
+    - The number of features comes from a maximum spanning forest of the pixel
+      graph, where an edge is weighted with the lower NDVI value of its two pixels.
+      Adding the pixels in descending order of NDVI value, as in incremental
+      labeling, the forest edges at or above a threshold join the vegetation pixels
+      into features. Their number is the number of pixels minus the number of forest
+      edges at or above the threshold. The not-vegetation features are counted
+      likewise from a minimum spanning forest of the higher NDVI values.
+
+    Pixels are 4-connected, as in riparian_raster_stats(), and the vegetation
+    pixels are those with an NDVI value equal to or over the threshold.
+
+    Parameters
+    ----------
+    watershed_name : str
+        Name of the watershed being evaluated.
+
+    buffer_width : float
+        The width in meters of the riparian buffer. Included in the table of statistics
+        for reference purposes.
+
+    thresholds : list of float
+        The NDVI thresholds to calculate the statistics for.
+
+    watershed_gdf : GeoPandas GeoDataFrame
+        The watershed being evaluated. Needed for the calculation of the watershed's
+        total area.
+
+    ndvi_da : RioXarray DataArray
+        Normalized Difference Vegetation Index (NDVI) image of the riparian buffer.
+        The pixels outside the buffer are nan.
+
+    log_filepath : str
+        Path to the log file.
+
+    Returns
+    -------
+    stats_df : Pandas DataFrame
+        A DataFrame with the columns of riparian_stats() and one row per threshold.
+        It is also written to '4-threshold_sweep.csv'.
+    """
+    # Print initial log message
+    print(
+        f"Calculating riparian statistics for {len(thresholds)} thresholds...", end=""
+    )
+
+    thresholds = np.asarray(thresholds, dtype="float64")
+    transform = ndvi_da.rio.transform()
+    pixel_width, pixel_height = abs(transform.a), abs(transform.e)
+    pixel_area = pixel_width * pixel_height / 1_000_000
+
+    # NDVI in the data type it is stored in. Values outside of [-1, 1], which
+    #   negative reflectances can produce, are clipped to it as the weights of the
+    #   spanning forests assume that range
+    ndvi = np.clip(ndvi_da.values, -1, 1)
+    valid = ~np.isnan(ndvi)
+
+    # Compared with the NDVI values in their data type, as in the classification
+    levels = thresholds.astype(ndvi.dtype)
+
+    # The riparian buffer does not depend on the threshold
+    riparian_area, riparian_n_feature, riparian_perimeter = _raster_feature_measures(
+        valid, pixel_width, pixel_height
+    )
+    watershed_area = watershed_gdf["geometry"].area.sum() / 1_000_000
+
+    # Areas
+    n_veg = _count_at_thresholds(ndvi[valid], levels)
+    n_not_veg = np.count_nonzero(valid) - n_veg
+    veg_area = n_veg * pixel_area
+    not_veg_area = n_not_veg * pixel_area
+
+    # Perimeters, from the vertical (horizontal neighbours) and horizontal edges
+    padded = np.pad(ndvi, 1, constant_values=np.nan)
+    veg_perimeter = np.zeros(len(thresholds))
+    not_veg_perimeter = np.zeros(len(thresholds))
+    for first, second, edge_length in [
+        (padded[:, :-1], padded[:, 1:], pixel_height),
+        (padded[:-1, :], padded[1:, :], pixel_width),
+    ]:
+        first_valid, second_valid = ~np.isnan(first), ~np.isnan(second)
+
+        # Between two buffer pixels: on both boundaries when low < threshold <= high
+        both = first_valid & second_valid
+        low = np.minimum(first[both], second[both])
+        high = np.maximum(first[both], second[both])
+        n_inner_edges = _count_at_thresholds(high, levels) - _count_at_thresholds(
+            low, levels
+        )
+
+        # Between a buffer pixel and the outside
+        outer = np.concatenate(
+            [first[first_valid & ~second_valid], second[second_valid & ~first_valid]]
+        )
+        n_veg_outer_edges = _count_at_thresholds(outer, levels)
+        n_not_veg_outer_edges = len(outer) - n_veg_outer_edges
+
+        veg_edges = n_inner_edges + n_veg_outer_edges
+        not_veg_edges = n_inner_edges + n_not_veg_outer_edges
+        veg_perimeter += veg_edges * edge_length / 1000
+        not_veg_perimeter += not_veg_edges * edge_length / 1000
+
+    # Number of features, from spanning forests of the graph of the buffer pixels
+    n_nodes = np.count_nonzero(valid)
+    node_ids = np.full(ndvi.shape, -1, dtype="int32" if n_nodes < 2**31 else "int64")
+    node_ids[valid] = np.arange(n_nodes)
+    node_values = ndvi[valid]
+    rows, cols = [], []
+    for first, second in [
+        (node_ids[:, :-1], node_ids[:, 1:]),
+        (node_ids[:-1, :], node_ids[1:, :]),
+    ]:
+        both = (first >= 0) & (second >= 0)
+        rows.append(first[both])
+        cols.append(second[both])
+    rows, cols = np.concatenate(rows), np.concatenate(cols)
+    low = np.minimum(node_values[rows], node_values[cols])
+    high = np.maximum(node_values[rows], node_values[cols])
+
+    veg_forest = _forest_edge_values(node_values, rows, cols, low, maximum=True)
+    veg_n_feature = n_veg - _count_at_thresholds(veg_forest, levels)
+    not_veg_forest = _forest_edge_values(node_values, rows, cols, high, maximum=False)
+    not_veg_n_feature = n_not_veg - (
+        len(not_veg_forest) - _count_at_thresholds(not_veg_forest, levels)
+    )
+
+    # One table row per threshold
+    with np.errstate(divide="ignore", invalid="ignore"):
+        stats_df = pd.concat(
+            [
+                _statistics_table(
+                    watershed_name=watershed_name,
+                    buffer_width=buffer_width,
+                    ndvi_threshold=thresholds[i],
+                    watershed_area=watershed_area,
+                    riparian_area=riparian_area,
+                    veg_area=veg_area[i],
+                    not_veg_area=not_veg_area[i],
+                    not_veg_mean_size=(
+                        not_veg_area[i] / not_veg_n_feature[i]
+                        if not_veg_n_feature[i]
+                        else np.nan
+                    ),
+                    riparian_n_feature=riparian_n_feature,
+                    veg_n_feature=veg_n_feature[i],
+                    not_veg_n_feature=not_veg_n_feature[i],
+                    riparian_perimeter=riparian_perimeter,
+                    veg_perimeter=veg_perimeter[i],
+                    not_veg_perimeter=not_veg_perimeter[i],
+                )
+                for i in range(len(thresholds))
+            ],
+            ignore_index=True,
+        )
+
+    print("done\n")
+
+    # Write a log entry
+    with open(log_filepath, "a") as file:
+        file.write(
+            f"Riparian statistics for {len(thresholds)} NDVI thresholds completed @"
+            f" {datetime.now().strftime('%H:%M:%S')}\n\n"
+        )
+        file.write("Results:\n")
+        file.write(stats_df.to_string())
+        file.write("\n\n")
+
+    stats_df.to_csv("4-threshold_sweep.csv", index=False)
+
+    print("The statistics for each threshold can be found here:")
+    print(os.path.abspath("4-threshold_sweep.csv") + "\n")
+
+    return stats_df
+
+
+# %% 6) d. Function to calculate the statistics of many watersheds at once - John
+
+
+def _zone_feature_measures(zone_values, n_zones, pixel_width, pixel_height):
+    """
+    Measure the features of every zone from an array of the zone ID of each pixel.
+
+    Features are 4-connected runs of pixels of the same zone, so a feature that
+    crosses the boundary between two zones is split between them, as if each zone
+    had been clipped on its own. Every measure is aggregated by zone with a single
+    np.bincount() rather than a loop over the zones.
+
+    Parameters
+    ----------
+    zone_values : numpy.ndarray
+        2D integer array of the zone ID (1 to n_zones) of each feature pixel, and 0
+        for the other pixels.
+
+    n_zones : int
+        The number of zones.
+
+    pixel_width : float
+        Width of a pixel in meters.
+
+    pixel_height : float
+        Height of a pixel in meters.
+
+    Returns
+    -------
+    area : numpy.ndarray
+        Total area of the features of each zone (km2), indexed by zone ID.
+
+    n_features : numpy.ndarray
+        Number of features of each zone, indexed by zone ID.
+
+    perimeter : numpy.ndarray
+        Total perimeter of the features of each zone (km), indexed by zone ID.
+    """
+    import skimage.measure
+
+    n_bins = n_zones + 1
+    area = (
+        np.bincount(zone_values.ravel(), minlength=n_bins)
+        * pixel_width
+        * pixel_height
+        / 1_000_000
+    )
+
+    # Neighbouring pixels of different zones get different labels
+    labels, n_labels = skimage.measure.label(
+        zone_values, background=0, connectivity=1, return_num=True
+    )
+    label_zones = np.zeros(n_labels + 1, dtype=zone_values.dtype)
+    label_zones[labels.ravel()] = zone_values.ravel()
+    n_features = np.bincount(label_zones[1:], minlength=n_bins)
+
+    # Each edge between pixels of different zones is on the boundary of the
+    #   features on both sides of it, except for the zone 0 side
+    padded = np.pad(zone_values, 1)
+    perimeter = np.zeros(n_bins)
+    for before, after, edge_length in [
+        (padded[:, :-1], padded[:, 1:], pixel_height),
+        (padded[:-1, :], padded[1:, :], pixel_width),
+    ]:
+        edge = before != after
+        perimeter += np.bincount(before[edge], minlength=n_bins) * edge_length
+        perimeter += np.bincount(after[edge], minlength=n_bins) * edge_length
+    perimeter /= 1000
+
+    area[0] = n_features[0] = perimeter[0] = 0
+    return area, n_features, perimeter
+
+
+def zonal_riparian_stats(
+    buffer_width,
+    ndvi_threshold,
+    watershed_gdf,
+    riparian_da,
+    log_filepath,
+    zone_field=None,
+):
+    """
+    Generate the statistics of every watershed of a layer in a single raster pass.
+
+    The watersheds are rasterized once onto the grid of the classified image, which
+    gives the watershed ID of every pixel. The areas, feature counts and perimeters
+    of every watershed are then aggregated by ID with np.bincount(), as in
+    riparian_raster_stats(), rather than by running the analysis once per watershed.
+    Features are split at the boundaries between watersheds, so each watershed's
+    statistics are those it would get on its own from the same pixels.
+
+    Parameters
+    ----------
+    buffer_width : float
+        The width in meters of the riparian buffer. Included in the table of statistics
+        for reference purposes.
+
+    ndvi_threshold : float
+        The NDVI threshold used to classify pixels as vegetation and not-vegetation.
+        Included in the table of statistics for reference purposes.
+
+    watershed_gdf : GeoPandas GeoDataFrame
+        The watersheds, one per feature. They should not overlap: a pixel within
+        several watersheds is counted in the last one only.
+
+    riparian_da : RioXarray DataArray
+        Riparian buffer pixels classified into vegetation (1) and non-vegetation (2).
+        Nodata is 0.
+
+    log_filepath : str
+        Path to the log file.
+
+    zone_field : str, optional
+        The field of watershed_gdf holding the name of each watershed. The default is
+        None, which names the watersheds by their position in the layer, from 1.
+
+    Returns
+    -------
+    stats_df : Pandas DataFrame
+        A DataFrame with the columns of the one returned by riparian_stats() and one
+        row per watershed.
+    """
+    # Print initial log message
+    print("Calculating riparian statistics of each watershed...", end="")
+
+    if zone_field is not None and zone_field not in watershed_gdf.columns:
+        raise Exception(
+            f"Error: Field '{zone_field}' not found. Expected one of the fields of the"
+            f" watershed layer: {', '.join(map(str, watershed_gdf.columns))}."
+        )
+
+    zones_gdf = watershed_gdf.to_crs(riparian_da.rio.crs)
+    n_zones = len(zones_gdf)
+    if zone_field is None:
+        zone_names = [str(number) for number in range(1, n_zones + 1)]
+    else:
+        zone_names = zones_gdf[zone_field].astype(str).tolist()
+
+    transform = riparian_da.rio.transform()
+    pixel_width, pixel_height = abs(transform.a), abs(transform.e)
+    zone_ids = features.rasterize(
+        zip(zones_gdf.geometry, range(1, n_zones + 1)),
+        out_shape=riparian_da.shape,
+        transform=transform,
+        fill=0,
+        dtype="int32",
+    )
+    values = riparian_da.values
+
+    veg_area, veg_n_feature, veg_perimeter = _zone_feature_measures(
+        np.where(values == 1, zone_ids, 0), n_zones, pixel_width, pixel_height
+    )
+    not_veg_area, not_veg_n_feature, not_veg_perimeter = _zone_feature_measures(
+        np.where(values == 2, zone_ids, 0), n_zones, pixel_width, pixel_height
+    )
+    riparian_area, riparian_n_feature, riparian_perimeter = _zone_feature_measures(
+        np.where(values > 0, zone_ids, 0), n_zones, pixel_width, pixel_height
+    )
+    watershed_area = zones_gdf["geometry"].area.to_numpy() / 1_000_000
+
+    # Watersheds without riparian buffer or vegetation get nan ratios
+    with np.errstate(divide="ignore", invalid="ignore"):
+        not_veg_mean_size = np.where(
+            not_veg_n_feature > 0, not_veg_area / not_veg_n_feature, np.nan
+        )
+        stats_df = pd.concat(
+            [
+                _statistics_table(
+                    watershed_name=zone_names[i - 1],
+                    buffer_width=buffer_width,
+                    ndvi_threshold=ndvi_threshold,
+                    watershed_area=watershed_area[i - 1],
+                    riparian_area=riparian_area[i],
+                    veg_area=veg_area[i],
+                    not_veg_area=not_veg_area[i],
+                    not_veg_mean_size=not_veg_mean_size[i],
+                    riparian_n_feature=riparian_n_feature[i],
+                    veg_n_feature=veg_n_feature[i],
+                    not_veg_n_feature=not_veg_n_feature[i],
+                    riparian_perimeter=riparian_perimeter[i],
+                    veg_perimeter=veg_perimeter[i],
+                    not_veg_perimeter=not_veg_perimeter[i],
+                )
+                for i in range(1, n_zones + 1)
+            ],
+            ignore_index=True,
+        )
+
+    print("done")
+
+    _export_statistics(stats_df, log_filepath)
+
+    return stats_df
+
+
+# %% 6) e. Function to calculate the vegetation coverage of each reach - John
+
+
+def reach_riparian_stats(
+    watershed_gdf,
+    waterbodies_gdf,
+    watercourses_gdf,
+    buffer_width,
+    riparian_da,
+    log_filepath,
+    block_size=1024,
+    vector_format="gpkg",
+):
+    """
+    Calculate the vegetated and not vegetated riparian area of each reach.
+
+    Every riparian buffer pixel is allocated to its nearest water course or water
+    body. The classified image is processed in blocks of block_size pixels. The water
+    courses and water bodies near a block are rasterized into a grid of feature IDs
+    padded by the buffer width, and the Euclidean distance transform of that grid
+    gives the nearest feature of every pixel of the block. As the nearest feature of
+    a buffer pixel is within the buffer width of it, the result is the same as one
+    transform of the whole image, with memory bounded by the block size. The areas of
+    each feature are then counted with np.bincount(), so the number of reaches does
+    not add Python loops.
+
+    The areas are written as attributes of the water courses and water bodies to
+    '4-watercourses-reach_coverage' and '4-waterbodies-reach_coverage':
+
+        riparian_m2
+            Area of the riparian buffer allocated to the feature (m2).
+
+        veg_m2
+            Area of vegetation allocated to the feature (m2).
+
+        not_veg_m2
+            Area of not-vegetation allocated to the feature (m2).
+
+        veg_pct
+            Vegetation coverage of the feature's riparian buffer (%), nan for the
+            features without any.
+
+    Parameters
+    ----------
+    watershed_gdf : GeoPandas GeoDataFrame
+        The watershed boundary.
+
+    waterbodies_gdf : GeoPandas GeoDataFrame or str
+        The water bodies, or the path to read them from. Only the features that can
+        reach the riparian buffer are kept.
+
+    watercourses_gdf : GeoPandas GeoDataFrame or str
+        The water courses, or the path to read them from. Only the features that can
+        reach the riparian buffer are kept.
+
+    buffer_width : float
+        The width in meters of the riparian buffer.
+
+    riparian_da : RioXarray DataArray
+        Riparian buffer pixels classified into vegetation (1) and non-vegetation (2).
+        Nodata is 0.
+
+    log_filepath : str
+        Path to the log file.
+
+    block_size : int, optional
+        The width and height in pixels of the blocks of the classified image. The
+        default is 1024.
+
+    vector_format : str, optional
+        The format of the outputs, one of VECTOR_FORMATS. See write_vector(). The
+        default is 'gpkg'.
+
+    Returns
+    -------
+    watercourses_gdf : GeoPandas GeoDataFrame
+        The water courses, in their own CRS, with the columns above.
+
+    waterbodies_gdf : GeoPandas GeoDataFrame
+        The water bodies, in their own CRS, with the columns above.
+    """
+    from scipy import ndimage
+
+    print("Calculating riparian vegetation coverage of each reach...", end="")
+
+    raster_crs = riparian_da.rio.crs
+    search_area = watershed_search_area(watershed_gdf, raster_crs, buffer_width)
+    if isinstance(waterbodies_gdf, str):
+        waterbodies_gdf = read_waterbodies(waterbodies_gdf, search_area)
+    else:
+        waterbodies_gdf = prefilter_to_search_area(waterbodies_gdf, search_area)
+    if isinstance(watercourses_gdf, str):
+        watercourses_gdf = read_watercourses(watercourses_gdf, search_area)
+    else:
+        watercourses_gdf = prefilter_to_search_area(watercourses_gdf, search_area)
+
+    # Water courses are IDs 1 to n_courses and water bodies the following ones,
+    #   burnt last so that they take the pixels of streams flowing through them
+    n_courses, n_bodies = len(watercourses_gdf), len(waterbodies_gdf)
+    n_bins = n_courses + n_bodies + 1
+    geoms = pd.concat(
+        [
+            watercourses_gdf.geometry.to_crs(raster_crs),
+            waterbodies_gdf.geometry.to_crs(raster_crs),
+        ],
+        ignore_index=True,
+    )
+
+    transform = riparian_da.rio.transform()
+    pixel_width, pixel_height = abs(transform.a), abs(transform.e)
+    pixel_area = pixel_width * pixel_height
+    pad = int(np.ceil(buffer_width / min(pixel_width, pixel_height)))
+    height, width = riparian_da.shape
+    veg_area = np.zeros(n_bins)
+    not_veg_area = np.zeros(n_bins)
+    for block in _block_windows(height, width, block_size):
+        values = riparian_da.isel(
+            y=slice(block.row_off, block.row_off + block.height),
+            x=slice(block.col_off, block.col_off + block.width),
+        ).values
+        riparian = values > 0
+        if not riparian.any():
+            continue
+
+        # The nearest feature of a buffer pixel is within buffer_width of it, so
+        #   within the padding of its block, which may extend beyond the image
+        padded = Window(
+            block.col_off - pad,
+            block.row_off - pad,
+            block.width + 2 * pad,
+            block.height + 2 * pad,
+        )
+        padded_transform = rasterio.windows.transform(padded, transform)
+        positions = np.sort(
+            geoms.sindex.query(shapely.box(*rasterio.windows.bounds(padded, transform)))
+        )
+        if not len(positions):
+            continue
+        labels = features.rasterize(
+            zip(geoms.iloc[positions], positions + 1),
+            out_shape=(int(padded.height), int(padded.width)),
+            transform=padded_transform,
+            all_touched=True,
+            dtype="int32",
+        )
+        if not labels.any():
+            continue
+
+        # Nearest feature pixel of every pixel, then the feature of each buffer pixel
+        rows, cols = ndimage.distance_transform_edt(
+            labels == 0,
+            sampling=(pixel_height, pixel_width),
+            return_distances=False,
+            return_indices=True,
+        )[:, pad : pad + block.height, pad : pad + block.width]
+        reach_ids = labels[rows[riparian], cols[riparian]]
+        classes = values[riparian]
+        veg_area += np.bincount(reach_ids[classes == 1], minlength=n_bins) * pixel_area
+        not_veg_area += (
+            np.bincount(reach_ids[classes == 2], minlength=n_bins) * pixel_area
+        )
+
+    riparian_area = veg_area + not_veg_area
+    with np.errstate(divide="ignore", invalid="ignore"):
+        veg_coverage = veg_area / riparian_area * 100
+
+    columns = {
+        "riparian_m2": riparian_area,
+        "veg_m2": veg_area,
+        "not_veg_m2": not_veg_area,
+        "veg_pct": veg_coverage,
+    }
+    watercourses_gdf = watercourses_gdf.assign(
+        **{name: column[1 : n_courses + 1] for name, column in columns.items()}
+    )
+    waterbodies_gdf = waterbodies_gdf.assign(
+        **{name: column[n_courses + 1 :] for name, column in columns.items()}
+    )
+
+    print("done\n")
+
+    print("Exporting reach coverage...", end="")
+    reach_paths = [
+        write_vector(watercourses_gdf, "4-watercourses-reach_coverage", vector_format),
+        write_vector(waterbodies_gdf, "4-waterbodies-reach_coverage", vector_format),
+    ]
+    print("done\n")
+
+    print("Vegetation coverage of each reach can be found here:")
+    for path in reach_paths:
+        print(os.path.abspath(path))
+    print()
+
+    # Write a log entry
+    with open(log_filepath, "a") as file:
+        file.write(
+            "Reach coverage completed @"
+            f" {datetime.now().strftime('%H:%M:%S')} for {n_courses} water courses"
+            f" and {n_bodies} water bodies\n\n"
+        )
+
+    return watercourses_gdf, waterbodies_gdf
+
+
+# %% 7) Function to produce a report - John & Haley
+
+# Circumference of the earth in Web Mercator (EPSG:3857) meters, the extent of zoom 0
+WEB_MERCATOR_EXTENT = 2 * np.pi * 6378137
+
+# Size in pixels of the map tiles
+MAP_TILE_SIZE = 256
+
+# RGBA colours of the nodata (0), vegetation (1) and not-vegetation (2) map pixels
+MAP_TILE_COLOURS = np.array([[0, 0, 0, 0], [0, 128, 0, 128], [0, 0, 0, 255]], "uint8")
+
+
+def _map_tile_range(bounds, zoom):
+    """Return the x and y ranges of the map tiles covering Web Mercator bounds."""
+    tile_extent = WEB_MERCATOR_EXTENT / 2**zoom
+    last = 2**zoom - 1
+    minx, miny, maxx, maxy = bounds
+    x_range = range(
+        max(int((minx + WEB_MERCATOR_EXTENT / 2) // tile_extent), 0),
+        min(int((maxx + WEB_MERCATOR_EXTENT / 2) // tile_extent), last) + 1,
+    )
+    y_range = range(
+        max(int((WEB_MERCATOR_EXTENT / 2 - maxy) // tile_extent), 0),
+        min(int((WEB_MERCATOR_EXTENT / 2 - miny) // tile_extent), last) + 1,
+    )
+    return x_range, y_range
+
+
+def _render_map_tile(tile):
+    """
+    Render one map tile of the classified image as an RGBA PNG.
+
+    Uses the riparian_path and tiles_dir of _WORKER_STATE. Only the pixels of the
+    classified image under the tile are read and warped to Web Mercator.
+
+    Parameters
+    ----------
+    tile : tuple
+        The (zoom, x, y) index of the tile.
+
+    Returns
+    -------
+    tile : tuple
+        The tile, unchanged.
+
+    written : bool
+        Whether the tile was written. Tiles without riparian buffer pixels are not.
+    """
+    from rasterio.enums import Resampling
+    from rasterio.transform import from_origin
+    from rasterio.vrt import WarpedVRT
+
+    zoom, x, y = tile
+    tile_extent = WEB_MERCATOR_EXTENT / 2**zoom
+    transform = from_origin(
+        -WEB_MERCATOR_EXTENT / 2 + x * tile_extent,
+        WEB_MERCATOR_EXTENT / 2 - y * tile_extent,
+        tile_extent / MAP_TILE_SIZE,
+        tile_extent / MAP_TILE_SIZE,
+    )
+
+    with rasterio.open(_WORKER_STATE["riparian_path"]) as src:
+        with WarpedVRT(
+            src,
+            crs="EPSG:3857",
+            transform=transform,
+            width=MAP_TILE_SIZE,
+            height=MAP_TILE_SIZE,
+            resampling=Resampling.nearest,
+            src_nodata=0,
+            nodata=0,
+        ) as vrt:
+            classes = vrt.read(1)
+
+    if not classes.any():
+        return tile, False
+
+    from matplotlib.image import imsave
+
+    tile_dir = os.path.join(_WORKER_STATE["tiles_dir"], str(zoom), str(x))
+    os.makedirs(tile_dir, exist_ok=True)
+    imsave(os.path.join(tile_dir, f"{y}.png"), MAP_TILE_COLOURS[classes])
+
+    return tile, True
+
+
+def render_map_tiles(
+    riparian_path, log_filepath, tiles_dir="5-report_tiles", n_levels=6, n_jobs=1
+):
+    """
+    Render the classified image as a pyramid of XYZ PNG map tiles.
+
+    Tiles are written to '<tiles_dir>/<zoom>/<x>/<y>.png' in the Web Mercator tiling
+    scheme of Leaflet and other web maps. The most detailed zoom level matches the
+    resolution of the image and the n_levels - 1 levels above it are coarser, so the
+    number of tiles, and the time to render them, grows with the number of pixels of
+    the image rather than with its number of features.
+
+    Parameters
+    ----------
+    riparian_path : str
+        Path to the image of the riparian buffer classified into vegetation (1) and
+        not-vegetation (2).
+
+    log_filepath : str
+        Path to the log file.
+
+    tiles_dir : str, optional
+        The directory the tiles are written to. The default is '5-report_tiles'.
+
+    n_levels : int, optional
+        The number of zoom levels of the pyramid. The default is 6.
+
+    n_jobs : int, optional
+        The number of processes rendering tiles in parallel. The default is 1. -1
+        uses all available processors.
+
+    Returns
+    -------
+    map_tiles : dictionary
+        The 'url' template of the tiles relative to the results directory, the
+        'min_zoom' and 'max_zoom' of the pyramid and the 'bounds' of the image as
+        ((south, west), (north, east)) latitudes and longitudes.
+    """
+    from rasterio.warp import transform_bounds
+
+    print("Rendering map tiles of riparian buffer vegetation...", end="")
+
+    with rasterio.open(riparian_path) as src:
+        bounds = transform_bounds(src.crs, "EPSG:3857", *src.bounds)
+        west, south, east, north = transform_bounds(src.crs, "EPSG:4326", *src.bounds)
+        resolution = min(
+            (bounds[2] - bounds[0]) / src.width, (bounds[3] - bounds[1]) / src.height
+        )
+
+    # Most detailed zoom level with tile pixels no larger than the image's pixels
+    max_zoom = int(np.ceil(np.log2(WEB_MERCATOR_EXTENT / MAP_TILE_SIZE / resolution)))
+    max_zoom = min(max(max_zoom, 0), 22)
+    min_zoom = max(max_zoom - n_levels + 1, 0)
+
+    tiles = []
+    for zoom in range(min_zoom, max_zoom + 1):
+        x_range, y_range = _map_tile_range(bounds, zoom)
+        tiles += [(zoom, x, y) for x in x_range for y in y_range]
+
+    shutil.rmtree(tiles_dir, ignore_errors=True)
+    state = {"riparian_path": os.path.abspath(riparian_path), "tiles_dir": tiles_dir}
+    n_written = sum(
+        written
+        for _, written in _map_blocks(
+            _render_map_tile, tiles, n_jobs=n_jobs, state=state
+        )
+    )
+
+    print("done\n")
+
+    print("The map tiles can be found here:")
+    print(os.path.abspath(tiles_dir) + "\n")
+
+    # Write a log entry
+    with open(log_filepath, "a") as file:
+        file.write(
+            f"Riparian map tiles completed ({n_written} tiles, zoom {min_zoom} to"
+            f" {max_zoom}) @ {datetime.now().strftime('%H:%M:%S')}\n\n"
+        )
+
+    return {
+        "url": f"{tiles_dir}/{{z}}/{{x}}/{{y}}.png",
+        "min_zoom": min_zoom,
+        "max_zoom": max_zoom,
+        "bounds": ((south, west), (north, east)),
+    }
+
+
+def _tile_map(map_tiles):
+    """Create a Folium map displaying the map tiles from render_map_tiles()."""
+    import folium
+
+    m = folium.Map(width="85%")
+    folium.raster_layers.TileLayer(
+        tiles=map_tiles["url"],
+        attr="Riparian vegetation",
+        name="Riparian vegetation",
+        overlay=True,
+        min_native_zoom=map_tiles["min_zoom"],
+        max_native_zoom=map_tiles["max_zoom"],
+        max_zoom=map_tiles["max_zoom"] + 2,
+    ).add_to(m)
+    m.fit_bounds(map_tiles["bounds"])
+
+    return m
+
+
+def _feature_map(vegetation_gdf, not_vegetation_gdf):
+    """Create a Folium map displaying the vegetation and not-vegetation features."""
+    vegetation_gdf["value"] = "vegetation"
+    not_vegetation_gdf["value"] = "not-vegetation"
+
+    m = vegetation_gdf.explore(
+        width="85%",
+        color="green",
+        tooltip="value",
+        name="Vegetation",
+        legend_kwds={"caption": "Riparian vegetation"},
+        style_kwds={"stroke": False, "opacity": 0.3},
+    )
+
+    not_vegetation_gdf.explore(
+        m=m,
+        color="black",
+        tooltip="value",
+        name="Not-vegetation",
+        style_kwds={
+            "stroke": True,
+            "opacity": 1,
+            "fillColor": "black",
+            "weight": 1,
+        },
+    )
+
+    return m
+
+
+def report(stats_df, vegetation_gdf, not_vegetation_gdf, log_filepath, map_tiles=None):
+    """
+    Write an HTML report to the results directory.
+
+    The report contains the statistical results and an interactive folium map.
+
+    Parameters
+    ----------
+    stats_df : Pandas DataFrame
+        The DataFrame containing the riparian connectivity statistics. Displayed as an
+        HTML table in the report.
+
+    vegetation_gdf : GeoPandas GeoDataFrame
+        The GeoDataFrame containing the riparian buffer vegetation features. Displayed
+        in an interactive Folium map.
+
+    not_vegetation_gdf : GeoPandas GeoDataFrame
+        The GeoDataFrame containing the riparian buffer not-vegetation features.
+        Displayed in an interactive Folium map.
+
+    log_filepath : str
+        Path to the log file.
+
+    map_tiles : dictionary, optional
+        The map tiles returned by render_map_tiles(). When given, the map displays
+        these tiles, which the report references rather than embeds, and
+        vegetation_gdf and not_vegetation_gdf are not used. The default is None, which
+        embeds the features in the map.
+
+    Returns
+    -------
     None.
 
     """
-    vegetation_gdf["value"] = "vegetation"
-    not_vegetation_gdf["value"] = "not-vegetation"
+    import folium
+    from folium import plugins
+
+    if map_tiles is not None:
+        m = _tile_map(map_tiles)
+    else:
+        m = _feature_map(vegetation_gdf, not_vegetation_gdf)
+
+    minimap = plugins.MiniMap()
+    m.add_child(minimap)
+    folium.LayerControl().add_to(m)
+
+    # 1. Set up multiple variables to store the titles, text within the report
+    page_title_text = "Riparian Connectivity"
+    title_text = "Riparian Connectivity in the Ottawa River Watershed"
+
+    stats_text = "Riparian Connectivity Summary Statistics"
+    stats_description = "Statistic Name Descriptions"
+
+    # 2. Combine them together using a long f-string
+
+    html = f"""
+    <html>
+        <head>
+            <title>{page_title_text}</title>
+        </head>
+        <body>
+        <body style="background-color:WhiteSmoke;">
+            <h1><b><u>{title_text}</u></b></h1>
+            
+            <h4>{stats_text}</h4>
+           {stats_df.transpose().to_html()}
+          
+            <h4><u>{stats_description}</u></h4>
+         
+             <ul>
+      <li>Watershed area (km2) - The area of the watershed (km2).</li>
+      <li>Riparian buffer area (km2) - The area of the riparian buffer.</li>
+      <li>Vegetation area (km2) - The area of the riparian buffer classified as vegetation.</li>
+      <li>Not-vegetation area (km2) - The area of the riparian buffer classified as not-vegetation</li>
+      <li>Vegetation coverage (%) - The percentage of the riparian buffer's area that is covered by vegetation</li>
+      <li>Not-vegetation coverage (%) - The percentage of the riparian buffer's area that is not covered by vegetation</li>
+      <li>Mean area of not-vegetation patches (km2) - The mean area (km2) of the not-vegetation features in the riparian buffer</li>
+      <li>Number of riparian buffer features - The number of separate riparian buffer features</li>
+      <li>Number of vegetation features - The number of separate vegetation features in the riparian buffer</li>
+      <li>Number of not-vegetation features - The number of separate not-vegetation features in the riparian buffer</li>
+      <li>Perimeter of riparian buffer (km) - The total perimeter (km) of the riparian buffer features.</li>
+      <li>Perimeter of riparian buffer (km) - The total perimeter (km) of the riparian buffer features.</li>
+      <li>Perimeter of not-vegetation features (km) - The total perimeter of not-vegetation features.</li>
+      <li>Vegetation Connectivity - The quotient of the number of riparian buffer features divided by the number of vegetation features.</li>
+      <li>Vegetation Compactness - The normalized isoperimetric ratio (see README.md for more info)</li>
+        </ul>
+        </head>
+
+    <body>
+    
+    <h4><u>Map Legend</u></h4>
+    
+    <table>
+    <table style="width:15%"
+      <tr>
+        <th>Class</th>
+        <th>Colour</th>
+      </tr>
+      
+      
+      <tr>
+        <td>Vegetation</td>
+        <td>Green</td>
+      </tr>
+      <tr>
+        <td>Non-Vegetation</td>
+        <td>Black</td>
+      </tr>
+    </table>
+    
+    </body>
+            
+            {m.get_root().render()}
+            </body>
+      
+        </html>
+    """
+
+    # 3. Write the html string as an HTML file
+    with open("5-report.html", "w") as f:
+        f.write(html)
+
+
+# %% 8) Functions to process many watersheds in a batch - John
+
+MANIFEST_FIELDS = [
+    "name",
+    "watershed",
+    "waterbodies",
+    "watercourses",
+    "imagery",
+    "buffer_width",
+]
+
+
+def _parse_threshold(threshold):
+    """Return an NDVI threshold as a float between 0 and 1, or the string 'otsu'."""
+    if str(threshold).strip().lower() == "otsu":
+        return "otsu"
+    try:
+        threshold = float(threshold)
+    except ValueError:
+        threshold = None
+    if threshold is None or not 0 < threshold < 1:
+        raise Exception(
+            "Error: NDVI threshold must be a decimal number between 0 and 1 or 'otsu'"
+        )
+    return threshold
+
+
+def parse_thresholds(thresholds):
+    """
+    Parse the NDVI thresholds of a sweep.
+
+    Parameters
+    ----------
+    thresholds : str
+        Either comma separated thresholds, e.g. '0.2,0.3,0.45', or a range given as
+        'start:stop:step', e.g. '0.1:0.9:0.05', which includes stop.
+
+    Returns
+    -------
+    thresholds : list of float
+        The sorted, unique thresholds.
+    """
+    try:
+        if ":" in thresholds:
+            start, stop, step = (float(part) for part in thresholds.split(":"))
+            if step <= 0:
+                raise ValueError
+            values = np.round(np.arange(start, stop + step / 2, step), 10)
+        else:
+            values = [float(part) for part in thresholds.split(",")]
+    except ValueError:
+        raise ValueError(
+            f"Invalid NDVI thresholds: '{thresholds}'. Expected comma separated"
+            " thresholds or a 'start:stop:step' range."
+        )
+
+    return sorted(set(float(value) for value in values))
+
+
+def read_manifest(manifest_path, default_threshold="otsu"):
+    """
+    Read and check a manifest of the watersheds to process in a batch.
+
+    The manifest can be a CSV file with one row per watershed, or a JSON or YAML file
+    containing a list of watersheds (optionally under a 'watersheds' key). Each
+    watershed has the following fields:
+
+        name
+            Name of the watershed, used to name its results directory.
+        watershed, waterbodies, watercourses
+            Paths to the watershed boundary, water bodies and water courses files.
+        imagery
+            Path to the Sentinel-2 multispectral GeoTiff imagery file.
+        buffer_width
+            The riparian buffer width in meters.
+        threshold (optional)
+            The NDVI threshold, or 'otsu' to use the Otsu-generated threshold
+            suggestion. The default is default_threshold.
+        scenes (optional)
+            Paths to other scenes of the same tile as the imagery, separated by ';'
+            in a CSV manifest. See the scenes option of run_pipeline().
+
+    Relative paths are relative to the directory containing the manifest.
+
+    Parameters
+    ----------
+    manifest_path : str
+        Path to the manifest file.
+
+    default_threshold : float or str, optional
+        The threshold of the watersheds without one. The default is 'otsu'.
+
+    Returns
+    -------
+    entries : list of dict
+        One dictionary per watershed with absolute paths and a parsed threshold.
+    """
+    suffix = Path(manifest_path).suffix.lower()
+    if suffix == ".csv":
+        entries = pd.read_csv(manifest_path, dtype=str, keep_default_na=False).to_dict(
+            orient="records"
+        )
+    elif suffix == ".json":
+        with open(manifest_path) as file:
+            entries = json.load(file)
+    elif suffix in [".yaml", ".yml"]:
+        try:
+            import yaml
+        except ImportError:
+            raise Exception(
+                "Error: The PyYAML package is required to read a YAML manifest."
+            )
+        with open(manifest_path) as file:
+            entries = yaml.safe_load(file)
+    else:
+        raise Exception(
+            "Error: Unknown manifest format. Expected a '.csv', '.json', '.yaml' or"
+            f" '.yml' file but received '{suffix}'."
+        )
+
+    if isinstance(entries, dict):
+        entries = entries.get("watersheds", [])
+
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_path))
+    for number, entry in enumerate(entries, start=1):
+        missing = [field for field in MANIFEST_FIELDS if entry.get(field) in (None, "")]
+        if missing:
+            raise Exception(
+                f"Error: Watershed {number} of the manifest is missing the following"
+                f" fields: {', '.join(missing)}."
+            )
+        for field in ["watershed", "waterbodies", "watercourses", "imagery"]:
+            entry[field] = os.path.join(manifest_dir, os.path.expanduser(entry[field]))
+        entry["name"] = str(entry["name"])
+        entry["buffer_width"] = float(entry["buffer_width"])
+        entry["threshold"] = _parse_threshold(
+            entry.get("threshold") or default_threshold
+        )
+        scenes = entry.get("scenes") or []
+        if isinstance(scenes, str):
+            scenes = [scene for scene in scenes.split(";") if scene.strip()]
+        entry["scenes"] = [
+            os.path.join(manifest_dir, os.path.expanduser(scene.strip()))
+            for scene in scenes
+        ]
+
+    return entries
+
+
+def _run_manifest_entry(entry, output_dir, options):
+    """
+    Run the analysis of one watershed of a manifest.
+
+    Any error is caught so that it does not stop the other watersheds of the batch.
+
+    Returns
+    -------
+    summary : dictionary
+        The watershed name, status, results directory and error, if any, of the run.
+
+    stats_df : Pandas DataFrame
+        The riparian connectivity statistics, or None if the run failed.
+    """
+    summary = {
+        "Watershed name": entry["name"],
+        "Status": "failed",
+        "Results directory": None,
+        "Error": None,
+    }
+    metrics = []
+    try:
+        with measure_stage(metrics, "load", options.get("profile_stage")):
+            data_dict = load_data(
+                watershed_name=entry["name"],
+                watershed_path=entry["watershed"],
+                waterbodies_path=entry["waterbodies"],
+                watercourses_path=entry["watercourses"],
+                imagery_path=entry["imagery"],
+                buffer_width=entry["buffer_width"],
+                output_dir=output_dir,
+                multiple_watersheds=options.get("zonal", False),
+            )
+        summary["Results directory"] = data_dict["results_dir"]
+        if entry["scenes"]:
+            options = {**options, "scenes": entry["scenes"]}
+        stats_df = run_pipeline(
+            data_dict=data_dict,
+            ndvi_threshold=entry["threshold"],
+            metrics=metrics,
+            **options,
+        )
+        summary["Status"] = "completed"
+    except Exception as e:
+        summary["Error"] = f"{type(e).__name__}: {e}"
+        stats_df = None
+
+    return summary, stats_df
+
+
+def run_batch(manifest_path, workers=1, output_dir="results", **options):
+    """
+    Process every watershed of a manifest without user interaction.
+
+    The watersheds are processed concurrently on a pool of worker processes. Each gets
+    its own results directory within output_dir. A summary of the runs is written to
+    'batch_summary.csv' and the statistics of all completed watersheds to
+    'batch_statistics.csv', both in output_dir.
+
+    Parameters
+    ----------
+    manifest_path : str
+        Path to the manifest file. See read_manifest().
+
+    workers : int, optional
+        Number of watersheds processed concurrently. The default is 1.
+
+    output_dir : str, optional
+        The directory in which the results directories are created. The default is
+        'results'.
+
+    **options
+        Options passed on to run_pipeline() for every watershed, e.g. stats_engine.
+        An ndvi_threshold option is the threshold of the watersheds of the manifest
+        without one.
+
+    Returns
+    -------
+    summaries : list of dict
+        The summary of the run of each watershed.
+    """
+    entries = read_manifest(
+        manifest_path, default_threshold=options.pop("ndvi_threshold", None) or "otsu"
+    )
+    output_dir = os.path.abspath(output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+
+    print(f"\nProcessing {len(entries)} watersheds with {workers} workers...\n")
+
+    summaries = []
+    stats = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(_run_manifest_entry, entry, output_dir, options)
+            for entry in entries
+        ]
+        for future in as_completed(futures):
+            summary, stats_df = future.result()
+            summaries.append(summary)
+            if stats_df is not None:
+                stats.append(stats_df)
+            print(
+                f"\n{summary['Watershed name']}: {summary['Status']}"
+                + (f" ({summary['Error']})" if summary["Error"] else "")
+            )
+
+    pd.DataFrame(summaries).to_csv(
+        os.path.join(output_dir, "batch_summary.csv"), index=False
+    )
+    if stats:
+        pd.concat(stats, ignore_index=True).to_csv(
+            os.path.join(output_dir, "batch_statistics.csv"), index=False
+        )
+
+    n_completed = sum(summary["Status"] == "completed" for summary in summaries)
+    print(f"\n{n_completed} of {len(entries)} watersheds completed successfully.")
+    print("A summary of the batch can be found here:")
+    print(os.path.join(output_dir, "batch_summary.csv") + "\n")
+
+    return summaries
+
+
+def validate_manifest(manifest_path, multiple_watersheds=False):
+    """
+    Check the inputs of every watershed of a manifest without processing them.
+
+    The checks are those of validate_inputs(), so only the watershed boundaries and
+    the metadata of the other inputs are read. A summary is printed.
+
+    Parameters
+    ----------
+    manifest_path : str
+        Path to the manifest file. See read_manifest().
+
+    multiple_watersheds : bool, optional
+        Whether the watershed boundaries may have more than 1 feature. The default is
+        False.
+
+    Returns
+    -------
+    summaries : list of dict
+        The watershed name, status ('valid' or 'invalid') and error, if any, of each
+        watershed.
+    """
+    summaries = []
+    for entry in read_manifest(manifest_path):
+        summary = {"Watershed name": entry["name"], "Status": "valid", "Error": None}
+        try:
+            if entry["buffer_width"] <= 0:
+                raise Exception(
+                    "Error: Buffer width must be a valid integer or float > 0"
+                )
+            validate_inputs(
+                watershed_path=entry["watershed"],
+                waterbodies_path=entry["waterbodies"],
+                watercourses_path=entry["watercourses"],
+                imagery_path=entry["imagery"],
+                multiple_watersheds=multiple_watersheds,
+            )
+        except Exception as e:
+            summary["Status"] = "invalid"
+            summary["Error"] = f"{type(e).__name__}: {e}"
+        summaries.append(summary)
+
+    print("\n" + pd.DataFrame(summaries).to_string(index=False) + "\n")
+    n_valid = sum(summary["Status"] == "valid" for summary in summaries)
+    print(f"{n_valid} of {len(summaries)} watersheds have valid inputs.\n")
+
+    return summaries
+
+
+# %% 9) Functions to cache the outputs of stages between runs - John
+
+# Hashes of input files, keyed by their path, size and modification time
+_FILE_HASHES = {}
+
+# Files that make up a shapefile along with the '.shp' file
+SHAPEFILE_SIDECARS = [".shx", ".dbf", ".prj", ".cpg"]
+
+
+def input_hash(path):
+    """
+    Hash the contents of an input file.
+
+    For a shapefile the files that accompany the '.shp' file are hashed as well. The
+    hashes are memoized for the lifetime of the process, keyed by the path, size and
+    modification time of the file.
+
+    Parameters
+    ----------
+    path : str
+        Path to the input file.
+
+    Returns
+    -------
+    digest : str
+        The hexadecimal SHA-256 digest of the file(s).
+    """
+    paths = [path]
+    if Path(path).suffix.lower() == ".shp":
+        paths += [
+            str(Path(path).with_suffix(suffix))
+            for suffix in SHAPEFILE_SIDECARS
+            if Path(path).with_suffix(suffix).exists()
+        ]
+
+    digest = hashlib.sha256()
+    for file_path in paths:
+        stat = os.stat(file_path)
+        key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+        if key not in _FILE_HASHES:
+            file_digest = hashlib.sha256()
+            with open(file_path, "rb") as file:
+                for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                    file_digest.update(chunk)
+            _FILE_HASHES[key] = file_digest.hexdigest()
+        digest.update(_FILE_HASHES[key].encode())
+
+    return digest.hexdigest()
+
+
+def cache_key(stage, *parts):
+    """Combine a stage name with the hashes and parameters of its inputs into a key."""
+    return hashlib.sha256(json.dumps([stage, *map(str, parts)]).encode()).hexdigest()
+
+
+def cache_fetch(cache_dir, key, filename, log_filepath):
+    """
+    Copy a cached stage output to the working directory, if it is in the cache.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Path to the cache directory.
+
+    key : str
+        The cache key of the output, from cache_key().
+
+    filename : str
+        The name of the output in the working directory, e.g. '1_riparian_buffer.gpkg'.
+
+    log_filepath : str
+        Path to the log file.
+
+    Returns
+    -------
+    found : bool
+        True if the output was in the cache and has been copied.
+    """
+    cached_path = os.path.join(cache_dir, key + Path(filename).suffix)
+    try:
+        shutil.copyfile(cached_path, filename)
+    except FileNotFoundError:
+        return False
+
+    # Mark the output as recently used, eviction removes the least recently used
+    os.utime(cached_path)
+
+    print(f"\nReusing cached {filename}\n")
+    with open(log_filepath, "a") as file:
+        file.write(
+            f"{filename} reused from cache ({cached_path}) @"
+            f" {datetime.now().strftime('%H:%M:%S')}\n\n"
+        )
+
+    return True
+
+
+def cache_store(cache_dir, key, filename, max_size_mb=10240):
+    """
+    Store a stage output in the cache, evicting the least recently used outputs.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Path to the cache directory. It is created if it does not exist.
+
+    key : str
+        The cache key of the output, from cache_key().
+
+    filename : str
+        The name of the output in the working directory.
+
+    max_size_mb : float, optional
+        The maximum total size of the cache in megabytes. The least recently used
+        outputs are removed until the cache fits. The default is 10240 (10 GB).
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    cached_path = os.path.join(cache_dir, key + Path(filename).suffix)
+
+    # Copy to a temporary file first so other processes never see a partial output
+    temp_path = f"{cached_path}.{os.getpid()}.tmp"
+    shutil.copyfile(filename, temp_path)
+    os.replace(temp_path, cached_path)
+
+    _evict_cache(cache_dir, max_size_mb * 1024 * 1024)
+
+
+def _evict_cache(cache_dir, max_size):
+    """Remove the least recently used outputs until the cache fits in max_size bytes."""
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.is_file() and not entry.name.endswith(".tmp"):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_size <= max_size:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # Already evicted by another process sharing the cache
+            pass
+        total_size -= size
+
+
+# %% 10) Functions to measure the stages of the analysis - John
+
+# Names of the measured stages, in the order they run
+PIPELINE_STAGES = [
+    "load",
+    "buffer",
+    "ndvi",
+    "otsu",
+    "classify",
+    "vectorize",
+    "stats",
+    "reaches",
+    "report",
+]
+
+
+def _peak_rss_mb(who):
+    """Return the peak resident set size in MB of this process or of its children."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(who).ru_maxrss
+    # Reported in kilobytes on Linux and in bytes on macOS
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def _children_cpu_time():
+    """Return the CPU time in seconds of the child processes that have exited."""
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _bytes_written(paths, since):
+    """Return the size of the files at or within paths modified since a time in ns."""
+    total = 0
+    for path in paths:
+        if os.path.isdir(path):
+            filenames = [
+                os.path.join(root, filename)
+                for root, _, filenames in os.walk(path)
+                for filename in filenames
+            ]
+        else:
+            filenames = [path]
+        for filename in filenames:
+            try:
+                stat = os.stat(filename)
+            except FileNotFoundError:
+                continue
+            if stat.st_mtime_ns >= since:
+                total += stat.st_size
+    return total
+
+
+@contextmanager
+def measure_stage(metrics, stage, profile_stage=None):
+    """
+    Measure a stage of the analysis and append its measures to metrics.
+
+    Records the wall time, the CPU time of this process and of the worker processes
+    that exited during the stage, and the peak resident set size (RSS) of this process
+    and of its exited children so far. The code of the stage can add other measures,
+    such as the number of pixels or features processed, to the yielded dictionary.
+    When it lists the paths of its outputs in the 'outputs' item, the bytes of those
+    files (or of the files within those directories) written during the stage are
+    recorded instead of the list.
+
+    Parameters
+    ----------
+    metrics : list
+        The measures of the stages of the run. A dictionary is appended to it.
+
+    stage : str
+        The name of the stage, one of PIPELINE_STAGES.
+
+    profile_stage : str, optional
+        When equal to stage, the stage is profiled with cProfile and the profile is
+        written to '6-profile-<stage>.prof', which can be read with pstats or
+        snakeviz. The process ID is printed when the stage starts so a sampling
+        profiler such as py-spy can be attached to it. The default is None.
+
+    Yields
+    ------
+    record : dictionary
+        The measures of the stage.
+    """
+    record = {"stage": stage}
+    # Whole seconds, as some file systems store coarser modification times
+    started = time.time_ns() // 10**9 * 10**9
+    profiler = None
+    if stage == profile_stage:
+        print(f"\nProfiling the '{stage}' stage (process ID {os.getpid()})\n")
+        profiler = cProfile.Profile()
+
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time() + _children_cpu_time()
+    if profiler:
+        profiler.enable()
+    try:
+        yield record
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(f"6-profile-{stage}.prof")
+
+        record["wall_time_s"] = time.perf_counter() - wall_start
+        record["cpu_time_s"] = time.process_time() + _children_cpu_time() - cpu_start
+        record["peak_rss_mb"] = _peak_rss_mb(getattr(resource, "RUSAGE_SELF", None))
+        record["children_peak_rss_mb"] = _peak_rss_mb(
+            getattr(resource, "RUSAGE_CHILDREN", None)
+        )
+        if "outputs" in record:
+            record["bytes_written"] = _bytes_written(record.pop("outputs"), started)
+        metrics.append(record)
+
+
+def write_metrics(metrics, log_filepath):
+    """
+    Write the measures of the stages to '6-metrics.json' and '6-metrics.csv'.
+
+    Pixels and features processed are added to each stage's throughput per second of
+    wall time.
+    """
+    for record in metrics:
+        for measure in ["pixels", "features"]:
+            if record.get(measure) is not None and record["wall_time_s"] > 0:
+                record[f"{measure}_per_s"] = record[measure] / record["wall_time_s"]
+
+    with open("6-metrics.json", "w") as file:
+        json.dump(
+            {
+                "created": datetime.now().isoformat(timespec="seconds"),
+                "stages": metrics,
+            },
+            file,
+            indent=2,
+            default=float,
+        )
+    pd.DataFrame(metrics).to_csv("6-metrics.csv", index=False)
+
+    # Write a log entry
+    with open(log_filepath, "a") as file:
+        file.write(
+            "Metrics of the stages written to 6-metrics.json @"
+            f" {datetime.now().strftime('%H:%M:%S')}\n\n"
+        )
+
+
+# %% 11) Functions to checkpoint and resume interrupted runs - John
+
+# Name of the run manifest in the results directory
+RUN_MANIFEST = "run_manifest.json"
+
+
+def write_run_manifest(run_state):
+    """Write the run manifest to the results directory, replacing it atomically."""
+    with open(RUN_MANIFEST + ".tmp", "w") as file:
+        json.dump(run_state, file, indent=2)
+    os.replace(RUN_MANIFEST + ".tmp", RUN_MANIFEST)
+
+
+def read_run_manifest(results_dir="."):
+    """
+    Read the run manifest of a results directory.
+
+    Parameters
+    ----------
+    results_dir : str, optional
+        Path to the results directory. The default is the working directory.
+
+    Returns
+    -------
+    run_state : dictionary
+        The inputs and options of the run and the record of each completed stage.
+    """
+    path = os.path.join(results_dir, RUN_MANIFEST)
+    if not os.path.exists(path):
+        raise Exception(
+            f"Error: No run manifest found in '{results_dir}'. Expected the results"
+            " directory of a run started with this version of the script."
+        )
+    with open(path) as file:
+        return json.load(file)
+
+
+def start_run_manifest(data_dict, options, resume=False):
+    """
+    Start the run manifest of the working directory, or load it to resume the run.
+
+    The manifest records the inputs and options of the run, and each stage completed
+    with record_stage(), so that resume_run() can continue an interrupted run.
+
+    Parameters
+    ----------
+    data_dict : dictionary
+        The dictionary returned by load_data_ui(), load_data() or resume_run().
+
+    options : dictionary
+        The options of run_pipeline() for the run.
+
+    resume : bool, optional
+        Whether to load the existing manifest rather than start a new one. The
+        default is False.
+
+    Returns
+    -------
+    run_state : dictionary
+        The contents of the run manifest.
+    """
+    if resume and os.path.exists(RUN_MANIFEST):
+        return read_run_manifest()
+
+    run_state = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "inputs": {
+            "watershed_name": data_dict["watershed_name"],
+            "watershed_path": data_dict["watershed_path"],
+            "waterbodies_path": data_dict["waterbodies_path"],
+            "watercourses_path": data_dict["watercourses_path"],
+            "imagery_path": data_dict["imagery_path"],
+            "buffer_width": data_dict["buffer_width"],
+        },
+        "log_filepath": os.path.abspath(data_dict["log_filepath"]),
+        "options": options,
+        "stages": {},
+    }
+    write_run_manifest(run_state)
+
+    return run_state
+
+
+def stage_completed(run_state, stage, key, log_filepath):
+    """
+    Check whether a stage was completed from the same inputs and its outputs exist.
+
+    Parameters
+    ----------
+    run_state : dictionary
+        The contents of the run manifest.
+
+    stage : str
+        The name of the stage, one of PIPELINE_STAGES.
+
+    key : str
+        The key of the stage's inputs and parameters, from cache_key().
+
+    log_filepath : str
+        Path to the log file.
+
+    Returns
+    -------
+    completed : bool
+        True if the outputs of the stage can be reloaded instead of recomputed.
+    """
+    record = run_state["stages"].get(stage)
+    if (
+        record is None
+        or record["key"] != key
+        or not all(os.path.exists(path) for path in record["artifacts"])
+    ):
+        return False
+
+    print(f"\nReusing the outputs of the completed '{stage}' stage\n")
+    with open(log_filepath, "a") as file:
+        file.write(
+            f"Outputs of the completed '{stage}' stage reused"
+            f" ({', '.join(record['artifacts'])}) @"
+            f" {datetime.now().strftime('%H:%M:%S')}\n\n"
+        )
+
+    return True
+
+
+def record_stage(run_state, stage, key, artifacts, **values):
+    """
+    Record a completed stage in the run manifest.
 
-    m = vegetation_gdf.explore(
-        width="85%",
-        color="green",
-        tooltip="value",
-        name="Vegetation",
-        legend_kwds={"caption": "Riparian vegetation"},
-        style_kwds={"stroke": False, "opacity": 0.3},
-    )
+    Parameters
+    ----------
+    run_state : dictionary
+        The contents of the run manifest.
 
-    not_vegetation_gdf.explore(
-        m=m,
-        color="black",
-        tooltip="value",
-        name="Not-vegetation",
-        style_kwds={
-            "stroke": True,
-            "opacity": 1,
-            "fillColor": "black",
-            "weight": 1,
-        },
-    )
+    stage : str
+        The name of the stage, one of PIPELINE_STAGES.
 
-    minimap = plugins.MiniMap()
-    m.add_child(minimap)
-    folium.LayerControl().add_to(m)
+    key : str
+        The key of the stage's inputs and parameters, from cache_key(). Changing
+        an input or parameter changes the key, so the stage is not reused.
 
-    # 1. Set up multiple variables to store the titles, text within the report
-    page_title_text = "Riparian Connectivity"
-    title_text = "Riparian Connectivity in the Ottawa River Watershed"
+    artifacts : list of str
+        The paths of the stage's outputs, relative to the results directory.
 
-    stats_text = "Riparian Connectivity Summary Statistics"
-    stats_description = "Statistic Name Descriptions"
+    **values
+        Other values to record, e.g. the NDVI threshold.
+    """
+    if run_state["stages"].get(stage, {}).get("key") == key:
+        return
+    run_state["stages"][stage] = {
+        "key": key,
+        "artifacts": artifacts,
+        "completed": datetime.now().isoformat(timespec="seconds"),
+        **values,
+    }
+    write_run_manifest(run_state)
 
-    # 2. Combine them together using a long f-string
 
-    html = f"""
-    <html>
-        <head>
-            <title>{page_title_text}</title>
-        </head>
-        <body>
-        <body style="background-color:WhiteSmoke;">
-            <h1><b><u>{title_text}</u></b></h1>
-            
-            <h4>{stats_text}</h4>
-           {stats_df.transpose().to_html()}
-          
-            <h4><u>{stats_description}</u></h4>
-         
-             <ul>
-      <li>Watershed area (km2) - The area of the watershed (km2).</li>
-      <li>Riparian buffer area (km2) - The area of the riparian buffer.</li>
-      <li>Vegetation area (km2) - The area of the riparian buffer classified as vegetation.</li>
-      <li>Not-vegetation area (km2) - The area of the riparian buffer classified as not-vegetation</li>
-      <li>Vegetation coverage (%) - The percentage of the riparian buffer's area that is covered by vegetation</li>
-      <li>Not-vegetation coverage (%) - The percentage of the riparian buffer's area that is not covered by vegetation</li>
-      <li>Mean area of not-vegetation patches (km2) - The mean area (km2) of the not-vegetation features in the riparian buffer</li>
-      <li>Number of riparian buffer features - The number of separate riparian buffer features</li>
-      <li>Number of vegetation features - The number of separate vegetation features in the riparian buffer</li>
-      <li>Number of not-vegetation features - The number of separate not-vegetation features in the riparian buffer</li>
-      <li>Perimeter of riparian buffer (km) - The total perimeter (km) of the riparian buffer features.</li>
-      <li>Perimeter of riparian buffer (km) - The total perimeter (km) of the riparian buffer features.</li>
-      <li>Perimeter of not-vegetation features (km) - The total perimeter of not-vegetation features.</li>
-      <li>Vegetation Connectivity - The quotient of the number of riparian buffer features divided by the number of vegetation features.</li>
-      <li>Vegetation Compactness - The normalized isoperimetric ratio (see README.md for more info)</li>
-        </ul>
-        </head>
+def resume_run(results_dir):
+    """
+    Reload the inputs and options of an interrupted run to continue it.
 
-    <body>
-    
-    <h4><u>Map Legend</u></h4>
-    
-    <table>
-    <table style="width:15%"
-      <tr>
-        <th>Class</th>
-        <th>Colour</th>
-      </tr>
-      
-      
-      <tr>
-        <td>Vegetation</td>
-        <td>Green</td>
-      </tr>
-      <tr>
-        <td>Non-Vegetation</td>
-        <td>Black</td>
-      </tr>
-    </table>
-    
-    </body>
-            
-            {m.get_root().render()}
-            </body>
-      
-        </html>
+    The inputs recorded in the run manifest are checked again with validate_inputs()
+    and the results directory becomes the working directory.
+
+    Parameters
+    ----------
+    results_dir : str
+        Path to the results directory of the interrupted run.
+
+    Returns
+    -------
+    data_dict : dictionary
+        The same dictionary as returned by load_data_ui().
+
+    options : dictionary
+        The options of run_pipeline() the run was started with, with the NDVI
+        threshold once it was chosen.
     """
+    results_dir = os.path.abspath(results_dir)
+    run_state = read_run_manifest(results_dir)
+    inputs = run_state["inputs"]
+
+    watershed_gdf, imagery_da, imagery_crs = validate_inputs(
+        watershed_path=inputs["watershed_path"],
+        waterbodies_path=inputs["waterbodies_path"],
+        watercourses_path=inputs["watercourses_path"],
+        imagery_path=inputs["imagery_path"],
+        multiple_watersheds=run_state["options"].get("zonal", False),
+    )
+    os.chdir(results_dir)
 
-    # 3. Write the html string as an HTML file
-    with open("5-report.html", "w") as f:
-        f.write(html)
+    print(f"\nResuming the run in {results_dir}\n")
+    log_filepath = run_state["log_filepath"]
+    with open(log_filepath, "a") as file:
+        file.write(f"Run resumed @ {datetime.now().strftime('%H:%M:%S')}\n\n")
+
+    data_dict = {
+        **inputs,
+        "watershed": watershed_gdf,
+        "imagery": imagery_da,
+        "imagery_crs": imagery_crs,
+        "results_dir": results_dir,
+        "log_filepath": log_filepath,
+    }
+
+    return data_dict, run_state["options"]
 
 
 # %% def main function
 
 
-def main():
+def _positive_int(value):
+    """Parse a command line option that must be a whole number of at least 1."""
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"expected a positive integer, got '{value}'")
+    return number
+
+
+def _worker_count(value):
+    """Parse a number of processes, where negative numbers count from all of them."""
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number == 0:
+        raise argparse.ArgumentTypeError(f"expected a non-zero integer, got '{value}'")
+    return number
+
+
+def _threshold_option(value):
+    """Parse the NDVI threshold given on the command line."""
+    try:
+        return _parse_threshold(value)
+    except Exception as e:
+        raise argparse.ArgumentTypeError(str(e).removeprefix("Error: "))
+
+
+def parse_args():
+    """Parse the command line options."""
+    parser = argparse.ArgumentParser(
+        description="Quantify the riparian connectivity of a watershed."
+    )
+    parser.add_argument(
+        "--ndvi-block-size",
+        type=_positive_int,
+        default=None,
+        metavar="PIXELS",
+        help="Compute the NDVI image in blocks of PIXELS x PIXELS read straight from"
+        " disk, keeping memory use bounded on large scenes.",
+    )
+    parser.add_argument(
+        "--precision",
+        choices=NDVI_PRECISIONS,
+        default="float64",
+        help="Data type the NDVI image is computed and stored in. 'float32' and"
+        " 'int16' (scaled by 1e-4) halve and quarter the memory and disk space of"
+        " 'float64' (the default).",
+    )
+    parser.add_argument(
+        "--cog",
+        nargs="?",
+        const="deflate",
+        default=None,
+        choices=COG_COMPRESSIONS,
+        help="Write the NDVI and classified images as Cloud-Optimized GeoTIFFs:"
+        " internally tiled, compressed with a predictor and with internal overviews."
+        " The compression is 'deflate' (the default) or 'zstd'.",
+    )
+    parser.add_argument(
+        "--scenes",
+        nargs="+",
+        default=None,
+        metavar="PATH",
+        help="Other Sentinel-2 scenes of the same tile as the imagery, e.g. the other"
+        " dates of a growing season. The NDVI image is then a composite of the NDVI of"
+        " every date, computed in chunks of --ndvi-block-size pixels, and the"
+        " statistics of each date are written to '2-riparian_buffer-NDVI_dates.csv'.",
+    )
+    parser.add_argument(
+        "--composite",
+        choices=NDVI_COMPOSITES,
+        default="median",
+        help="Composite of the NDVI of the scenes used as the NDVI image: the 'median'"
+        " (the default) or 'max' of each pixel over the dates. Both are written.",
+    )
+    parser.add_argument(
+        "--zonal",
+        action="store_true",
+        help="Accept a watershed layer with several watersheds, one per feature, and"
+        " calculate the statistics of every watershed in a single pass over the"
+        " classified raster, one row per watershed.",
+    )
+    parser.add_argument(
+        "--zone-field",
+        default=None,
+        metavar="FIELD",
+        help="Field of the watershed layer naming each watershed with --zonal. By"
+        " default the watersheds are numbered from 1.",
+    )
+    parser.add_argument(
+        "--reach-stats",
+        action="store_true",
+        help="Also calculate the vegetated and not vegetated riparian area of each"
+        " water course and water body, allocating every riparian buffer pixel to its"
+        " nearest one, and write them as attributes of the two layers.",
+    )
+    parser.add_argument(
+        "--stats-engine",
+        choices=["vector", "raster"],
+        default="vector",
+        help="Calculate the statistics from the vegetation polygons ('vector', the"
+        " default) or directly from the classified raster ('raster').",
+    )
+    parser.add_argument(
+        "--no-report",
+        dest="make_report",
+        action="store_false",
+        help="Do not produce the HTML report. With '--stats-engine raster' the"
+        " classified raster is then never converted to polygons.",
+    )
+    parser.add_argument(
+        "--vector-format",
+        choices=list(VECTOR_FORMATS),
+        default="gpkg",
+        help="Format of the riparian buffer and vegetation feature outputs: GeoPackage"
+        " ('gpkg', the default), GeoPackage written through pyogrio's Arrow interface"
+        " ('gpkg-arrow') or GeoParquet ('parquet').",
+    )
+    parser.add_argument(
+        "--report-map",
+        choices=["vector", "tiles"],
+        default="vector",
+        help="Embed the vegetation features in the report's map ('vector', the"
+        " default) or render the classified raster as PNG map tiles that the report"
+        " references ('tiles'), which keeps the report small for large watersheds.",
+    )
+    parser.add_argument(
+        "--tile-size",
+        type=_positive_int,
+        default=None,
+        metavar="PIXELS",
+        help="Compute, classify and measure the NDVI image in tiles of PIXELS x PIXELS"
+        " on a pool of processes. The statistics are the same as the raster engine's.",
+    )
+    parser.add_argument(
+        "--tile-workers",
+        type=_worker_count,
+        default=-1,
+        help="Number of processes used with --tile-size. The default is -1, which uses"
+        " all available processors, and -2 leaves one of them unused.",
+    )
+    parser.add_argument(
+        "--buffer-mode",
+        choices=BUFFER_MODES,
+        default="vector",
+        help="Create the riparian buffer by buffering the water bodies and water"
+        " courses ('vector', the default) or with a distance transform of the water"
+        " pixels on the grid of the imagery ('raster'), which is faster for dense"
+        " networks.",
+    )
+    parser.add_argument(
+        "--buffer-workers",
+        type=int,
+        default=None,
+        metavar="N",
+        help="Buffer the water bodies and water courses in spatially grouped chunks on"
+        " N processes (-1 for all available processors) and merge them with a"
+        " hierarchical union.",
+    )
+    parser.add_argument(
+        "--threshold",
+        dest="ndvi_threshold",
+        type=_threshold_option,
+        default=None,
+        metavar="T",
+        help="The NDVI threshold, between 0 and 1, or 'otsu' for the Otsu-generated"
+        " suggestion, instead of prompting for it. The NDVI image is then read once to"
+        " build its histogram and classify it. In batch mode, the threshold of the"
+        " watersheds of the manifest without one.",
+    )
+    parser.add_argument(
+        "--sweep",
+        dest="sweep_thresholds",
+        type=parse_thresholds,
+        default=None,
+        metavar="THRESHOLDS",
+        help="Calculate the statistics for many NDVI thresholds at once instead of"
+        " classifying the NDVI image with one threshold. THRESHOLDS is a comma"
+        " separated list (e.g. '0.2,0.3,0.45') or a 'start:stop:step' range (e.g."
+        " '0.1:0.9:0.05'). The table is written to '4-threshold_sweep.csv'.",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=None,
+        metavar="DIR",
+        help="Reuse the riparian buffer, NDVI image and classified image from DIR when"
+        " they were produced before from the same inputs and parameters, e.g. when"
+        " only the NDVI threshold changes. New outputs are added to DIR.",
+    )
+    parser.add_argument(
+        "--cache-size-mb",
+        type=float,
+        default=10240,
+        metavar="MB",
+        help="Maximum size of the cache. The least recently used outputs are removed"
+        " beyond it. The default is 10240 (10 GB).",
+    )
+    parser.add_argument(
+        "--profile-stage",
+        choices=PIPELINE_STAGES,
+        default=None,
+        help="Profile one stage of the analysis with cProfile and write the profile to"
+        " '6-profile-<stage>.prof'. The process ID is printed when the stage starts,"
+        " so a sampling profiler such as py-spy can be attached to it instead.",
+    )
+    parser.add_argument(
+        "--validate-only",
+        action="store_true",
+        help="Only check the inputs, from the watershed boundary and the metadata of"
+        " the other layers and the imagery, and stop without running the analysis."
+        " With --batch every watershed of the manifest is checked.",
+    )
+    parser.add_argument(
+        "--resume",
+        default=None,
+        metavar="RESULTS_DIR",
+        help="Continue an interrupted run in RESULTS_DIR with the inputs and options"
+        " recorded in its run_manifest.json. Completed stages whose inputs have not"
+        " changed are reloaded from disk rather than recomputed.",
+    )
+    parser.add_argument(
+        "--batch",
+        default=None,
+        metavar="MANIFEST",
+        help="Process every watershed listed in a CSV, JSON or YAML manifest without"
+        " prompting for any input. See read_manifest() for the expected fields.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=_positive_int,
+        default=1,
+        help="Number of watersheds processed concurrently in batch mode. The default"
+        " is 1.",
+    )
+    parser.add_argument(
+        "--output-dir",
+        default="results",
+        help="Directory in which a results directory is created for each watershed"
+        " in batch mode. The default is 'results'.",
+    )
+    return parser.parse_args()
+
+
+def _classification_stage(
+    ndvi_threshold,
+    classification_key,
+    log_filepath,
+    block_size,
+    cache_dir,
+    cache_size_mb,
+    cog,
+    run_state,
+):
     """
-    Is the main function of the script.
+    Classify the NDVI image with classify_ndvi_windowed(), unless it can be reused.
 
-    Calls all other functions and excecutes the program.
+    The classified image is reused when the run already completed the classification
+    with the same key, or when it is cached.
 
-    Parameters (inputs)
-    -------------------
-    None.
+    Returns
+    -------
+    riparian_da : RioXarray DataArray
+        Riparian buffer pixels classified into vegetation (1) and non-vegetation (2).
 
-    Returns (outputs)
-    -----------------
-    None.
+    histogram : tuple of numpy.ndarray
+        The histogram of the NDVI image, or None if the classification was reused.
     """
-    # 1) Function to read the vector and raster data - John
-    data_dict = load_data_ui()
+    if stage_completed(run_state, "classify", classification_key, log_filepath) or (
+        cache_dir
+        and cache_fetch(
+            cache_dir,
+            classification_key,
+            "3-riparian_buffer-vegetation.tiff",
+            log_filepath,
+        )
+    ):
+        riparian_da = rxr.open_rasterio("3-riparian_buffer-vegetation.tiff").squeeze(
+            "band", drop=True
+        )
+        histogram = None
+    else:
+        riparian_da, histogram = classify_ndvi_windowed(
+            ndvi_path="2-riparian_buffer-NDVI.tiff",
+            threshold=ndvi_threshold,
+            log_filepath=log_filepath,
+            block_size=block_size,
+            cog=cog,
+        )
+        if cache_dir:
+            cache_store(
+                cache_dir,
+                classification_key,
+                "3-riparian_buffer-vegetation.tiff",
+                cache_size_mb,
+            )
+    record_stage(
+        run_state,
+        "classify",
+        classification_key,
+        ["3-riparian_buffer-vegetation.tiff"],
+        ndvi_threshold=ndvi_threshold,
+    )
 
-    # 2) Function to perform vector operations to create riparian zone - Ben
-    riparian_buff_geom = vector_operations(
-        watershed_gdf=data_dict["watershed"],
-        waterbodies_gdf=data_dict["waterbodies"],
-        watercourses_gdf=data_dict["watercourses"],
-        imagery_crs=data_dict["imagery_crs"],
-        buffer_width=data_dict["buffer_width"],
-        log_filepath=data_dict["log_filepath"],
+    return riparian_da, histogram
+
+
+def run_pipeline(
+    data_dict,
+    ndvi_threshold=None,
+    ndvi_block_size=None,
+    stats_engine="vector",
+    make_report=True,
+    tile_size=None,
+    tile_workers=-1,
+    buffer_workers=None,
+    cache_dir=None,
+    cache_size_mb=10240,
+    sweep_thresholds=None,
+    precision="float64",
+    cog=None,
+    report_map="vector",
+    vector_format="gpkg",
+    scenes=None,
+    composite="median",
+    zonal=False,
+    zone_field=None,
+    reach_stats=False,
+    buffer_mode="vector",
+    metrics=None,
+    profile_stage=None,
+    resume=False,
+):
+    """
+    Run the analysis on loaded data, from the riparian buffer to the report.
+
+    The outputs are written to the current working directory, i.e. the results
+    directory created by load_data_ui() or load_data().
+
+    Parameters
+    ----------
+    data_dict : dictionary
+        The dictionary returned by load_data_ui() or load_data().
+
+    ndvi_threshold : float or str, optional
+        The NDVI threshold, or 'otsu' to use the Otsu-generated threshold suggestion.
+        The default is None, which prompts the user for the threshold.
+
+    ndvi_block_size : int, optional
+        When given, the NDVI image is computed block by block with
+        create_ndvi_windowed() using blocks of this many pixels per side. The default
+        is None, which computes the NDVI image in memory with create_ndvi(). The NDVI
+        image is classified with classify_ndvi_windowed() in blocks of the same size,
+        1024 by default.
+
+    stats_engine : str, optional
+        'vector' (the default) calculates the statistics from the vegetation and
+        not-vegetation polygons with riparian_stats(). 'raster' calculates them
+        directly from the classified raster with riparian_raster_stats(), and the
+        raster is only converted to polygons if the report is produced.
+
+    make_report : bool, optional
+        Whether to produce the HTML report. The default is True.
+
+    tile_size : int, optional
+        When given, the NDVI image is computed, classified and measured in tiles of
+        this many pixels per side on a pool of tile_workers processes, and the
+        statistics are calculated with tiled_riparian_stats(). stats_engine is then
+        ignored. The default is None.
+
+    tile_workers : int, optional
+        The number of processes used in tile mode and to render the map tiles of the
+        report. The default is -1, which uses all available processors, and other
+        negative values leave -tile_workers - 1 of them unused.
+
+    buffer_workers : int, optional
+        When given, the riparian buffer is created in parallel on this many worker
+        processes. See vector_operations(). The default is None.
+
+    cache_dir : str, optional
+        When given, the riparian buffer, NDVI image and classified image are reused
+        from this cache directory if they were produced before from identical inputs
+        and parameters, and stored in it otherwise. The classified image is not cached
+        in tile mode. The default is None, which disables the cache.
+
+    cache_size_mb : float, optional
+        The maximum size of the cache in megabytes. The least recently used outputs
+        are evicted beyond it. The default is 10240 (10 GB).
+
+    sweep_thresholds : list of float, optional
+        When given, the statistics are calculated for each of these NDVI thresholds
+        with threshold_sweep() once the NDVI image is created, and the analysis stops
+        there. ndvi_threshold is then ignored. The default is None.
+
+    precision : str, optional
+        The data type the NDVI image is computed and stored in: 'float64' (the
+        default), 'float32' or 'int16' (scaled by NDVI_INT16_SCALE). See create_ndvi().
+        With 'float32' NDVI values differ from 'float64' by less than 1e-7 and with
+        'int16' by at most 5e-5, so only pixels whose NDVI value is that close to the
+        threshold can change class.
+
+    cog : str, optional
+        When given, the NDVI and classified images are written as Cloud-Optimized
+        GeoTIFFs with internal overviews, compressed with this codec ('deflate' or
+        'zstd'). See to_cog(). The default is None, which writes plain GeoTIFFs.
+
+    report_map : str, optional
+        'vector' (the default) embeds the vegetation and not-vegetation features in
+        the map of the report. 'tiles' renders the classified image as PNG map tiles
+        with render_map_tiles() and the report references them, which keeps the
+        report small and its build time bounded for large watersheds. The
+        classified image is then only converted to features for the 'vector'
+        statistics engine.
+
+    vector_format : str, optional
+        The format of the vector outputs: 'gpkg' (the default), 'gpkg-arrow' or
+        'parquet' (GeoParquet). See write_vector().
+
+    scenes : list of str, optional
+        Paths to other scenes of the same Sentinel-2 tile as the imagery, acquired on
+        other dates. When given, the NDVI image is a composite of the NDVI of the
+        imagery and of these scenes, created with create_ndvi_composite() in chunks
+        of ndvi_block_size pixels (1024 by default). tile_size is then only used to
+        classify the NDVI image. The default is None.
+
+    composite : str, optional
+        The composite of the NDVI time series used as the NDVI image when scenes are
+        given, one of NDVI_COMPOSITES. The default is 'median'.
+
+    zonal : bool, optional
+        Whether the watershed layer holds several watersheds, one per feature, whose
+        statistics are calculated together with zonal_riparian_stats(), one row per
+        watershed. stats_engine is then ignored. The default is False.
+
+    zone_field : str, optional
+        The field of the watershed layer naming each watershed in zonal mode. The
+        default is None, which numbers them.
+
+    reach_stats : bool, optional
+        Whether to calculate the vegetated and not vegetated area of the riparian
+        buffer of each water course and water body with reach_riparian_stats(). The
+        default is False.
+
+    buffer_mode : str, optional
+        'vector' (the default) creates the riparian buffer by buffering the water
+        bodies and water courses with vector_operations(). 'raster' creates it on the
+        grid of the imagery with raster_buffer(), in blocks of ndvi_block_size pixels
+        (1024 by default), and the NDVI image is masked with '1_riparian_buffer.tiff'.
+        buffer_workers is then ignored.
+
+    metrics : list, optional
+        The measures of the stages that already ran, such as loading the data. The
+        measures of each stage are appended to it with measure_stage() and written to
+        '6-metrics.json' and '6-metrics.csv' at the end of the run. The default is
+        None, which starts an empty list.
+
+    profile_stage : str, optional
+        The name of a stage of PIPELINE_STAGES to profile with cProfile. See
+        measure_stage(). The default is None.
+
+    resume : bool, optional
+        Whether to continue the run recorded in the run manifest of the working
+        directory. Each stage is recorded in 'run_manifest.json' with a key of its
+        inputs and parameters and the paths of its outputs. When resuming, the
+        stages completed with the same key are reloaded from disk. See
+        resume_run(). The default is False.
+
+    Returns
+    -------
+    stats_df : Pandas DataFrame
+        The riparian connectivity statistics, with one row per threshold in a sweep.
+    """
+    # The tiled pipeline calculates the statistics as it classifies the tiles
+    if tile_size:
+        stats_engine = "tiled"
+    # The statistics of many watersheds are calculated from the classified raster
+    if zonal:
+        stats_engine = "zonal"
+
+    log_filepath = data_dict["log_filepath"]
+    if metrics is None:
+        metrics = []
+
+    # Keys of the stage outputs, from the hashes of their inputs
+    buffer_key = cache_key(
+        "buffer",
+        input_hash(data_dict["watershed_path"]),
+        input_hash(data_dict["waterbodies_path"]),
+        input_hash(data_dict["watercourses_path"]),
+        data_dict["buffer_width"],
+        data_dict["imagery_crs"].to_wkt(),
+        vector_format,
+    )
+    if buffer_mode == "raster":
+        # The buffer is made of the pixels of the imagery
+        buffer_key = cache_key(
+            "raster_buffer", buffer_key, input_hash(data_dict["imagery_path"])
+        )
+    # The NDVI step's mode and block size, which decide how the image is computed
+    if scenes:
+        ndvi_mode, ndvi_block = "composite", ndvi_block_size or 1024
+    elif tile_size:
+        ndvi_mode, ndvi_block = "tiled", tile_size
+    elif ndvi_block_size:
+        ndvi_mode, ndvi_block = "windowed", ndvi_block_size
+    else:
+        ndvi_mode, ndvi_block = "in-memory", None
+    ndvi_key = cache_key(
+        "ndvi",
+        buffer_key,
+        input_hash(data_dict["imagery_path"]),
+        precision,
+        cog,
+        ndvi_mode,
+        ndvi_block,
+    )
+    if scenes:
+        ndvi_key = cache_key(
+            "composite", ndvi_key, composite, *[input_hash(scene) for scene in scenes]
+        )
+
+    # Record the completed stages so that an interrupted run can be resumed
+    run_state = start_run_manifest(
+        data_dict=data_dict,
+        options={
+            "ndvi_threshold": ndvi_threshold,
+            "ndvi_block_size": ndvi_block_size,
+            "stats_engine": stats_engine,
+            "make_report": make_report,
+            "tile_size": tile_size,
+            "tile_workers": tile_workers,
+            "buffer_workers": buffer_workers,
+            "cache_dir": cache_dir,
+            "cache_size_mb": cache_size_mb,
+            "sweep_thresholds": sweep_thresholds,
+            "precision": precision,
+            "cog": cog,
+            "report_map": report_map,
+            "vector_format": vector_format,
+            "scenes": scenes,
+            "composite": composite,
+            "zonal": zonal,
+            "zone_field": zone_field,
+            "reach_stats": reach_stats,
+            "buffer_mode": buffer_mode,
+        },
+        resume=resume,
     )
 
+    # 2) Function to perform vector operations to create riparian zone - Ben
+    with measure_stage(metrics, "buffer", profile_stage) as stage:
+        if buffer_mode == "raster":
+            # The NDVI image is masked with the buffer pixels rather than polygons
+            riparian_buff_path = "1_riparian_buffer.tiff"
+        else:
+            riparian_buff_path = "1_riparian_buffer" + VECTOR_FORMATS[vector_format]
+        if stage_completed(run_state, "buffer", buffer_key, log_filepath) or (
+            cache_dir
+            and cache_fetch(cache_dir, buffer_key, riparian_buff_path, log_filepath)
+        ):
+            if buffer_mode == "raster":
+                riparian_buff_geom = riparian_buff_path
+            else:
+                riparian_buff_geom = read_vector(riparian_buff_path).geometry
+        else:
+            if buffer_mode == "raster":
+                # 2) b. Function to create the riparian zone with a distance transform
+                riparian_buff_geom = raster_buffer(
+                    watershed_gdf=data_dict["watershed"],
+                    waterbodies_gdf=data_dict["waterbodies_path"],
+                    watercourses_gdf=data_dict["watercourses_path"],
+                    imagery_path=data_dict["imagery_path"],
+                    buffer_width=data_dict["buffer_width"],
+                    log_filepath=log_filepath,
+                    block_size=ndvi_block_size or 1024,
+                )
+            else:
+                riparian_buff_geom = vector_operations(
+                    watershed_gdf=data_dict["watershed"],
+                    waterbodies_gdf=data_dict["waterbodies_path"],
+                    watercourses_gdf=data_dict["watercourses_path"],
+                    imagery_crs=data_dict["imagery_crs"],
+                    buffer_width=data_dict["buffer_width"],
+                    log_filepath=log_filepath,
+                    buffer_workers=buffer_workers,
+                    vector_format=vector_format,
+                )
+            if cache_dir:
+                cache_store(cache_dir, buffer_key, riparian_buff_path, cache_size_mb)
+        record_stage(run_state, "buffer", buffer_key, [riparian_buff_path])
+        stage["outputs"] = [riparian_buff_path]
+        if buffer_mode == "raster":
+            with rasterio.open(riparian_buff_path) as src:
+                stage["pixels"] = src.width * src.height
+        else:
+            stage["features"] = len(riparian_buff_geom)
+
     # 3) Function to perform NDVI image processing - Haley
-    ndvi_da = create_ndvi(
-        imagery_da=data_dict["imagery"],
-        riparian_buff_geom=riparian_buff_geom,
-        log_filepath=data_dict["log_filepath"],
+    with measure_stage(metrics, "ndvi", profile_stage) as stage:
+        if stage_completed(run_state, "ndvi", ndvi_key, log_filepath) or (
+            cache_dir
+            and cache_fetch(
+                cache_dir, ndvi_key, "2-riparian_buffer-NDVI.tiff", log_filepath
+            )
+        ):
+            ndvi_da = open_ndvi("2-riparian_buffer-NDVI.tiff")
+        else:
+            if scenes:
+                # 3) b. Functions to composite the NDVI of a time series of scenes
+                ndvi_da = create_ndvi_composite(
+                    imagery_paths=[data_dict["imagery_path"], *scenes],
+                    riparian_buff_geom=riparian_buff_geom,
+                    log_filepath=log_filepath,
+                    composite=composite,
+                    chunk_size=ndvi_block_size or 1024,
+                    precision=precision,
+                    cog=cog,
+                )
+            elif tile_size:
+                ndvi_da = create_ndvi_windowed(
+                    imagery_path=data_dict["imagery_path"],
+                    riparian_buff_geom=riparian_buff_geom,
+                    log_filepath=log_filepath,
+                    block_size=tile_size,
+                    n_jobs=tile_workers,
+                    precision=precision,
+                    cog=cog,
+                )
+            elif ndvi_block_size:
+                ndvi_da = create_ndvi_windowed(
+                    imagery_path=data_dict["imagery_path"],
+                    riparian_buff_geom=riparian_buff_geom,
+                    log_filepath=log_filepath,
+                    block_size=ndvi_block_size,
+                    precision=precision,
+                    cog=cog,
+                )
+            else:
+                ndvi_da = create_ndvi(
+                    imagery_da=data_dict["imagery"],
+                    riparian_buff_geom=riparian_buff_geom,
+                    log_filepath=log_filepath,
+                    precision=precision,
+                    cog=cog,
+                )
+            if cache_dir:
+                cache_store(
+                    cache_dir, ndvi_key, "2-riparian_buffer-NDVI.tiff", cache_size_mb
+                )
+        record_stage(run_state, "ndvi", ndvi_key, ["2-riparian_buffer-NDVI.tiff"])
+        stage["outputs"] = ["2-riparian_buffer-NDVI.tiff"]
+        if scenes:
+            stage["outputs"] += [
+                f"2-riparian_buffer-NDVI_{name}.tiff"
+                for name in NDVI_COMPOSITES
+                if name != composite
+            ] + ["2-riparian_buffer-NDVI_dates.csv"]
+        stage["pixels"] = ndvi_da.size
+
+    # 4) b. With a threshold given up front, the NDVI histogram is built in the same
+    #   pass over the NDVI image as the classification
+    riparian_da = histogram = None
+    if (
+        stats_engine != "tiled"
+        and sweep_thresholds is None
+        and ndvi_threshold not in (None, "otsu")
+    ):
+        classification_key = cache_key("classification", ndvi_key, ndvi_threshold)
+        with measure_stage(metrics, "classify", profile_stage) as stage:
+            riparian_da, histogram = _classification_stage(
+                ndvi_threshold=ndvi_threshold,
+                classification_key=classification_key,
+                log_filepath=log_filepath,
+                block_size=ndvi_block_size or 1024,
+                cache_dir=cache_dir,
+                cache_size_mb=cache_size_mb,
+                cog=cog,
+                run_state=run_state,
+            )
+            stage["outputs"] = ["3-riparian_buffer-vegetation.tiff"]
+            stage["pixels"] = riparian_da.size
+
+    # A reused classification with a fixed threshold needs no pass over the NDVI image
+    #   for its histogram, unless the plot of the histogram is missing
+    classification_reused = (
+        riparian_da is not None
+        and histogram is None
+        and os.path.exists("3-riparian_buffer-NDVI_histogram.png")
     )
 
     # 4) a. Function to suggest a threshold to separated vegetated from non-veg - Taji
-    otsu_threshold_suggestion(
-        ndvi_da=ndvi_da.copy(),
-        log_filepath=data_dict["log_filepath"],
-    )
+    if not classification_reused:
+        with measure_stage(metrics, "otsu", profile_stage) as stage:
+            if histogram is None:
+                histogram = ndvi_histogram(ndvi_da)
+            suggested_threshold = otsu_threshold_suggestion(
+                ndvi_da=ndvi_da,
+                log_filepath=log_filepath,
+                histogram=histogram,
+            )
+            stage["outputs"] = []
+            stage["pixels"] = int(histogram[0].sum())
+    if ndvi_threshold == "otsu":
+        ndvi_threshold = suggested_threshold
+
+    # 6) c. Function to calculate the statistics for many NDVI thresholds - John
+    if sweep_thresholds is not None:
+        with measure_stage(metrics, "stats", profile_stage) as stage:
+            stats_df = threshold_sweep(
+                watershed_name=data_dict["watershed_name"],
+                buffer_width=data_dict["buffer_width"],
+                thresholds=sweep_thresholds,
+                watershed_gdf=data_dict["watershed"],
+                ndvi_da=ndvi_da,
+                log_filepath=log_filepath,
+            )
+            stage["outputs"] = ["4-threshold_sweep.csv"]
+            stage["pixels"] = ndvi_da.size
+        print(stats_df.to_string())
+        write_metrics(metrics, log_filepath)
+        return stats_df
+
+    # Not measured, as it may wait for the user's input
+    if classification_reused:
+        with open(log_filepath, "a") as file:
+            file.write(f"NDVI threshold input: {ndvi_threshold}\n\n")
+    else:
+        ndvi_threshold = select_ndvi_threshold(
+            ndvi_da=ndvi_da,
+            log_filepath=log_filepath,
+            threshold=ndvi_threshold,
+            histogram=histogram,
+        )
+    # A resumed run continues with the threshold chosen
+    run_state["options"]["ndvi_threshold"] = ndvi_threshold
+    write_run_manifest(run_state)
+    classification_key = cache_key("classification", ndvi_key, ndvi_threshold)
 
     # 4) b. Function to create Riparian Vegetation DataArray - Taji
-    riparian_da, ndvi_threshold = create_binary_riparian_da(
-        ndvi_da=ndvi_da,
-        log_filepath=data_dict["log_filepath"],
-    )
+    if stats_engine == "tiled":
+        # 4) c. Functions to classify the NDVI image and measure its features in tiles
+        with measure_stage(metrics, "classify", profile_stage) as stage:
+            if stage_completed(run_state, "classify", classification_key, log_filepath):
+                riparian_da = rxr.open_rasterio(
+                    "3-riparian_buffer-vegetation.tiff"
+                ).squeeze("band", drop=True)
+                stats_df = pd.read_csv("4-statistics_table.csv", index_col=0)
+            else:
+                riparian_da, stats_df = tiled_riparian_stats(
+                    watershed_name=data_dict["watershed_name"],
+                    buffer_width=data_dict["buffer_width"],
+                    ndvi_threshold=ndvi_threshold,
+                    watershed_gdf=data_dict["watershed"],
+                    ndvi_path="2-riparian_buffer-NDVI.tiff",
+                    log_filepath=log_filepath,
+                    tile_size=tile_size,
+                    n_jobs=tile_workers,
+                    cog=cog,
+                )
+            stage["outputs"] = [
+                "3-riparian_buffer-vegetation.tiff",
+                "4-statistics_table.csv",
+            ]
+            record_stage(
+                run_state,
+                "classify",
+                classification_key,
+                stage["outputs"],
+                ndvi_threshold=ndvi_threshold,
+            )
+            stage["pixels"] = riparian_da.size
+    elif riparian_da is None:
+        with measure_stage(metrics, "classify", profile_stage) as stage:
+            riparian_da, _ = _classification_stage(
+                ndvi_threshold=ndvi_threshold,
+                classification_key=classification_key,
+                log_filepath=log_filepath,
+                block_size=ndvi_block_size or 1024,
+                cache_dir=cache_dir,
+                cache_size_mb=cache_size_mb,
+                cog=cog,
+                run_state=run_state,
+            )
+            stage["outputs"] = ["3-riparian_buffer-vegetation.tiff"]
+            stage["pixels"] = riparian_da.size
 
     # 5) Function to convert Riparian Vegetation DataArray to GeoDataFrame - John
-    riparian_dict = extract_raster_features(
-        da=riparian_da, log_filepath=data_dict["log_filepath"]
-    )
+    if stats_engine == "vector" or (make_report and report_map == "vector"):
+        with measure_stage(metrics, "vectorize", profile_stage) as stage:
+            vectorize_key = cache_key("vectorize", classification_key, vector_format)
+            feature_paths = {
+                name: filename + VECTOR_FORMATS[vector_format]
+                for name, filename in [
+                    ("vegetation_gdf", "4-riparian_buffer-vegetation"),
+                    ("not_vegetation_gdf", "4-riparian_buffer-not_vegetation"),
+                    ("riparian_buffer_gdf", "4-riparian_buffer"),
+                ]
+            }
+            if stage_completed(run_state, "vectorize", vectorize_key, log_filepath):
+                riparian_dict = {
+                    name: read_vector(path) for name, path in feature_paths.items()
+                }
+            else:
+                riparian_dict = extract_raster_features(
+                    da=riparian_da,
+                    log_filepath=data_dict["log_filepath"],
+                    vector_format=vector_format,
+                )
+            stage["outputs"] = list(feature_paths.values())
+            record_stage(run_state, "vectorize", vectorize_key, stage["outputs"])
+            stage["pixels"] = riparian_da.size
+            stage["features"] = sum(len(gdf) for gdf in riparian_dict.values())
 
     # 6) Function to calculate Riparian Connectivity Statistics - Taji / John
-    stats_df = riparian_stats(
-        watershed_name=data_dict["watershed_name"],
-        buffer_width=data_dict["buffer_width"],
-        ndvi_threshold=ndvi_threshold,
-        watershed_gdf=data_dict["watershed"],
-        riparian_buffer_gdf=riparian_dict["riparian_buffer_gdf"],
-        vegetation_gdf=riparian_dict["vegetation_gdf"],
-        not_vegetation_gdf=riparian_dict["not_vegetation_gdf"],
-        log_filepath=data_dict["log_filepath"],
-    )
+    if stats_engine in ["raster", "vector", "zonal"]:
+        with measure_stage(metrics, "stats", profile_stage) as stage:
+            stats_key = cache_key("stats", classification_key, stats_engine, zone_field)
+            if stage_completed(run_state, "stats", stats_key, log_filepath):
+                stats_df = pd.read_csv("4-statistics_table.csv", index_col=0)
+            elif stats_engine == "zonal":
+                # 6) d. Function to calculate the statistics of many watersheds
+                stats_df = zonal_riparian_stats(
+                    buffer_width=data_dict["buffer_width"],
+                    ndvi_threshold=ndvi_threshold,
+                    watershed_gdf=data_dict["watershed"],
+                    riparian_da=riparian_da,
+                    log_filepath=data_dict["log_filepath"],
+                    zone_field=zone_field,
+                )
+            elif stats_engine == "raster":
+                # 6) b. Function to calculate the statistics from the raster directly
+                stats_df = riparian_raster_stats(
+                    watershed_name=data_dict["watershed_name"],
+                    buffer_width=data_dict["buffer_width"],
+                    ndvi_threshold=ndvi_threshold,
+                    watershed_gdf=data_dict["watershed"],
+                    riparian_da=riparian_da,
+                    log_filepath=data_dict["log_filepath"],
+                )
+            else:
+                stats_df = riparian_stats(
+                    watershed_name=data_dict["watershed_name"],
+                    buffer_width=data_dict["buffer_width"],
+                    ndvi_threshold=ndvi_threshold,
+                    watershed_gdf=data_dict["watershed"],
+                    riparian_buffer_gdf=riparian_dict["riparian_buffer_gdf"],
+                    vegetation_gdf=riparian_dict["vegetation_gdf"],
+                    not_vegetation_gdf=riparian_dict["not_vegetation_gdf"],
+                    log_filepath=data_dict["log_filepath"],
+                )
+            stage["outputs"] = ["4-statistics_table.csv"]
+            record_stage(run_state, "stats", stats_key, stage["outputs"])
+            if stats_engine in ["raster", "zonal"]:
+                stage["pixels"] = riparian_da.size
+            else:
+                stage["features"] = sum(len(gdf) for gdf in riparian_dict.values())
     print(stats_df.transpose())
 
+    # 6) e. Function to calculate the vegetation coverage of each reach - John
+    reaches_key = cache_key("reaches", classification_key, buffer_key)
+    if reach_stats and not stage_completed(
+        run_state, "reaches", reaches_key, log_filepath
+    ):
+        with measure_stage(metrics, "reaches", profile_stage) as stage:
+            watercourses_gdf, waterbodies_gdf = reach_riparian_stats(
+                watershed_gdf=data_dict["watershed"],
+                waterbodies_gdf=data_dict["waterbodies_path"],
+                watercourses_gdf=data_dict["watercourses_path"],
+                buffer_width=data_dict["buffer_width"],
+                riparian_da=riparian_da,
+                log_filepath=data_dict["log_filepath"],
+                block_size=ndvi_block_size or 1024,
+                vector_format=vector_format,
+            )
+            stage["outputs"] = [
+                "4-watercourses-reach_coverage" + VECTOR_FORMATS[vector_format],
+                "4-waterbodies-reach_coverage" + VECTOR_FORMATS[vector_format],
+            ]
+            record_stage(run_state, "reaches", reaches_key, stage["outputs"])
+            stage["pixels"] = riparian_da.size
+            stage["features"] = len(watercourses_gdf) + len(waterbodies_gdf)
+
     # 7) Function to produce a report - John & Haley
-    report(
-        stats_df=stats_df,
-        vegetation_gdf=riparian_dict["vegetation_gdf"],
-        not_vegetation_gdf=riparian_dict["not_vegetation_gdf"],
-        log_filepath=data_dict["log_filepath"],
+    report_key = cache_key("report", classification_key, report_map)
+    if make_report and not stage_completed(
+        run_state, "report", report_key, log_filepath
+    ):
+        with measure_stage(metrics, "report", profile_stage) as stage:
+            if report_map == "tiles":
+                report(
+                    stats_df=stats_df,
+                    vegetation_gdf=None,
+                    not_vegetation_gdf=None,
+                    log_filepath=data_dict["log_filepath"],
+                    map_tiles=render_map_tiles(
+                        riparian_path="3-riparian_buffer-vegetation.tiff",
+                        log_filepath=data_dict["log_filepath"],
+                        n_jobs=tile_workers,
+                    ),
+                )
+                stage["outputs"] = ["5-report.html", "5-report_tiles"]
+                record_stage(run_state, "report", report_key, stage["outputs"])
+                stage["pixels"] = riparian_da.size
+            else:
+                report(
+                    stats_df=stats_df,
+                    vegetation_gdf=riparian_dict["vegetation_gdf"],
+                    not_vegetation_gdf=riparian_dict["not_vegetation_gdf"],
+                    log_filepath=data_dict["log_filepath"],
+                )
+                stage["outputs"] = ["5-report.html"]
+                record_stage(run_state, "report", report_key, stage["outputs"])
+                stage["features"] = len(riparian_dict["vegetation_gdf"]) + len(
+                    riparian_dict["not_vegetation_gdf"]
+                )
+
+    write_metrics(metrics, log_filepath)
+
+    return stats_df
+
+
+def main(
+    ndvi_threshold=None,
+    ndvi_block_size=None,
+    stats_engine="vector",
+    make_report=True,
+    tile_size=None,
+    tile_workers=-1,
+    buffer_workers=None,
+    cache_dir=None,
+    cache_size_mb=10240,
+    sweep_thresholds=None,
+    precision="float64",
+    cog=None,
+    report_map="vector",
+    vector_format="gpkg",
+    scenes=None,
+    composite="median",
+    zonal=False,
+    zone_field=None,
+    reach_stats=False,
+    buffer_mode="vector",
+    profile_stage=None,
+    resume=None,
+):
+    """
+    Is the main function of the script.
+
+    Calls all other functions and excecutes the program.
+
+    Parameters (inputs)
+    -------------------
+    ndvi_threshold, ndvi_block_size, stats_engine, make_report, tile_size, tile_workers,
+    buffer_workers, cache_dir, cache_size_mb, sweep_thresholds, precision, cog,
+    report_map, vector_format, scenes, composite, zonal, zone_field, reach_stats,
+    buffer_mode, profile_stage
+        Options passed on to run_pipeline(). See run_pipeline() for descriptions.
+
+    resume : str, optional
+        The results directory of an interrupted run to continue with resume_run(),
+        instead of prompting for the inputs. The run continues with the options it was
+        started with, and the other options are ignored. The default is None.
+
+    Returns (outputs)
+    -----------------
+    None.
+    """
+    # 1) Function to read the vector and raster data - John
+    metrics = []
+    with measure_stage(metrics, "load", profile_stage):
+        if resume:
+            data_dict, options = resume_run(resume)
+        else:
+            data_dict = load_data_ui(multiple_watersheds=zonal)
+            options = {
+                "ndvi_threshold": ndvi_threshold,
+                "ndvi_block_size": ndvi_block_size,
+                "stats_engine": stats_engine,
+                "make_report": make_report,
+                "tile_size": tile_size,
+                "tile_workers": tile_workers,
+                "buffer_workers": buffer_workers,
+                "cache_dir": cache_dir,
+                "cache_size_mb": cache_size_mb,
+                "sweep_thresholds": sweep_thresholds,
+                "precision": precision,
+                "cog": cog,
+                "report_map": report_map,
+                "vector_format": vector_format,
+                "scenes": scenes,
+                "composite": composite,
+                "zonal": zonal,
+                "zone_field": zone_field,
+                "reach_stats": reach_stats,
+                "buffer_mode": buffer_mode,
+            }
+
+    # 2) to 7) Functions to perform the analysis and produce the report
+    run_pipeline(
+        data_dict=data_dict,
+        metrics=metrics,
+        profile_stage=profile_stage,
+        resume=bool(resume),
+        **options,
     )
 
 
 # %% run main function
 if __name__ == "__main__":
-    main()
+    args = vars(parse_args())
+    batch = args.pop("batch")
+    workers = args.pop("workers")
+    output_dir = args.pop("output_dir")
+    validate_only = args.pop("validate_only")
+    resume = args.pop("resume")
+    # The analysis runs inside the results directory
+    if args["cache_dir"]:
+        args["cache_dir"] = os.path.abspath(args["cache_dir"])
+    if args["scenes"]:
+        args["scenes"] = [os.path.abspath(scene) for scene in args["scenes"]]
+    if validate_only and batch:
+        summaries = validate_manifest(batch, multiple_watersheds=args["zonal"])
+        if any(summary["Status"] != "valid" for summary in summaries):
+            sys.exit(1)
+    elif validate_only:
+        load_data_ui(validate_only=True, multiple_watersheds=args["zonal"])
+    elif batch:
+        summaries = run_batch(
+            manifest_path=batch, workers=workers, output_dir=output_dir, **args
+        )
+        if any(summary["Status"] != "completed" for summary in summaries):
+            sys.exit(1)
+    else:
+        main(resume=resume, **args)